@@ -1,7 +1,8 @@
 from django.contrib import admin
-from .models import Trip, User, InternationalTrip
+from .models import Trip, User, InternationalTrip, CachedRoute
 
 
 admin.site.register(Trip)
 admin.site.register(User)
-admin.site.register(InternationalTrip)
\ No newline at end of file
+admin.site.register(InternationalTrip)
+admin.site.register(CachedRoute)
@@ -0,0 +1,165 @@
+'''
+The JSON API over both kinds of trips (see the Trip*ApiView views):
+
+    GET    /account/api/trips/?kind=all&fields=id,From,to&cursor=...&limit=...
+    POST   /account/api/trips/   {"trips": [{"country": ..., "From": ..., ...}, ...]}
+    DELETE /account/api/trips/   {"local": [ids], "international": [ids]}
+    DELETE /account/api/trips/<kind>/<id>/
+
+The list is the keyset-paginated timeline of the My Trips page and only
+selects the asked for fields. The created trips go through the same
+forms, Trip.clean() and concurrent routing as the CSV import
+(importer.create_trips()).
+'''
+
+import json
+
+from django.conf import settings
+from . import bulk
+from . import importer
+from . import timeline
+from .models import Trip, InternationalTrip
+
+
+# The fields of a trip in the API. A local trip has its country at both ends.
+FIELDS = ('id', 'kind', 'date', 'first_country', 'From', 'second_country', 'to',
+          'fuel_cost', 'fuel_consumption', 'distance', 'money', 'time', 'status')
+
+# The timeline columns of the API fields.
+COLUMNS = {'first_country': 'country_a', 'second_country': 'country_b'}
+
+
+class ApiError(Exception):
+    ''' A bad request, answered with a 400 and the message. '''
+
+
+def json_body(request):
+    try:
+        return json.loads(request.body.decode('utf-8'))
+    except ValueError:
+        raise ApiError("The body has to be JSON!")
+
+
+def parse_fields(value):
+    ''' The ?fields= of a request as a tuple (all of the FIELDS if it is empty). '''
+
+    if not value:
+        return FIELDS
+
+    fields = tuple(field.strip() for field in value.split(',') if field.strip())
+    unknown = [field for field in fields if field not in FIELDS]
+    if unknown:
+        raise ApiError("Unknown field(s): {}. The fields are {}.".format(", ".join(unknown), ",".join(FIELDS)))
+    return fields
+
+
+def parse_limit(value):
+    page_size, max_page_size = timeline.page_size(), getattr(settings, 'API_MAX_PAGE_SIZE', 100)
+    try:
+        return min(max(int(value), 1), max_page_size) if value else page_size
+    except ValueError:
+        raise ApiError("The limit has to be a number!")
+
+
+def as_json(value):
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    if value is not None and not isinstance(value, (int, str)):
+        return str(value)
+    return value
+
+
+def serialize(row, fields):
+    ''' The API representation of a timeline row. '''
+
+    return {field: as_json(row[COLUMNS.get(field, field)]) for field in fields}
+
+
+def serialize_trip(trip, kind, fields):
+    ''' The API representation of a Trip or InternationalTrip. '''
+
+    row = {column: getattr(trip, column) for column in ('id', 'date', 'From', 'to', 'fuel_cost',
+                                                        'fuel_consumption', 'distance', 'money', 'time', 'status')}
+    row['kind'] = kind
+    if kind == 'local':
+        row['country_a'] = row['country_b'] = trip.country
+    else:
+        row['country_a'], row['country_b'] = trip.first_country, trip.second_country
+
+    return serialize(row, fields)
+
+
+def list_trips(user, kinds, fields, cursor=None, limit=None):
+    # The kind and the countries are always in the timeline rows.
+    columns = [field for field in fields if field not in ('kind',) + tuple(COLUMNS)]
+    try:
+        rows, next_cursor = timeline.timeline(user, kinds, cursor, limit, columns)
+    except timeline.InvalidCursor as e:
+        raise ApiError(str(e))
+
+    return {'results': [serialize(row, fields) for row in rows], 'next': next_cursor}
+
+
+def batch_limit():
+    return getattr(settings, 'API_BATCH_LIMIT', 100)
+
+
+def create_trips(user, items, fields=FIELDS):
+    '''
+    Creates the trips described by the `items` dicts. The kind of a trip is its
+    "kind" or comes from its keys, like the kind of a CSV import from its header.
+    Returns the {"created": [...], "errors": [{"index": ..., "error": ...}]} answer.
+    '''
+
+    if not isinstance(items, list) or not 1 <= len(items) <= batch_limit():
+        raise ApiError("Send between 1 and {} trips!".format(batch_limit()))
+
+    report = importer.ImportReport('api')
+    shapes = {}
+    for index, item in enumerate(items):
+        if not isinstance(item, dict):
+            report.error(index, "Every trip has to be a JSON object!")
+            continue
+
+        kind = item.get('kind')
+        try:
+            if kind == 'local':
+                shape = (Trip, importer.LOCAL_FIELDS, kind)
+            elif kind == 'international':
+                shape = (InternationalTrip, importer.INTERNATIONAL_FIELDS, kind)
+            else:
+                shape = importer.detect_shape(item.keys())
+        except importer.InvalidImportFile:
+            report.error(index, "A trip needs either {} or {}.".format(",".join(importer.LOCAL_FIELDS),
+                                                                      ",".join(importer.INTERNATIONAL_FIELDS)))
+            continue
+        shapes.setdefault(shape[2], (shape, []))[1].append((index, item))
+
+    created = []
+    for kind, ((model, model_fields, kind), rows) in shapes.items():
+        trips = importer.create_trips(user, model, model_fields, rows, report)
+        created += [serialize_trip(trip, kind, fields) for trip in trips]
+
+    return {'created': created,
+            'errors': [{'index': index, 'error': error} for index, error in sorted(report.errors)]}
+
+
+def delete_trips(user, ids):
+    '''
+    Deletes the user's trips with the {"local": [ids], "international": [ids]}
+    ids in one transaction (see accounts.bulk). The ids of other users are ignored.
+    Returns the number of deleted trips.
+    '''
+
+    if not isinstance(ids, dict) or not set(ids) <= set(timeline.KINDS):
+        raise ApiError("Send the ids as {\"local\": [...], \"international\": [...]}!")
+    if sum(len(pks) for pks in ids.values() if isinstance(pks, list)) > batch_limit():
+        raise ApiError("Send at most {} ids!".format(batch_limit()))
+
+    querysets = []
+    for kind, pks in ids.items():
+        if not isinstance(pks, list) or not all(isinstance(pk, int) and not isinstance(pk, bool) for pk in pks):
+            raise ApiError("The ids have to be lists of numbers!")
+        querysets.append(timeline.KINDS[kind].objects.filter(pk__in=pks))
+
+    return bulk.delete_trips(user, querysets)
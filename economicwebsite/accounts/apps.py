@@ -3,3 +3,21 @@ from django.apps import AppConfig
 
 class AccountsConfig(AppConfig):
     name = 'accounts'
+
+    def ready(self):
+        # Connecting the receivers of the trip signals.
+        from . import signals
+
+        # Registering the system checks (the MapQuest key).
+        from . import checks
+
+        # The routing API calls are timed for the /metrics endpoint.
+        from . import metrics, routing
+        routing.add_call_hook(metrics.record_routing_call)
+
+        # The city index and the country table get loaded before the first request
+        # needs them (the rest of the warm-up needs the database, see accounts.warmup).
+        from django.conf import settings
+        if getattr(settings, 'WARMUP_ON_READY', False):
+            from . import warmup
+            warmup.preload()
@@ -0,0 +1,167 @@
+'''
+Prefix autocomplete of the country and city names of the trip forms.
+
+The names are kept in sorted arrays of accent-folded, lowercase keys, so a
+lookup is two binary searches (the range of the keys that start with the
+prefix) plus picking the top k of that range by weight. The weight of a
+name is how many trips use it (the dataset has no populations), and the
+top k of the short, busy prefixes is memoized.
+
+The index is rebuilt when the gazetteer changes. The usage counts (a scan of
+both trip tables) are never counted on the request path: warmup() counts
+them when a worker starts, and once they are older than
+settings.AUTOCOMPLETE_USAGE_TTL seconds a background thread recounts them
+and swaps the rebuilt index in, while the lookups keep using the last one.
+'''
+
+import bisect
+import heapq
+import logging
+import threading
+import time
+import unicodedata
+from collections import Counter
+from functools import lru_cache
+
+from django.conf import settings
+from django.db import connections
+
+from . import countries_info
+from .gazetteer import gazetteer
+
+
+logger = logging.getLogger(__name__)
+
+
+def fold(text):
+    ''' Lowercases the text and strips its accents ("Plovdiv", "plóvdiv" -> "plovdiv"). '''
+
+    decomposed = unicodedata.normalize('NFKD', text.strip().lower())
+    return ''.join(c for c in decomposed if not unicodedata.combining(c))
+
+
+class PrefixIndex:
+    ''' A sorted array of (folded key, name) pairs with a weight per name. '''
+
+    def __init__(self, names, weights):
+        entries = sorted((fold(name), name) for name in names)
+        self.keys = [key for key, name in entries]
+        self.names = [name for key, name in entries]
+        self.weights = [weights.get(key, 0) for key in self.keys]
+        self.top = lru_cache(maxsize=4096)(self._top)
+
+    def _top(self, prefix, limit):
+        start = bisect.bisect_left(self.keys, prefix)
+        end = bisect.bisect_left(self.keys, prefix + '\U0010ffff', start)
+
+        # The most used names first, the alphabetical order breaks the ties.
+        best = heapq.nsmallest(limit, range(start, end), key=lambda i: (-self.weights[i], i))
+        return tuple(self.names[i] for i in best)
+
+    def search(self, prefix, limit):
+        return self.top(fold(prefix), limit)
+
+
+def usage():
+    ''' The number of trips per folded city and country name. '''
+
+    from .models import Trip, InternationalTrip
+
+    counts = Counter()
+    for model, fields in ((Trip, ('From', 'to', 'country')),
+                          (InternationalTrip, ('From', 'to', 'first_country', 'second_country'))):
+        for values in model.objects.values_list(*fields).iterator():
+            counts.update(fold(value) for value in values)
+    return counts
+
+
+def display(name):
+    return name.title()
+
+
+class Autocomplete:
+    ''' The country index plus one city index per country and one over all of the cities. '''
+
+    def __init__(self):
+        # (the gazetteer's index, the usage counts, the prefix indexes)
+        self._state = None
+        # (the usage counts, when they were counted)
+        self._usage = (Counter(), None)
+        self._refreshing = False
+        self._lock = threading.Lock()
+
+    def _build(self, cities, weights):
+        countries = PrefixIndex([display(country) for country in countries_info.countries], weights)
+        per_country = {country: PrefixIndex([display(city) for city in names], weights)
+                       for country, names in cities.items()}
+        everywhere = PrefixIndex({display(city) for names in cities.values() for city in names}, weights)
+        return countries, per_country, everywhere
+
+    def _usage_is_stale(self):
+        counted = self._usage[1]
+        return counted is None or time.monotonic() - counted > getattr(settings, 'AUTOCOMPLETE_USAGE_TTL', 3600)
+
+    def refresh_usage(self):
+        ''' Recounts the usage and swaps in the index rebuilt with it. '''
+
+        try:
+            weights = usage()
+        except Exception:
+            logger.exception("Could not count the autocomplete usage.")
+            # The last counts stay until the next recount is due.
+            weights = self._usage[0]
+
+        cities = gazetteer.index()
+        state = (cities, weights, self._build(cities, weights))
+        with self._lock:
+            self._usage = (weights, time.monotonic())
+            self._state = state
+
+    def _refresh_in_background(self):
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+
+        def refresh():
+            try:
+                self.refresh_usage()
+            finally:
+                connections.close_all()
+                self._refreshing = False
+
+        threading.Thread(target=refresh, name='autocomplete-usage', daemon=True).start()
+
+    def _get_state(self):
+        cities = gazetteer.index()
+        state = self._state
+
+        if state is None or state[0] is not cities:
+            with self._lock:
+                state = self._state
+                if state is None or state[0] is not cities:
+                    # The names change with the gazetteer, the last usage counts are kept.
+                    weights = self._usage[0]
+                    state = self._state = (cities, weights, self._build(cities, weights))
+
+        if self._usage_is_stale():
+            self._refresh_in_background()
+        return state[2]
+
+    def preload(self):
+        ''' Counts the usage and builds the index right away (when a worker starts). '''
+
+        self.refresh_usage()
+
+    def countries(self, prefix, limit):
+        return self._get_state()[0].search(prefix, limit)
+
+    def cities(self, prefix, limit, country=None):
+        countries, per_country, everywhere = self._get_state()
+        if country:
+            index = per_country.get(country.strip().lower())
+            return index.search(prefix, limit) if index else ()
+        return everywhere.search(prefix, limit)
+
+
+autocomplete = Autocomplete()
@@ -0,0 +1,165 @@
+'''
+The routing backends. settings.ROUTING_BACKEND picks the one that
+accounts.routing uses:
+
+    'accounts.backends.MapQuestBackend'    - the MapQuest directions API (the default)
+    'accounts.backends.LocalGraphBackend'  - the road graph in settings.ROAD_GRAPH_DIR, built
+                                             with `manage.py build_road_graph` (out of the
+                                             bundled sample of the Bulgarian roads by default)
+
+Every backend returns routes as the dict that the trip views expect:
+the statuscode key (0 - OK, 402 - impossible route, 602 - unknown location)
+plus the distance (km) and formattedTime keys when a route was found.
+'''
+
+import threading
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+
+def format_time(seconds):
+    seconds = int(round(seconds))
+    return "{:02d}:{:02d}:{:02d}".format(seconds // 3600, seconds % 3600 // 60, seconds % 60)
+
+
+class RoutingBackend:
+    '''
+    The interface of the routing backends.
+    `cacheable` tells accounts.routing whether the answers should go
+    through the route cache.
+    '''
+
+    cacheable = True
+
+    def route(self, origin, origin_country, destination, destination_country):
+        raise NotImplementedError
+
+    async def aroute(self, origin, origin_country, destination, destination_country):
+        return await sync_to_async(self.route, thread_sensitive=False)(
+            origin, origin_country, destination, destination_country)
+
+    def matrix(self, places):
+        '''
+        Routes every ordered pair of the (city, country code) places in as few
+        calls as the backend allows. Returns a dict of (i, j) -> route; the pairs
+        that are left out get routed one by one by accounts.routing.
+        '''
+
+        return {}
+
+
+class MapQuestBackend(RoutingBackend):
+    '''
+    The MapQuest directions API, through the pooled clients in accounts.routing.
+    Without settings.MAPQUEST_KEY every call fails with a RoutingError (the
+    views show it as a form error) and `manage.py check` reports accounts.E001.
+    '''
+
+    def check_key(self):
+        from . import routing
+
+        if not settings.MAPQUEST_KEY:
+            raise routing.RoutingError("The MAPQUEST_KEY environment variable is not set.")
+
+    def route(self, origin, origin_country, destination, destination_country):
+        from . import routing
+
+        self.check_key()
+        return routing.get_client().route(origin, origin_country, destination, destination_country)
+
+    async def aroute(self, origin, origin_country, destination, destination_country):
+        from . import routing
+
+        self.check_key()
+        return await routing.get_async_client().route(origin, origin_country, destination, destination_country)
+
+    def matrix(self, places):
+        from . import routing
+
+        self.check_key()
+        client = routing.get_client()
+        if len(places) <= routing.MATRIX_LIMIT:
+            return client.matrix(places) or {}
+
+        # Every pair of groups (at most MATRIX_LIMIT places together) gets one call.
+        size = routing.MATRIX_LIMIT // 2
+        groups = [list(range(start, min(start + size, len(places)))) for start in range(0, len(places), size)]
+        routes = {}
+        for a in range(len(groups)):
+            for b in range(a + 1, len(groups)):
+                indexes = groups[a] + groups[b]
+                found = client.matrix([places[i] for i in indexes]) or {}
+                for (i, j), route in found.items():
+                    routes[indexes[i], indexes[j]] = route
+        return routes
+
+
+class LocalGraphBackend(RoutingBackend):
+    '''
+    Answers the routes out of the memory-mapped road graph in
+    settings.ROAD_GRAPH_DIR (see accounts.roadgraph), with no network calls.
+    The graph has to be built first with `manage.py build_road_graph`.
+    '''
+
+    cacheable = False
+
+    def __init__(self, path=None):
+        from .roadgraph import RoadGraph
+
+        self.graph = RoadGraph(path or settings.ROAD_GRAPH_DIR)
+
+    def route(self, origin, origin_country, destination, destination_country):
+        source = self.graph.node(origin, origin_country)
+        target = self.graph.node(destination, destination_country)
+
+        if source is None or target is None:
+            return {'statuscode': 602}
+
+        path = self.graph.shortest_path(source, target)
+        if path is None:
+            return {'statuscode': 402}
+
+        length, time = path
+        return {'statuscode': 0, 'distance': length, 'formattedTime': format_time(time)}
+
+    def matrix(self, places):
+        nodes = [self.graph.node(city, country_code) for city, country_code in places]
+        routes = {}
+
+        for i, source in enumerate(nodes):
+            targets = [node for node in nodes if node is not None]
+            found = self.graph.shortest_paths_from(source, targets) if source is not None else {}
+            for j, target in enumerate(nodes):
+                if i == j:
+                    continue
+                if source is None or target is None:
+                    routes[i, j] = {'statuscode': 602}
+                elif target in found:
+                    length, time = found[target]
+                    routes[i, j] = {'statuscode': 0, 'distance': length, 'formattedTime': format_time(time)}
+                else:
+                    routes[i, j] = {'statuscode': 402}
+        return routes
+
+    async def aroute(self, origin, origin_country, destination, destination_country):
+        # The graph search is CPU bound and quick, so there is nothing to await.
+        return self.route(origin, origin_country, destination, destination_country)
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    ''' Returns the process-wide instance of settings.ROUTING_BACKEND. '''
+
+    global _backend
+
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                path = getattr(settings, 'ROUTING_BACKEND', 'accounts.backends.MapQuestBackend')
+                _backend = import_string(path)()
+    return _backend
@@ -0,0 +1,67 @@
+'''
+The bulk delete of trips (the My Trips bulk delete and the JSON API).
+
+Every kind of trip is deleted with one queryset delete() scoped to the user
+(it cascades to the route jobs). The totals receiver in accounts.signals
+would subtract every deleted trip with its own UPDATE, so it is paused with
+signals.totals_paused() and the trips get subtracted from the per-user totals
+in one go (which also invalidates the cached My Trips fragments).
+
+duplicates() finds the trips that `manage.py dedupe_trips` reports (and deletes).
+'''
+
+from django.db import transaction
+
+from economicwebsite.database import retry_on_lock
+
+from . import signals, totals
+from .gazetteer import normalize
+
+
+@retry_on_lock
+def delete_trips(user, querysets):
+    '''
+    Deletes the user's trips in the querysets (one per kind of trip) in one
+    transaction. Only the user's own trips get deleted, whatever the
+    querysets say. Returns the number of deleted trips.
+    '''
+
+    deleted = 0
+    with transaction.atomic():
+        for queryset in querysets:
+            model = queryset.model
+            queryset = queryset.filter(user=user).order_by()
+
+            # What the trips added to the totals (the rows are locked where the DB supports it).
+            rows = list(queryset.select_for_update().values_list('distance', 'money', 'time'))
+            if not rows:
+                continue
+
+            # Only the primary keys are fetched for the cascade and the post_delete signals.
+            with signals.totals_paused():
+                queryset.only('pk', 'user').delete()
+
+            totals.add(user.pk, model, -len(rows),
+                       -sum(row[0] for row in rows),
+                       -sum(row[1] for row in rows),
+                       -sum(totals.time_to_seconds(row[2]) for row in rows))
+            deleted += len(rows)
+
+    return deleted
+
+
+def duplicates(model):
+    '''
+    The trips of the model that only differ from an older trip of the same user
+    in case or whitespace, as (trip, pk of the older trip) pairs. Only reads the
+    pk, user, From and to columns, so it also works before the migration that
+    added the lookup keys (0007_trip_lookup_keys, which has its own copy).
+    '''
+
+    first = {}
+    for trip in model.objects.exclude(user=None).order_by('pk').only('pk', 'user', 'From', 'to').iterator():
+        key = (trip.user_id, normalize(trip.From), normalize(trip.to))
+        if key in first:
+            yield trip, first[key]
+        else:
+            first[key] = trip.pk
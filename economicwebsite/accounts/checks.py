@@ -0,0 +1,19 @@
+'''
+The system checks of the accounts app (run by `manage.py check` and at startup).
+'''
+
+from django.conf import settings
+from django.core.checks import Error, register
+
+
+@register()
+def check_routing_key(app_configs, **kwargs):
+    ''' The MapQuest backend can't route anything without an API key. '''
+
+    backend = getattr(settings, 'ROUTING_BACKEND', 'accounts.backends.MapQuestBackend')
+    if backend == 'accounts.backends.MapQuestBackend' and not settings.MAPQUEST_KEY:
+        return [Error("MAPQUEST_KEY is not set, so no trip can be routed.",
+                      hint="Set the MAPQUEST_KEY environment variable (or use the "
+                           "accounts.backends.LocalGraphBackend ROUTING_BACKEND).",
+                      id='accounts.E001')]
+    return []
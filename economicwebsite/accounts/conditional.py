@@ -0,0 +1,76 @@
+'''
+The validators of the conditional GETs (ETag / Last-Modified) of the
+My Trips and Profile pages, for django.views.decorators.http.condition().
+
+They come out of the user's TripTotals row (one primary key lookup): the
+trip counts and the time that any of the trips last changed. Creating,
+updating or deleting a trip changes that row, deletions included (which
+the latest trip date alone would miss). The ETags also cover the rest
+of what the pages show: the user, the avatar in the navigation and the
+CSRF cookie that the forms' tokens are made for.
+
+A validator of None turns the conditional handling off for the request:
+for anonymous users and while there are messages to show.
+'''
+
+import hashlib
+
+from django.conf import settings
+from django.contrib import messages
+from django.views.decorators.http import condition
+
+from avatar.models import Avatar
+
+from .models import TripTotals
+
+
+def trips_state(request):
+    ''' The (trips, international trips, updated) of the user, cached on the request. '''
+
+    if not hasattr(request, '_trips_state'):
+        request._trips_state = TripTotals.objects.filter(user=request.user) \
+                                                 .values_list('trips', 'international_trips', 'updated').first()
+    return request._trips_state
+
+
+def is_conditional(request):
+    return request.user.is_authenticated and not len(messages.get_messages(request))
+
+
+def avatar_state(user):
+    '''
+    The (id, date uploaded) of the avatar that the pages show, cached on the user
+    for the request. It is read from the Avatar table every time (one query on the
+    user's index), so every worker sees a new avatar right away.
+    '''
+
+    if not hasattr(user, '_avatar_state'):
+        user._avatar_state = Avatar.objects.filter(user=user).order_by('-primary', '-date_uploaded') \
+                                           .values_list('id', 'date_uploaded').first()
+    return user._avatar_state
+
+
+def make_etag(request, *parts):
+    user = request.user
+    raw = "|".join(str(part) for part in (
+        request.get_full_path(), user.pk, user.username, user.email,
+        request.COOKIES.get(settings.CSRF_COOKIE_NAME, ''),
+        avatar_state(user), trips_state(request)) + parts)
+
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+
+def trips_etag(request, *args, **kwargs):
+    if is_conditional(request):
+        return make_etag(request)
+
+
+def trips_last_modified(request, *args, **kwargs):
+    if not is_conditional(request) or trips_state(request) is None:
+        return None
+
+    avatar = avatar_state(request.user)
+    return max(trips_state(request)[2], avatar[1]) if avatar else trips_state(request)[2]
+
+
+trips_condition = condition(etag_func=trips_etag, last_modified_func=trips_last_modified)
@@ -0,0 +1,113 @@
+'''
+The what-if cost table of a route: the money of the trip at every fuel cost
+and fuel consumption of two ranges, for a routed trip of the user or for a
+route that is already known (the route cache or the local road graph), so
+it never makes an upstream routing call.
+
+The grid is one NumPy broadcast over integer cents:
+
+    money[i, j] = consumptions[i] * distance * cents[j] // 10000
+
+which truncates exactly like models.calculate_money() does with the Decimal
+fuel cost (float math could come out a cent below an exact price).
+'''
+
+from decimal import Decimal
+
+import numpy as np
+from django.conf import settings
+
+from . import countries_info
+from . import routing
+from .backends import get_backend
+from .models import ROUTED
+
+
+# (start, stop, step) of the fuel costs (€/l) and of the fuel consumptions (l/100km), both ends included.
+DEFAULT_COSTS = (Decimal('1.00'), Decimal('3.00'), Decimal('0.25'))
+DEFAULT_CONSUMPTIONS = (4, 12, 1)
+
+
+class GridError(Exception):
+    ''' Raised when there is no route to price or the ranges are invalid. '''
+
+
+def max_cells():
+    return getattr(settings, 'COST_GRID_MAX_CELLS', 2500)
+
+
+def to_cents(value):
+    return int(value * 100)
+
+
+def axis(start, stop, step):
+    ''' The inclusive range as an int64 array (costs in cents). '''
+
+    if step <= 0:
+        raise GridError("The step of a range has to be positive!")
+    if start > stop:
+        raise GridError("The start of a range has to be before its end!")
+
+    return np.arange(start, stop + 1, step, dtype=np.int64)
+
+
+def grid(distance, cents, consumptions):
+    ''' The (consumptions x fuel costs) int64 array of the money of a `distance` km trip. '''
+
+    return consumptions[:, np.newaxis] * np.int64(distance) * cents[np.newaxis, :] // 10000
+
+
+def build(distance, costs=DEFAULT_COSTS, consumptions=DEFAULT_CONSUMPTIONS):
+    '''
+    The cost table as a dict: the fuel costs (as strings, so no float rounding shows),
+    the fuel consumptions and the money rows (one per consumption).
+    '''
+
+    cents = axis(*(to_cents(value) for value in costs))
+    litres = axis(*consumptions)
+    if len(cents) * len(litres) > max_cells():
+        raise GridError("The table can have at most {} cells!".format(max_cells()))
+
+    money = grid(distance, cents, litres)
+
+    return {
+        'distance': distance,
+        'fuel_costs': [str(Decimal(int(cent)).scaleb(-2)) for cent in cents],
+        'fuel_consumptions': litres.tolist(),
+        'money': money.tolist(),
+    }
+
+
+def trip_distance(model, user, pk):
+    ''' The distance of a routed trip of the user. '''
+
+    trip = model.objects.filter(user=user, pk=pk).values_list('distance', 'status').first()
+    if trip is None:
+        raise GridError("There is no such trip!")
+    if trip[1] != ROUTED:
+        raise GridError("The trip has no route yet!")
+
+    return trip[0]
+
+
+def route_distance(origin, origin_country, destination, destination_country):
+    '''
+    The distance of a route that is already known: from the route cache, or from
+    the backend when it isn't cached (the local graph, which is no upstream call).
+    '''
+
+    for country in (origin_country, destination_country):
+        if country.lower() not in countries_info.countries:
+            raise GridError("A country with the name of {} does not exist in our data set!".format(country.capitalize()))
+
+    locations = (origin, countries_info.countries[origin_country.lower()],
+                 destination, countries_info.countries[destination_country.lower()])
+
+    backend = get_backend()
+    route = routing.get_cached_route(*locations) if backend.cacheable else backend.route(*locations)
+    if route is None:
+        raise GridError("This route hasn't been calculated yet, save the trip first!")
+    if route['statuscode'] != 0:
+        raise GridError("There is no route between {} and {}!".format(origin, destination))
+
+    return int(route['distance'])
@@ -0,0 +1,103 @@
+'''
+The export of a user's trips as CSV or NDJSON (one JSON object per line).
+
+The rows are streamed: every kind of trip is read with values_list()
+and a chunked iterator() (served by the (user, -date) indexes), the two
+kinds are merged by date, newest first, and the lines are sent in
+batches, optionally through a streaming gzip compressor. The memory use
+doesn't depend on the number of trips.
+'''
+
+import csv
+import heapq
+import json
+import zlib
+
+from . import timeline
+from .models import Trip, InternationalTrip
+
+
+COLUMNS = ('kind', 'date', 'first_country', 'From', 'second_country', 'to',
+           'fuel_cost', 'fuel_consumption', 'distance', 'money', 'time')
+
+# A local trip has the same country at both ends.
+FIELDS = {
+    'local': (Trip, ('date', 'country', 'From', 'country', 'to',
+                     'fuel_cost', 'fuel_consumption', 'distance', 'money', 'time')),
+    'international': (InternationalTrip, ('date', 'first_country', 'From', 'second_country', 'to',
+                                          'fuel_cost', 'fuel_consumption', 'distance', 'money', 'time')),
+}
+
+CHUNK_SIZE = 2000
+LINES_PER_WRITE = 200
+
+
+def rows(user, kinds=('local', 'international'), since=None, until=None, country=None):
+    ''' The (kind, date, ...) tuples of the user's trips (see COLUMNS), newest first. '''
+
+    streams = []
+    for kind in kinds:
+        model, fields = FIELDS[kind]
+        queryset = timeline.filtered(kind, user, since, until, country)
+
+        values = queryset.order_by('-date', '-id').values_list(*fields).iterator(chunk_size=CHUNK_SIZE)
+        streams.append(((kind,) + row for row in values))
+
+    return heapq.merge(*streams, key=lambda row: row[1], reverse=True)
+
+
+class Echo:
+    ''' A file-like object for csv.writer that returns the written line instead of buffering it. '''
+
+    def write(self, value):
+        return value
+
+
+def csv_lines(rows):
+    writer = csv.writer(Echo())
+    yield writer.writerow(COLUMNS)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def ndjson_lines(rows):
+    for row in rows:
+        data = dict(zip(COLUMNS, row))
+        data['date'] = data['date'].isoformat()
+        data['fuel_cost'] = str(data['fuel_cost'])
+        yield json.dumps(data) + "\n"
+
+
+LINES = {
+    'csv': csv_lines,
+    'ndjson': ndjson_lines,
+}
+
+
+def batched(lines, size=LINES_PER_WRITE):
+    ''' Joins the lines into bigger chunks, a write per line would be mostly overhead. '''
+
+    batch = []
+    for line in lines:
+        batch.append(line)
+        if len(batch) >= size:
+            yield "".join(batch).encode('utf-8')
+            batch = []
+    if batch:
+        yield "".join(batch).encode('utf-8')
+
+
+def gzipped(chunks):
+    compressor = zlib.compressobj(wbits=16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def stream(rows, format='csv', gzip=False):
+    ''' The byte chunks of the export of `rows` in the format. '''
+
+    chunks = batched(LINES[format](rows))
+    return gzipped(chunks) if gzip else chunks
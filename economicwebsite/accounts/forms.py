@@ -1,10 +1,14 @@
 from django import forms
-from .models import User, Trip
+from django.conf import settings
+from .models import User, Trip, InternationalTrip
+from . import countries_info
 
 from django.contrib.auth import get_user_model
 from django.contrib.auth.forms import UserCreationForm
 
 from django.core.validators import RegexValidator
+from decimal import Decimal
+import uuid
 
 # A validation for the username, because the default validation accepts all unicode characters.
 alphanumeric = RegexValidator(r'^[0-9a-zA-Z_]*$', 'Only English alphabetic characters, underscores and/or numbers are allowed.')
@@ -43,4 +47,157 @@ class UserCreateForm(UserCreationForm):
 #         super().__init__(*args, **kwargs)
         
 #         self.fields['town_1'].label = "From"
-#         self.fields['town_2'].label = "To"
\ No newline at end of file
+#         self.fields['town_2'].label = "To"
+
+class SubmissionTokenMixin(forms.Form):
+    '''
+    A hidden one-time token per rendered form: the trip views claim it (see
+    RoutedTripMixin.claim_token() in accounts.views) before they validate and
+    route the trip, so a double-clicked submission isn't routed twice.
+    '''
+
+    token = forms.CharField(widget=forms.HiddenInput, max_length=32, required=False)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if not self.is_bound:
+            self.initial.setdefault('token', uuid.uuid4().hex)
+
+
+class TripForm(SubmissionTokenMixin, forms.ModelForm):
+
+    class Meta:
+        model = Trip
+        fields = ('country', 'From', 'to', 'fuel_cost', 'fuel_consumption')
+
+
+class InternationalTripForm(SubmissionTokenMixin, forms.ModelForm):
+
+    class Meta:
+        model = InternationalTrip
+        fields = ('first_country', 'From', 'second_country', 'to', 'fuel_cost', 'fuel_consumption')
+
+
+class TripImportForm(forms.Form):
+    ''' The upload form of the bulk trip import (see accounts.importer). '''
+
+    file = forms.FileField(label="CSV file")
+
+
+class RouteMatrixForm(forms.Form):
+    ''' The fuel settings of the distance matrix (the cities are validated by accounts.matrix). '''
+
+    fuel_cost = forms.DecimalField(max_digits=3, decimal_places=2, min_value=Decimal('0.01'))
+    fuel_consumption = forms.IntegerField(min_value=1, max_value=100)
+    save = forms.BooleanField(required=False)
+
+
+class TripFilterForm(forms.Form):
+    ''' The filters of the user's trips (see timeline.filtered()). '''
+
+    kind = forms.ChoiceField(choices=[('all', "All"), ('local', "Local"), ('international', "International")], required=False)
+    since = forms.DateField(required=False)
+    until = forms.DateField(required=False)
+    country = forms.CharField(max_length=60, required=False)
+
+    def clean_country(self):
+        country = self.cleaned_data['country'].strip()
+        if country and country.lower() not in countries_info.countries:
+            raise forms.ValidationError("A country with the name of {} does not exist in our data set!".format(country.capitalize()))
+        return country
+
+    def clean(self):
+        cleaned_data = super().clean()
+        since, until = cleaned_data.get('since'), cleaned_data.get('until')
+        if since and until and since > until:
+            raise forms.ValidationError("The start of the date range has to be before its end!")
+        return cleaned_data
+
+
+class TripExportForm(TripFilterForm):
+    ''' The format and the filters of the trip export (see accounts.export). '''
+
+    format = forms.ChoiceField(choices=[('csv', "CSV"), ('ndjson', "NDJSON")], required=False)
+    gzip = forms.BooleanField(required=False)
+
+
+class BulkDeleteForm(TripFilterForm):
+    '''
+    The bulk delete of My Trips: either the checked trips (the `local` and
+    `international` id lists) or, with `matching`, all of the trips that
+    match the filters.
+    '''
+
+    local = forms.TypedMultipleChoiceField(coerce=int, required=False)
+    international = forms.TypedMultipleChoiceField(coerce=int, required=False)
+    matching = forms.BooleanField(required=False)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Any ids are valid choices, the delete is scoped to the user anyway.
+        for field in ('local', 'international'):
+            self.fields[field].valid_value = lambda value: str(value).isdigit()
+
+    def clean(self):
+        cleaned_data = super().clean()
+        ids = len(cleaned_data.get('local') or ()) + len(cleaned_data.get('international') or ())
+        limit = getattr(settings, 'BULK_DELETE_MAX_IDS', 500)
+
+        if not ids and not cleaned_data.get('matching'):
+            raise forms.ValidationError("Select the trips that you want to delete!")
+        if ids > limit:
+            raise forms.ValidationError("You can delete at most {} selected trips at once!".format(limit))
+        return cleaned_data
+
+
+class RepriceTripsForm(forms.Form):
+    ''' The new fuel cost of the user's trips (all of them or the ones in a country, see accounts.repricing). '''
+
+    fuel_cost = forms.DecimalField(max_digits=3, decimal_places=2, min_value=Decimal('0.01'))
+    country = forms.CharField(max_length=60, required=False)
+
+    clean_country = TripFilterForm.clean_country
+
+
+class CostGridForm(forms.Form):
+    '''
+    The route (a trip of the user: `kind` and `id`, or the cities of a route that is
+    already known) and the ranges of the what-if cost table (see accounts.costgrid).
+    '''
+
+    kind = forms.ChoiceField(choices=[('local', "Local"), ('international', "International")], required=False)
+    id = forms.IntegerField(min_value=1, required=False)
+
+    From = forms.CharField(max_length=60, required=False)
+    from_country = forms.CharField(max_length=60, required=False)
+    to = forms.CharField(max_length=60, required=False)
+    to_country = forms.CharField(max_length=60, required=False)
+
+    cost_from = forms.DecimalField(max_digits=3, decimal_places=2, min_value=Decimal('0.01'), required=False)
+    cost_to = forms.DecimalField(max_digits=3, decimal_places=2, min_value=Decimal('0.01'), required=False)
+    cost_step = forms.DecimalField(max_digits=3, decimal_places=2, min_value=Decimal('0.01'), required=False)
+    consumption_from = forms.IntegerField(min_value=1, max_value=100, required=False)
+    consumption_to = forms.IntegerField(min_value=1, max_value=100, required=False)
+    consumption_step = forms.IntegerField(min_value=1, max_value=100, required=False)
+
+    format = forms.ChoiceField(choices=[('json', "JSON"), ('html', "HTML")], required=False)
+
+    def clean(self):
+        cleaned_data = super().clean()
+        trip = cleaned_data.get('kind') and cleaned_data.get('id')
+        route = all(cleaned_data.get(field) for field in ('From', 'from_country', 'to', 'to_country'))
+
+        if not trip and not route:
+            raise forms.ValidationError("Give a trip (kind and id) or a route (From, from_country, to and to_country)!")
+        return cleaned_data
+
+    def ranges(self, default_costs, default_consumptions):
+        ''' The (start, stop, step) of the fuel costs and of the consumptions, the defaults where not given. '''
+
+        data = self.cleaned_data
+        costs = tuple(default if data.get(field) is None else data[field]
+                      for field, default in zip(('cost_from', 'cost_to', 'cost_step'), default_costs))
+        consumptions = tuple(default if data.get(field) is None else data[field]
+                             for field, default in zip(('consumption_from', 'consumption_to', 'consumption_step'),
+                                                       default_consumptions))
+        return costs, consumptions
@@ -0,0 +1,90 @@
+'''
+A per-user cache of the rendered My Trips fragments (see views.TripSection).
+
+Every fragment key contains the user's version: the time that any of the
+user's trips last changed, out of the TripTotals row that every write of
+trips updates (see accounts.totals, the bulk paths and the repricing
+included). So a user's fragments are invalidated all at once, in every
+worker and by the management commands too, whatever the cache backend,
+instead of finding and deleting them. The old entries simply expire.
+The pages that use the fragments have read the row already for their
+conditional GETs (see accounts.conditional), so it costs no query.
+
+The cards contain CSRF tokens, so the key also contains the CSRF cookie
+that they were rendered for.
+
+The hits and misses are counted in the cache too (see stats() and the
+trip_cache_stats command): with the default LocMemCache those are the
+counters of one worker, with a shared cache the ones of all of them.
+'''
+
+import hashlib
+
+from django.conf import settings
+from django.core.cache import caches
+
+from .conditional import trips_state
+
+
+HITS_KEY = 'trips:fragments:hits'
+MISSES_KEY = 'trips:fragments:misses'
+
+
+def get_cache():
+    return caches[getattr(settings, 'TRIP_FRAGMENT_CACHE', 'default')]
+
+
+def timeout():
+    return getattr(settings, 'TRIP_FRAGMENT_CACHE_TIMEOUT', 24 * 60 * 60)
+
+
+def get_version(request):
+    '''
+    The version of the user's fragments (0 before the first trip). It is read before
+    the trips get rendered, so a fragment is never older than the version it is stored under.
+    '''
+
+    if not request.user.is_authenticated:
+        return 0
+
+    state = trips_state(request)
+    return state[2].timestamp() if state is not None else 0
+
+
+def make_key(request, *parts):
+    csrf = request.COOKIES.get(settings.CSRF_COOKIE_NAME, '')
+    raw = "|".join(str(part) for part in parts + (csrf,))
+    return 'trips:fragment:{}:{}:{}'.format(request.user.pk, get_version(request),
+                                            hashlib.sha1(raw.encode('utf-8')).hexdigest())
+
+
+def count(key):
+    cache = get_cache()
+    try:
+        cache.incr(key)
+    except ValueError:
+        if not cache.add(key, 1, None):
+            cache.incr(key)
+
+
+def get(key):
+    content = get_cache().get(key)
+    count(HITS_KEY if content is not None else MISSES_KEY)
+    return content
+
+
+def store(key, content):
+    get_cache().set(key, content, timeout())
+
+
+def stats():
+    ''' The hit/miss counters of the fragment cache (see the module docstring). '''
+
+    hits = get_cache().get(HITS_KEY, 0)
+    misses = get_cache().get(MISSES_KEY, 0)
+    total = hits + misses
+    return {'hits': hits, 'misses': misses, 'hit_rate': hits / total if total else None}
+
+
+def reset_stats():
+    get_cache().delete_many([HITS_KEY, MISSES_KEY])
@@ -0,0 +1,101 @@
+import csv
+import logging
+import os
+import threading
+import time
+
+from django.conf import settings
+
+
+logger = logging.getLogger(__name__)
+
+
+def normalize(name):
+    ''' Normalizes a city/country name the way it is stored in the index. '''
+
+    return name.strip().lower()
+
+
+class Gazetteer:
+    '''
+    A process-wide, in-memory index of the cities in the countries.csv
+    file (one column per country, one city per cell).
+
+    The file is parsed once (on first use or on preload()) into a dict of
+    country -> set of city names, so membership checks are O(1).
+    The file's mtime is re-checked at most every `check_interval` seconds
+    and the index is rebuilt when it has changed.
+    '''
+
+    def __init__(self, path=None, check_interval=5):
+        self._path = path
+        self.check_interval = check_interval
+        self._index = None
+        self._mtime = None
+        self._checked_at = 0
+        self._lock = threading.Lock()
+
+    @property
+    def path(self):
+        if self._path is None:
+            return getattr(settings, 'GAZETTEER_PATH', os.path.join(settings.BASE_DIR, 'countries.csv'))
+        return self._path
+
+    def _file_mtime(self):
+        try:
+            return os.stat(self.path).st_mtime
+        except OSError:
+            return None
+
+    def _build(self):
+        index = {}
+        try:
+            with open(self.path, "r") as f:
+                for row in csv.DictReader(f):
+                    for header, value in row.items():
+                        if header is None or not value:
+                            continue
+                        index.setdefault(normalize(header), set()).add(normalize(value))
+        except OSError:
+            logger.exception("Could not read the gazetteer file %s.", self.path)
+
+        if not index:
+            # Every city would be rejected as unknown.
+            logger.error("The gazetteer %s has no cities.", self.path)
+        return index
+
+    def _get_index(self):
+        now = time.monotonic()
+        if self._index is not None and now - self._checked_at < self.check_interval:
+            return self._index
+
+        with self._lock:
+            mtime = self._file_mtime()
+            if self._index is None or mtime != self._mtime:
+                self._index = self._build()
+                self._mtime = mtime
+            self._checked_at = time.monotonic()
+            return self._index
+
+    def preload(self):
+        ''' Builds the index eagerly (e.g. at startup). '''
+
+        self._get_index()
+
+    def index(self):
+        ''' Returns the current country -> set of cities dict (rebuilt, not mutated, on changes). '''
+
+        return self._get_index()
+
+    def cities(self, country):
+        ''' Returns the set of (normalized) cities in a country. '''
+
+        return self._get_index().get(normalize(country), frozenset())
+
+    def contains(self, country, city):
+        ''' Checks whether the city is in that country. '''
+
+        return normalize(city) in self.cities(country)
+
+
+gazetteer = Gazetteer()
@@ -0,0 +1,186 @@
+'''
+Bulk import of trips from a CSV file (the upload view and the
+import_trips management command both use import_trips(), the JSON API
+uses create_trips() directly).
+
+The CSV has a header row and is either in the local shape:
+
+    country,From,to,fuel_cost,fuel_consumption
+
+or in the international one:
+
+    first_country,From,second_country,to,fuel_cost,fuel_consumption
+
+Every row is validated like the trip forms do (countries, the gazetteer,
+the field validators), the routes are fetched concurrently (see
+routing.get_routes()) and the trips are inserted with bulk_create.
+'''
+
+import csv
+import io
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.forms import modelform_factory
+
+from economicwebsite.database import retry_on_lock
+
+from . import routing
+from . import totals
+from .gazetteer import normalize
+from .models import Trip, InternationalTrip, DUPLICATE_TRIP, TOO_SHORT_TRIP
+
+
+LOCAL_FIELDS = ['country', 'From', 'to', 'fuel_cost', 'fuel_consumption']
+INTERNATIONAL_FIELDS = ['first_country', 'From', 'second_country', 'to', 'fuel_cost', 'fuel_consumption']
+
+
+class InvalidImportFile(Exception):
+    ''' Raised when the file as a whole can't be imported. '''
+
+
+class ImportReport:
+    ''' The outcome of an import: the number of created trips and the errors per CSV line. '''
+
+    def __init__(self, kind):
+        self.kind = kind
+        self.created = 0
+        self.errors = []
+
+    def error(self, line, message):
+        self.errors.append((line, message))
+
+    def __str__(self):
+        return "{} {} trip(s) created, {} row(s) with errors.".format(self.created, self.kind, len(self.errors))
+
+
+def detect_shape(fieldnames):
+    ''' Returns the (model, fields, kind) of the CSV by its header. '''
+
+    fieldnames = set(fieldnames or ())
+    if set(INTERNATIONAL_FIELDS) <= fieldnames:
+        return InternationalTrip, INTERNATIONAL_FIELDS, 'international'
+    if set(LOCAL_FIELDS) <= fieldnames:
+        return Trip, LOCAL_FIELDS, 'local'
+
+    raise InvalidImportFile("The CSV header has to contain either {} or {}."
+                            .format(",".join(LOCAL_FIELDS), ",".join(INTERNATIONAL_FIELDS)))
+
+
+def first_error(form):
+    for errors in form.errors.values():
+        return errors[0]
+
+
+def create_trips(user, model, fields, rows, report, workers=None, batch_size=None):
+    '''
+    Validates, routes and inserts the trips of one kind. `rows` are
+    (line, {field: value}) pairs and the errors are reported by line.
+    Returns the created trips.
+    '''
+
+    form_class = modelform_factory(model, fields=fields)
+
+    # The trips that the user already has (the from_key/to_key unique index).
+    seen = set(model.objects.filter(user=user).values_list('from_key', 'to_key'))
+
+    trips = []
+    for line, row in rows:
+        form = form_class({field: str(row.get(field) or '').strip() for field in fields})
+        if not form.is_valid():
+            report.error(line, first_error(form))
+            continue
+
+        trip = form.save(commit=False)
+        key = (normalize(trip.From), normalize(trip.to))
+        if key in seen:
+            report.error(line, DUPLICATE_TRIP)
+            continue
+
+        seen.add(key)
+        trips.append((line, trip))
+
+    routes = routing.get_routes([trip.locations() for line, trip in trips], workers=workers)
+
+    routed = []
+    for line, trip in trips:
+        route = routes[trip.locations()]
+        if isinstance(route, routing.RoutingError):
+            report.error(line, "We couldn't calculate this trip, please try again later!")
+        elif route['statuscode'] == 402:
+            report.error(line, "It is impossible to travel by a car from {} to {}".format(trip.From.title(), trip.to.title()))
+        elif 'distance' not in route:
+            report.error(line, "One of the cities does not exist in our data set!")
+        else:
+            trip.set_route(route)
+            trip.user = user
+            # bulk_create() skips the check of InternationalTrip.save().
+            if not trip.is_saved():
+                report.error(line, TOO_SHORT_TRIP)
+                continue
+            routed.append((line, trip))
+
+    duplicates = save_trips(user, model, [trip for line, trip in routed], batch_size)
+    for line, trip in routed:
+        if trip in duplicates:
+            report.error(line, DUPLICATE_TRIP)
+
+    created = [trip for line, trip in routed if trip not in duplicates]
+    report.created += len(created)
+    return created
+
+
+@retry_on_lock
+def save_trips(user, model, trips, batch_size=None):
+    '''
+    Inserts the routed trips and adds them to the user's totals, in one transaction.
+    Returns the trips that weren't inserted because the user got the same trip
+    in the meantime (e.g. a form submission that raced the import).
+    '''
+
+    batch_size = batch_size or getattr(settings, 'IMPORT_BATCH_SIZE', 500)
+    try:
+        with transaction.atomic():
+            model.objects.bulk_create(trips, batch_size=batch_size)
+            totals.add_trips(user, model, trips)
+        return []
+    except IntegrityError:
+        pass
+
+    # One of them is a duplicate now, so the trips are inserted one by one (each in a savepoint).
+    saved, duplicates = [], []
+    with transaction.atomic():
+        for trip in trips:
+            trip.pk = None
+            try:
+                with transaction.atomic():
+                    model.objects.bulk_create([trip])
+            except IntegrityError:
+                duplicates.append(trip)
+            else:
+                saved.append(trip)
+        totals.add_trips(user, model, saved)
+
+    return duplicates
+
+
+def import_trips(user, file, workers=None, batch_size=None):
+    '''
+    Imports the trips in the CSV `file` (a text file object) for the user.
+    Returns an ImportReport.
+    '''
+
+    reader = csv.DictReader(file)
+    model, fields, kind = detect_shape(reader.fieldnames)
+    report = ImportReport(kind)
+
+    create_trips(user, model, fields, enumerate(reader, start=2), report, workers, batch_size)
+
+    report.errors.sort()
+    return report
+
+
+def import_uploaded_file(user, uploaded_file, **kwargs):
+    ''' import_trips() for a Django UploadedFile (which is opened in binary mode). '''
+
+    return import_trips(user, io.TextIOWrapper(uploaded_file.file, encoding='utf-8-sig'), **kwargs)
@@ -0,0 +1,29 @@
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from accounts import roadgraph
+
+
+class Command(BaseCommand):
+    help = ("Builds the memory-mapped road graph of the LocalGraphBackend out of nodes/edges/places CSV files "
+            "(the bundled sample of the Bulgarian roads when they are left out).")
+
+    def add_arguments(self, parser):
+        sample = roadgraph.SAMPLE_DIR
+        parser.add_argument('nodes', nargs='?', default=os.path.join(sample, 'nodes.csv'),
+                            help="CSV with the id,lat,lon columns.")
+        parser.add_argument('edges', nargs='?', default=os.path.join(sample, 'edges.csv'),
+                            help="CSV with the source,target,length_km,time_s[,oneway] columns.")
+        parser.add_argument('places', nargs='?', default=os.path.join(sample, 'places.csv'),
+                            help="CSV with the city,country_code,node columns.")
+        parser.add_argument('--output', default=None,
+                            help="The graph directory (settings.ROAD_GRAPH_DIR by default).")
+
+    def handle(self, *args, **options):
+        path = options['output'] or settings.ROAD_GRAPH_DIR
+        nodes, edges = roadgraph.build(options['nodes'], options['edges'], options['places'], path)
+
+        self.stdout.write(self.style.SUCCESS(
+            "Built a road graph with {} nodes and {} edges in {}.".format(nodes, edges, path)))
@@ -0,0 +1,47 @@
+import os
+
+from django.conf import settings
+from django.contrib.staticfiles import finders
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.module_loading import import_string
+
+from economicwebsite.storage import PipelineStaticFilesStorage
+
+
+class Command(BaseCommand):
+    help = ("Builds the static files: collectstatic through economicwebsite.storage (minified, "
+            "content-hashed, precompressed, WebP) and a report of the sizes.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clear', action='store_true', help="Delete the old STATIC_ROOT files first.")
+
+    def handle(self, *args, **options):
+        storage_class = import_string(settings.STATICFILES_STORAGE)
+        if not issubclass(storage_class, PipelineStaticFilesStorage):
+            raise CommandError("Set STATICFILES_STORAGE to 'economicwebsite.storage.PipelineStaticFilesStorage'.")
+
+        call_command('collectstatic', interactive=False, clear=options['clear'], verbosity=0)
+
+        # A new storage, which loads the manifest that collectstatic has just written.
+        manifest = storage_class().hashed_files
+        source_total = served_total = 0
+        for name, hashed_name in sorted(manifest.items()):
+            source = os.path.getsize(finders.find(name))
+            served = os.path.join(settings.STATIC_ROOT, hashed_name)
+            siblings = ["{} {}".format(suffix, self.size(os.path.getsize(served + suffix)))
+                        for suffix in ('.br', '.gz', '.webp') if os.path.exists(served + suffix)]
+            smallest = min([os.path.getsize(served + suffix) for suffix in ('.br', '.gz', '.webp')
+                            if os.path.exists(served + suffix)] + [os.path.getsize(served)])
+
+            source_total += source
+            served_total += smallest
+            if options['verbosity'] >= 2:
+                self.stdout.write("{}  {} -> {}  {}".format(hashed_name, self.size(source), self.size(os.path.getsize(served)),
+                                                      "  ".join(siblings)))
+
+        self.stdout.write(self.style.SUCCESS("Built {} file(s): {} -> {} over the wire.".format(
+            len(manifest), self.size(source_total), self.size(served_total))))
+
+    def size(self, n):
+        return "{:.1f} KB".format(n / 1024)
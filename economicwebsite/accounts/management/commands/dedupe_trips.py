@@ -0,0 +1,34 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+
+from accounts import bulk
+from accounts.models import Trip, InternationalTrip
+
+
+class Command(BaseCommand):
+    help = ("Lists the trips that only differ from an older trip of the same user in case or whitespace "
+            "(they stop the 0007_trip_lookup_keys migration) and, with --delete, deletes them.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--delete', action='store_true',
+                            help="Delete the listed trips (and subtract them from their users' totals).")
+
+    def handle(self, *args, **options):
+        found = {}
+        for model in (Trip, InternationalTrip):
+            for trip, original in bulk.duplicates(model):
+                self.stdout.write("{} {} of user {}: {!r} -> {!r} (same as {} {})".format(
+                    model.__name__, trip.pk, trip.user_id, trip.From, trip.to, model.__name__, original))
+                found.setdefault(trip.user_id, {}).setdefault(model, []).append(trip.pk)
+
+        count = sum(len(pks) for trips in found.values() for pks in trips.values())
+        if not options['delete']:
+            self.stdout.write("Found {} duplicate trip(s), run with --delete to delete them.".format(count))
+            return
+
+        users = get_user_model().objects.in_bulk(list(found))
+        deleted = 0
+        for user_id, trips in found.items():
+            deleted += bulk.delete_trips(users[user_id], [model.objects.filter(pk__in=pks) for model, pks in trips.items()])
+
+        self.stdout.write(self.style.SUCCESS("Deleted {} duplicate trip(s).".format(deleted)))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from accounts import route_cache
+
+
+class Command(BaseCommand):
+    help = ("Deletes the expired routes and the least recently used ones above ROUTE_CACHE_MAX_ENTRIES "
+            "from the route cache (for a periodic job, e.g. with ROUTE_CACHE_EVICT_EVERY = 0).")
+
+    def handle(self, *args, **options):
+        self.stdout.write("Evicted {} route(s).".format(route_cache.evict()))
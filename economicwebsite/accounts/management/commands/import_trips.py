@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from accounts import importer
+from accounts.models import User
+
+
+class Command(BaseCommand):
+    help = "Imports the trips in a CSV file (local or international shape) for a user."
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="The CSV file.")
+        parser.add_argument('--user', required=True, help="The username of the owner of the trips.")
+        parser.add_argument('--workers', type=int, default=None,
+                            help="Routing threads (settings.ROUTING_BULK_WORKERS by default).")
+        parser.add_argument('--batch-size', type=int, default=None,
+                            help="Rows per INSERT (settings.IMPORT_BATCH_SIZE by default).")
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options['user'])
+        except User.DoesNotExist:
+            raise CommandError("There is no user with the username {}.".format(options['user']))
+
+        try:
+            with open(options['path'], encoding='utf-8-sig', newline='') as f:
+                report = importer.import_trips(user, f, workers=options['workers'],
+                                               batch_size=options['batch_size'])
+        except (OSError, importer.InvalidImportFile) as e:
+            raise CommandError(str(e))
+
+        for line, message in report.errors:
+            self.stderr.write("Line {}: {}".format(line, message))
+        self.stdout.write(self.style.SUCCESS(str(report)))
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from accounts import totals
+from accounts.models import User
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the per-user trip totals (shown on the profile) from the trip tables."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', default=None, help="Only rebuild the totals of this username.")
+
+    def handle(self, *args, **options):
+        user = None
+        if options['user']:
+            try:
+                user = User.objects.get(username=options['user'])
+            except User.DoesNotExist:
+                raise CommandError("There is no user with the username {}.".format(options['user']))
+
+        rows = totals.rebuild(user=user)
+
+        self.stdout.write(self.style.SUCCESS("Rebuilt the trip totals of {} user(s).".format(rows)))
@@ -0,0 +1,42 @@
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+
+from accounts import countries_info, repricing
+from accounts.models import User
+
+
+class Command(BaseCommand):
+    help = ("Reprices the saved trips at a new fuel cost (all of them, or the ones of --user "
+            "and/or --country) in batches of set-based UPDATEs, without routing them again.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('fuel_cost', help="The new fuel cost per litre, e.g. 1.75.")
+        parser.add_argument('--user', default=None, help="Only reprice the trips of this username.")
+        parser.add_argument('--country', default=None, help="Only reprice the trips in this country (at either end).")
+        parser.add_argument('--batch-size', type=int, default=None,
+                            help="Trips per UPDATE (settings.REPRICE_BATCH_SIZE by default).")
+
+    def handle(self, *args, **options):
+        user = None
+        if options['user']:
+            try:
+                user = User.objects.get(username=options['user'])
+            except User.DoesNotExist:
+                raise CommandError("There is no user with the username {}.".format(options['user']))
+
+        country = options['country']
+        if country and country.strip().lower() not in countries_info.countries:
+            raise CommandError("A country with the name of {} does not exist in our data set!".format(country))
+
+        batch_size = options['batch_size'] or getattr(settings, 'REPRICE_BATCH_SIZE', 5000)
+        if batch_size < 1:
+            raise CommandError("The batch size has to be positive.")
+
+        try:
+            repriced = repricing.reprice(options['fuel_cost'], user=user, country=country and country.strip(),
+                                         batch_size=batch_size)
+        except ValidationError as e:
+            raise CommandError("Invalid fuel cost: {}".format(" ".join(e.messages)))
+
+        self.stdout.write(self.style.SUCCESS("Repriced {} trip(s) at {}.".format(repriced, options['fuel_cost'])))
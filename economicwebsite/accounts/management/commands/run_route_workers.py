@@ -0,0 +1,48 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import DatabaseError
+
+from accounts import route_queue
+
+
+class Command(BaseCommand):
+    help = "Works off the background routing queue (settings.ROUTING_QUEUE) of the pending trips."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=None,
+                            help="Routing threads (settings.ROUTING_BULK_WORKERS by default).")
+        parser.add_argument('--batch-size', type=int, default=None,
+                            help="Jobs claimed per round (settings.ROUTE_QUEUE_BATCH_SIZE by default).")
+        parser.add_argument('--poll', type=float, default=None,
+                            help="Seconds to wait when the queue is empty (settings.ROUTE_QUEUE_POLL by default).")
+        parser.add_argument('--once', action='store_true', help="Exit once there are no due jobs left.")
+
+    def handle(self, *args, **options):
+        poll = options['poll'] or getattr(settings, 'ROUTE_QUEUE_POLL', 1.0)
+        worker = route_queue.worker_name()
+        self.stdout.write("Route worker {} started.".format(worker))
+
+        try:
+            while True:
+                try:
+                    route_queue.requeue_stale()
+                    routed, retried, failed = route_queue.run_once(worker, options['batch_size'], options['workers'])
+                except DatabaseError as e:
+                    # E.g. the database is locked or restarting: the claimed jobs go back to the queue
+                    # after the lock timeout, and the worker tries again after a poll.
+                    self.stderr.write("Route worker {} round failed: {}".format(worker, e))
+                    time.sleep(poll)
+                    continue
+
+                if routed or retried or failed:
+                    self.stdout.write("Routed {}, retrying {}, failed {}.".format(routed, retried, failed))
+                elif options['once']:
+                    break
+                else:
+                    time.sleep(poll)
+        except KeyboardInterrupt:
+            pass
+
+        self.stdout.write(self.style.SUCCESS("Route worker {} stopped.".format(worker)))
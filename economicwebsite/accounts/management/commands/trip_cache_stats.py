@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from accounts import fragments
+
+
+class Command(BaseCommand):
+    help = "Shows the hit/miss counters of the My Trips fragment cache."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true', help="Zero the counters after showing them.")
+
+    def handle(self, *args, **options):
+        stats = fragments.stats()
+        hit_rate = "-" if stats['hit_rate'] is None else "{:.1%}".format(stats['hit_rate'])
+
+        self.stdout.write("hits: {hits}  misses: {misses}  hit rate: {rate}".format(rate=hit_rate, **stats))
+
+        if options['reset']:
+            fragments.reset_stats()
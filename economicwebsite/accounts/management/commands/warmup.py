@@ -0,0 +1,53 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from accounts import warmup
+
+
+class Command(BaseCommand):
+    help = ("Warms this process up like a starting server (see accounts.warmup) and shows "
+            "what every step cost. Use --imports for the report of the slowest imports.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--routes', type=int, default=None,
+                            help="The size of the hot slice of the route cache (settings.ROUTE_CACHE_HOT_SIZE by default).")
+        parser.add_argument('--imports', action='store_true',
+                            help="Also profile the imports of a fresh process (python -X importtime).")
+        parser.add_argument('--limit', type=int, default=20, help="The slowest modules to list with --imports.")
+        parser.add_argument('--package', action='append', default=[],
+                            help="Only list the modules of this package with --imports (repeatable, e.g. accounts).")
+        parser.add_argument('--sort', choices=('cumulative', 'self'), default='cumulative',
+                            help="Rank the modules by their time with (cumulative) or without (self) their imports.")
+
+    def handle(self, *args, **options):
+        failed = False
+        total = 0
+        for name, seconds, detail in warmup.warmup(routes=options['routes']):
+            total += seconds
+            line = "{:<14} {:>8.1f} ms  {}".format(name, seconds * 1000, detail)
+            if isinstance(detail, Exception):
+                failed = True
+                self.stdout.write(self.style.ERROR(line))
+            else:
+                self.stdout.write(line)
+
+        style = self.style.WARNING if failed else self.style.SUCCESS
+        self.stdout.write(style("Warmed up in {:.1f} ms.".format(total * 1000)))
+
+        if options['imports']:
+            self.stdout.write("")
+            self.report_imports(options['limit'], options['sort'], options['package'])
+
+    def report_imports(self, limit, sort, packages):
+        try:
+            report = warmup.import_times()
+        except RuntimeError as e:
+            raise CommandError(str(e))
+        key = 1 if sort == 'self' else 2
+        modules = [row for row in report.modules
+                   if not packages or any(row[0] == package or row[0].startswith(package + '.') for package in packages)]
+
+        self.stdout.write("{} modules imported in {:.1f} ms, the slowest ({} time):".format(
+            len(report.modules), report.total / 1000, sort))
+        self.stdout.write("{:>10} {:>10}  module".format('self ms', 'cumul. ms'))
+        for module, own, cumulative in sorted(modules, key=lambda row: -row[key])[:limit]:
+            self.stdout.write("{:>10.1f} {:>10.1f}  {}".format(own / 1000, cumulative / 1000, module))
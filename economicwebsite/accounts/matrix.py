@@ -0,0 +1,134 @@
+'''
+The distance matrix: distance, time and fuel cost for every ordered pair
+of a list of cities, routed with as few upstream calls as possible
+(see routing.get_matrix()) and optionally saved as trips.
+'''
+
+from django.conf import settings
+from django.db import transaction
+
+from economicwebsite.database import retry_on_lock
+
+from . import countries_info
+from . import importer
+from . import routing
+from .gazetteer import gazetteer, normalize
+from .models import Trip, InternationalTrip, calculate_money
+
+
+class MatrixError(Exception):
+    ''' Raised when the list of cities can't be routed. '''
+
+
+class City:
+
+    def __init__(self, name, country):
+        self.name = name
+        self.country = country
+        self.country_code = countries_info.countries[country.lower()]
+
+    def place(self):
+        return (self.name, self.country_code)
+
+
+def parse_cities(cities):
+    '''
+    Validates the [{"city": ..., "country": ...}, ...] list
+    like the trip forms do and returns a list of Cities.
+    '''
+
+    limit = getattr(settings, 'ROUTE_MATRIX_MAX_CITIES', routing.MATRIX_LIMIT)
+    if not isinstance(cities, list) or not 2 <= len(cities) <= limit:
+        raise MatrixError("Send between 2 and {} cities!".format(limit))
+
+    parsed, seen = [], set()
+    for item in cities:
+        if not isinstance(item, dict):
+            raise MatrixError("Every city has to have a city and a country!")
+        name, country = str(item.get('city', '')).strip(), str(item.get('country', '')).strip()
+
+        if country.lower() not in countries_info.countries:
+            raise MatrixError("A country with the name of {} does not exist in our data set!".format(country.capitalize()))
+        if not gazetteer.contains(country, name):
+            raise MatrixError("{} does not exist/is not in {}!".format(name, country.capitalize()))
+        if (normalize(name), country.lower()) in seen:
+            raise MatrixError("The towns have to be different!")
+
+        seen.add((normalize(name), country.lower()))
+        parsed.append(City(name, country))
+
+    return parsed
+
+
+def route_error(origin, destination, route):
+    if isinstance(route, routing.RoutingError):
+        return "We can't calculate this trip right now, please try again later!"
+    if route['statuscode'] == 402:
+        return "It is impossible to travel by a car from {} to {}".format(origin.name.title(), destination.name.title())
+    if 'distance' not in route:
+        return "One of the cities does not exist in our data set!"
+
+
+def route_matrix(cities, fuel_cost, fuel_consumption):
+    '''
+    Routes every ordered pair of the Cities.
+    Returns a list of dicts (from/to are indexes in `cities`) and
+    the {(i, j): route} dict that save_trips() takes.
+    '''
+
+    routes = routing.get_matrix([city.place() for city in cities])
+
+    results = []
+    for (i, j), route in sorted(routes.items()):
+        result = {'from': i, 'to': j}
+        error = route_error(cities[i], cities[j], route)
+        if error:
+            result['error'] = error
+        else:
+            distance = int(route['distance'])
+            result.update({'distance': distance,
+                           'time': route['formattedTime'],
+                           'money': calculate_money(fuel_consumption, distance, fuel_cost)})
+        results.append(result)
+
+    return results, routes
+
+
+@retry_on_lock
+def save_trips(user, cities, routes, fuel_cost, fuel_consumption):
+    '''
+    Saves the routed pairs as Trips (same country) or InternationalTrips,
+    in one transaction. The pairs that the user already has (or gets in the
+    meantime) and the ones that cost nothing are skipped.
+    Returns the number of saved trips.
+    '''
+
+    trips, international_trips = [], []
+    for (i, j), route in routes.items():
+        origin, destination = cities[i], cities[j]
+        if route_error(origin, destination, route):
+            continue
+
+        if origin.country.lower() == destination.country.lower():
+            trip, same_kind = Trip(country=origin.country), trips
+        else:
+            trip = InternationalTrip(first_country=origin.country, second_country=destination.country)
+            same_kind = international_trips
+
+        trip.From, trip.to = origin.name, destination.name
+        trip.fuel_cost, trip.fuel_consumption = fuel_cost, fuel_consumption
+        trip.user = user
+        trip.set_route(route)
+        # bulk_create() skips the check of InternationalTrip.save().
+        if trip.is_saved():
+            same_kind.append(trip)
+
+    saved = 0
+    with transaction.atomic():
+        for model, new_trips in ((Trip, trips), (InternationalTrip, international_trips)):
+            existing = set(model.objects.filter(user=user).values_list('from_key', 'to_key'))
+            new_trips = [trip for trip in new_trips if (normalize(trip.From), normalize(trip.to)) not in existing]
+            # Inserted like an import, so a trip that the user got in the meantime is skipped too.
+            saved += len(new_trips) - len(importer.save_trips(user, model, new_trips))
+
+    return saved
@@ -0,0 +1,276 @@
+'''
+In-process performance metrics, exposed in the Prometheus text format
+on /metrics (see metrics_view()).
+
+    MetricsMiddleware       the latency, status, SQL queries/time and template
+                            render time of every request, per view, plus the
+                            slow request log (settings.SLOW_REQUEST_THRESHOLD)
+    routing.add_call_hook() the latency and the status of every call to the
+                            routing API
+    route_cache/fragments   the hit rates of the route cache and of the
+                            My Trips fragment cache
+
+The numbers are kept per process (like the route caches); with several
+workers every one of them has to be scraped, or the worker's metrics
+have to be aggregated by whatever runs them.
+'''
+
+import bisect
+import hmac
+import logging
+import threading
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+from django.http import HttpResponse, HttpResponseForbidden
+
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+
+
+def format_labels(names, values):
+    if not names:
+        return ""
+    pairs = ('{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+             for name, value in zip(names, values))
+    return "{" + ",".join(pairs) + "}"
+
+
+class Metric:
+
+    type = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def key(self, labels):
+        return tuple(labels.get(name, '') for name in self.labels)
+
+    def header(self):
+        return ["# HELP {} {}".format(self.name, self.help), "# TYPE {} {}".format(self.name, self.type)]
+
+
+class Counter(Metric):
+
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def get(self, **labels):
+        return self._values.get(self.key(labels), 0)
+
+    def render(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        return self.header() + ["{}{} {}".format(self.name, format_labels(self.labels, key), value)
+                                for key, value in values]
+
+
+class Histogram(Metric):
+
+    type = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self.key(labels)
+        with self._lock:
+            value_of = self._values.get(key)
+            if value_of is None:
+                value_of = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+
+            # The counts are per bucket here and get accumulated when rendered.
+            index = bisect.bisect_left(self.buckets, value)
+            if index < len(self.buckets):
+                value_of[0][index] += 1
+            value_of[1] += value
+            value_of[2] += 1
+
+    def render(self):
+        with self._lock:
+            values = sorted((key, (list(counts), total, count)) for key, (counts, total, count) in self._values.items())
+
+        lines = self.header()
+        for key, (counts, total, count) in values:
+            cumulative = 0
+            for bucket, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append("{}_bucket{} {}".format(self.name, format_labels(self.labels + ('le',), key + (bucket,)), cumulative))
+            lines.append("{}_bucket{} {}".format(self.name, format_labels(self.labels + ('le',), key + ('+Inf',)), count))
+            lines.append("{}_sum{} {}".format(self.name, format_labels(self.labels, key), total))
+            lines.append("{}_count{} {}".format(self.name, format_labels(self.labels, key), count))
+        return lines
+
+
+class Gauge(Metric):
+    ''' A value that is computed when the metrics are scraped. '''
+
+    type = 'gauge'
+
+    def __init__(self, name, help, function):
+        super().__init__(name, help)
+        self.function = function
+
+    def render(self):
+        value = self.function()
+        return self.header() + ["{} {}".format(self.name, "NaN" if value is None else value)]
+
+
+REQUEST_LATENCY = Histogram('http_request_duration_seconds', "The time spent on the requests.", ('view', 'method'))
+REQUESTS = Counter('http_requests_total', "The requests by their status code.", ('view', 'method', 'status'))
+REQUEST_QUERIES = Histogram('http_request_db_queries', "The SQL queries per request.", ('view',), QUERY_COUNT_BUCKETS)
+QUERY_LATENCY = Histogram('db_query_duration_seconds', "The time spent on the SQL queries.", ('view',))
+RENDER_LATENCY = Histogram('template_render_duration_seconds', "The time spent on rendering the templates.", ('view',))
+SLOW_REQUESTS = Counter('http_slow_requests_total', "The requests over settings.SLOW_REQUEST_THRESHOLD.", ('view',))
+ROUTING_LATENCY = Histogram('routing_request_duration_seconds', "The time spent on the routing API calls.", ('endpoint',))
+ROUTING_CALLS = Counter('routing_requests_total', "The routing API calls by their status code.", ('endpoint', 'status'))
+ROUTE_CACHE = Counter('route_cache_lookups_total', "The route cache lookups.", ('result',))
+
+
+def route_cache_hit_rate():
+    hits, misses = ROUTE_CACHE.get(result='hit'), ROUTE_CACHE.get(result='miss')
+    return hits / (hits + misses) if hits + misses else None
+
+
+def fragment_cache_hit_rate():
+    from . import fragments
+
+    return fragments.stats()['hit_rate']
+
+
+REGISTRY = [
+    REQUEST_LATENCY, REQUESTS, REQUEST_QUERIES, QUERY_LATENCY, RENDER_LATENCY, SLOW_REQUESTS,
+    ROUTING_LATENCY, ROUTING_CALLS, ROUTE_CACHE,
+    Gauge('route_cache_hit_ratio', "The hit rate of the route cache (this process).", route_cache_hit_rate),
+    Gauge('trip_fragment_cache_hit_ratio', "The hit rate of the My Trips fragment cache (see accounts.fragments).",
+          fragment_cache_hit_rate),
+]
+
+
+def render():
+    lines = []
+    for metric in REGISTRY:
+        lines += metric.render()
+    return "\n".join(lines) + "\n"
+
+
+def record_routing_call(endpoint, status, duration):
+    ''' The routing call hook (see routing.add_call_hook()). '''
+
+    ROUTING_LATENCY.observe(duration, endpoint=endpoint)
+    ROUTING_CALLS.inc(endpoint=endpoint, status=status)
+
+
+def record_route_cache(hits, misses):
+    if hits:
+        ROUTE_CACHE.inc(hits, result='hit')
+    if misses:
+        ROUTE_CACHE.inc(misses, result='miss')
+
+
+class QueryRecorder:
+    ''' A connection.execute_wrapper() that counts and times the queries of a request. '''
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.view = ''
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - start
+            self.count += 1
+            self.duration += duration
+            QUERY_LATENCY.observe(duration, view=self.view)
+
+
+def view_name(request):
+    match = getattr(request, 'resolver_match', None)
+    return (match.view_name or match._func_path) if match else '<unresolved>'
+
+
+class MetricsMiddleware:
+    '''
+    Records the metrics of every request. Requests that take longer than
+    settings.SLOW_REQUEST_THRESHOLD seconds are also logged (as warnings
+    of the accounts.metrics logger) with their SQL numbers.
+    '''
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        queries = QueryRecorder()
+        start = time.perf_counter()
+
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(queries))
+            request._metrics_queries = queries
+            response = self.get_response(request)
+
+        duration = time.perf_counter() - start
+        view = view_name(request)
+        REQUEST_LATENCY.observe(duration, view=view, method=request.method)
+        REQUESTS.inc(view=view, method=request.method, status=response.status_code)
+        REQUEST_QUERIES.observe(queries.count, view=view)
+
+        threshold = getattr(settings, 'SLOW_REQUEST_THRESHOLD', 1.0)
+        if threshold is not None and duration > threshold:
+            SLOW_REQUESTS.inc(view=view)
+            logger.warning("Slow request: %s %s (%s) %d in %.3fs, %d queries in %.3fs",
+                           request.method, request.get_full_path(), view, response.status_code,
+                           duration, queries.count, queries.duration)
+
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        # The queries are labeled with the view once it is known.
+        request._metrics_queries.view = view_name(request)
+
+    def process_template_response(self, request, response):
+        # A response that the view has rendered itself can't be timed here.
+        if response.is_rendered:
+            return response
+
+        start = time.perf_counter()
+        view = view_name(request)
+        response.add_post_render_callback(lambda response: RENDER_LATENCY.observe(time.perf_counter() - start, view=view))
+        return response
+
+
+def has_token(request):
+    ''' Whether the request has the "Authorization: Bearer <settings.METRICS_TOKEN>" header. '''
+
+    token = getattr(settings, 'METRICS_TOKEN', '')
+    scheme, _, given = request.META.get('HTTP_AUTHORIZATION', '').partition(' ')
+    return bool(token) and scheme.lower() == 'bearer' and hmac.compare_digest(given.strip().encode(), token.encode())
+
+
+def metrics_view(request):
+    '''
+    The metrics in the Prometheus text format, for the scrapers with the
+    settings.METRICS_TOKEN bearer token and for the staff.
+    '''
+
+    if not has_token(request) and not (request.user.is_authenticated and request.user.is_staff):
+        return HttpResponseForbidden()
+
+    return HttpResponse(render(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,30 @@
+# Generated by Django 2.1 on 2026-10-18 10:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CachedRoute',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=40, unique=True)),
+                ('origin', models.CharField(max_length=60)),
+                ('origin_country', models.CharField(max_length=2)),
+                ('destination', models.CharField(max_length=60)),
+                ('destination_country', models.CharField(max_length=2)),
+                ('distance', models.FloatField(default=0)),
+                ('formatted_time', models.CharField(blank=True, max_length=9)),
+                ('status', models.IntegerField(default=0)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('last_used', models.DateTimeField(auto_now_add=True, db_index=True)),
+                ('hits', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 2.1 on 2026-10-18 12:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0002_cachedroute'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='trip',
+            index=models.Index(fields=['user', '-date'], name='trip_user_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='internationaltrip',
+            index=models.Index(fields=['user', '-date'], name='inttrip_user_date_idx'),
+        ),
+    ]
@@ -0,0 +1,60 @@
+# Generated by Django 2.1 on 2026-10-18 12:40
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Sum
+import django.db.models.deletion
+
+
+def time_to_seconds(time):
+    try:
+        hours, minutes, seconds = map(int, time.split(':'))
+    except (AttributeError, ValueError):
+        return 0
+
+    return hours * 3600 + minutes * 60 + seconds
+
+
+def build_totals(apps, schema_editor):
+    ''' Sums up every user's trips of both kinds into their TripTotals row. '''
+
+    TripTotals = apps.get_model('accounts', 'TripTotals')
+
+    rows = {}
+    for name, counter in (('Trip', 'trips'), ('InternationalTrip', 'international_trips')):
+        trips = apps.get_model('accounts', name).objects.exclude(user=None)
+
+        for total in trips.values('user').annotate(count=Count('pk'), distance=Sum('distance'), money=Sum('money')).order_by():
+            row = rows.setdefault(total['user'], TripTotals(user_id=total['user']))
+            setattr(row, counter, total['count'])
+            row.distance += total['distance'] or 0
+            row.money += total['money'] or 0
+
+        # The drive times are "HH:MM:SS" strings, so they are summed up here.
+        for user_id, time in trips.values_list('user', 'time').iterator():
+            rows[user_id].seconds += time_to_seconds(time)
+
+    TripTotals.objects.bulk_create(rows.values(), batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('accounts', '0003_trip_user_date_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TripTotals',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='trip_totals', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('trips', models.PositiveIntegerField(default=0)),
+                ('international_trips', models.PositiveIntegerField(default=0)),
+                ('distance', models.BigIntegerField(default=0)),
+                ('money', models.BigIntegerField(default=0)),
+                ('seconds', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(build_totals, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 2.1 on 2026-10-18 14:05
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0004_triptotals'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='triptotals',
+            name='updated',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
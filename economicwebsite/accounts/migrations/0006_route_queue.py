@@ -0,0 +1,43 @@
+# Generated by Django 2.1 on 2026-10-18 15:20
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0005_triptotals_updated'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='internationaltrip',
+            name='status',
+            field=models.CharField(choices=[('routed', 'Routed'), ('pending', 'Pending'), ('failed', 'Failed')], default='routed', max_length=7),
+        ),
+        migrations.AddField(
+            model_name='trip',
+            name='status',
+            field=models.CharField(choices=[('routed', 'Routed'), ('pending', 'Pending'), ('failed', 'Failed')], default='routed', max_length=7),
+        ),
+        migrations.CreateModel(
+            name='RouteJob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('queued', 'Queued'), ('running', 'Running'), ('failed', 'Failed')], default='queued', max_length=7)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('run_after', models.DateTimeField(default=django.utils.timezone.now)),
+                ('locked_by', models.CharField(blank=True, max_length=100)),
+                ('locked_at', models.DateTimeField(null=True)),
+                ('last_error', models.CharField(blank=True, max_length=200)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('international_trip', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='route_jobs', to='accounts.InternationalTrip')),
+                ('trip', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='route_jobs', to='accounts.Trip')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['status', 'run_after'], name='routejob_status_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,110 @@
+# Generated by Django 2.1 on 2026-10-18 16:05
+
+import accounts.models
+from django.core.management.base import CommandError
+from django.db import migrations
+
+
+def normalize(name):
+    return name.strip().lower()
+
+
+def duplicates(model):
+    ''' The (trip, pk of the older trip) pairs of the user's trips that only differ in case or whitespace. '''
+
+    first = {}
+    for trip in model.objects.exclude(user=None).order_by('pk').only('pk', 'user', 'From', 'to').iterator():
+        key = (trip.user_id, normalize(trip.From), normalize(trip.to))
+        if key in first:
+            yield trip, first[key]
+        else:
+            first[key] = trip.pk
+
+
+def check_duplicates(apps, schema_editor):
+    '''
+    Stops the migration (before it changes anything) if some trips only differ
+    from an older trip of the same user in case or whitespace: the new unique
+    index would reject them, and deleting users' trips is left to an explicit
+    `manage.py dedupe_trips --delete`.
+    '''
+
+    found = []
+    for name in ('Trip', 'InternationalTrip'):
+        model = apps.get_model('accounts', name)
+        found += ["{} {} (same as {})".format(name, trip.pk, original) for trip, original in duplicates(model)]
+
+    if found:
+        raise CommandError(
+            "{} trip(s) only differ from an older trip of the same user in case or whitespace: {}{}. "
+            "Review them with `manage.py dedupe_trips`, delete them with `manage.py dedupe_trips --delete` "
+            "and migrate again.".format(len(found), ", ".join(found[:20]), ", ..." if len(found) > 20 else ""))
+
+
+def fill_keys(apps, schema_editor):
+    ''' Fills in the normalized keys (check_duplicates() made sure that they are unique per user). '''
+
+    for name in ('Trip', 'InternationalTrip'):
+        model = apps.get_model('accounts', name)
+
+        trips = list(model.objects.only('pk', 'From', 'to'))
+        for trip in trips:
+            trip.from_key, trip.to_key = normalize(trip.From), normalize(trip.to)
+        model.objects.bulk_update(trips, ['from_key', 'to_key'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    # The data migration commits before the new unique index gets created (PostgreSQL
+    # can't alter a table with pending trigger events). check_duplicates runs first,
+    # so a failed check leaves the tables as they were.
+    atomic = False
+
+    dependencies = [
+        ('accounts', '0006_route_queue'),
+    ]
+
+    operations = [
+        migrations.RunPython(check_duplicates, migrations.RunPython.noop),
+        migrations.AddField(
+            model_name='trip',
+            name='from_key',
+            field=accounts.models.LookupKeyField(default='', max_length=60, source='From'),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='trip',
+            name='to_key',
+            field=accounts.models.LookupKeyField(default='', max_length=60, source='to'),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='internationaltrip',
+            name='from_key',
+            field=accounts.models.LookupKeyField(default='', max_length=60, source='From'),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='internationaltrip',
+            name='to_key',
+            field=accounts.models.LookupKeyField(default='', max_length=60, source='to'),
+            preserve_default=False,
+        ),
+        migrations.AlterUniqueTogether(
+            name='trip',
+            unique_together=set(),
+        ),
+        migrations.AlterUniqueTogether(
+            name='internationaltrip',
+            unique_together=set(),
+        ),
+        migrations.RunPython(fill_keys, migrations.RunPython.noop, atomic=True),
+        migrations.AlterUniqueTogether(
+            name='trip',
+            unique_together={('from_key', 'to_key', 'user')},
+        ),
+        migrations.AlterUniqueTogether(
+            name='internationaltrip',
+            unique_together={('from_key', 'to_key', 'user')},
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.1 on 2026-10-18 18:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0007_trip_lookup_keys'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='cachedroute',
+            name='created',
+            field=models.DateTimeField(auto_now_add=True, db_index=True),
+        ),
+    ]
@@ -1,6 +1,7 @@
 from django.conf import settings
 from django.db import models
 from django.contrib import auth
+from django.utils import timezone
 from django.utils.text import slugify
 from django.urls import reverse
 from django.core.validators import MaxValueValidator, MinValueValidator
@@ -10,13 +11,11 @@ from . import countries_info
 from django.contrib.auth import get_user_model
 
 from django.core.exceptions import ValidationError
-from django.db import IntegrityError
+from django.db import IntegrityError, transaction
 
 usr = get_user_model()
 
-# Imports needed for city_in_country()
-import os
-import csv
+from .gazetteer import gazetteer, normalize
 
 
 
@@ -24,25 +23,122 @@ def city_in_country(country, check_city):
     '''
     Takes a country and a city and
     checks whether the city is in that country
-    using the .csv file that is in the BASE_DIR.
+    using the in-memory gazetteer built from the .csv file that is in the BASE_DIR.
     '''
 
-    with open(os.path.join(settings.BASE_DIR, 'countries.csv'), "r") as f:
-        reader = csv.DictReader(f)
-        data = {}
-        try:
-            for row in reader:
-                for header, value in row.items():
-                    try:
-                        data[header].append(value.lower())
-                    except KeyError:
-                        data[header] = [value.lower()]
-            country_list = data[country.title()]
+    return gazetteer.contains(country, check_city)
+
+
+
+def calculate_money(fuel_consumption, distance, fuel_cost):
+    ''' The price of a trip: the fuel used (litres per 100km * km) times the fuel cost. '''
+
+    fuel_used = fuel_consumption*distance
+
+    return int(fuel_used*fuel_cost/100)
+
+
+
+class LookupKeyField(models.CharField):
+    '''
+    The normalized (see gazetteer.normalize) copy of the `source` field, filled in
+    on every save and bulk_create, so a unique index on it catches the trips that
+    only differ in case or whitespace.
+    '''
+
+    def __init__(self, *args, source=None, **kwargs):
+        self.source = source
+        kwargs.setdefault('max_length', 60)
+        kwargs['editable'] = False
+        super().__init__(*args, **kwargs)
+
+    def deconstruct(self):
+        name, path, args, kwargs = super().deconstruct()
+        kwargs['source'] = self.source
+        del kwargs['editable']
+        return name, path, args, kwargs
+
+    def pre_save(self, model_instance, add):
+        value = normalize(getattr(model_instance, self.source) or '')
+        setattr(model_instance, self.attname, value)
+        return value
+
+
+
+DUPLICATE_TRIP = "You already have this trip in your My Trips tab!"
+# A routed trip that costs nothing isn't saved (see InternationalTrip.save()).
+TOO_SHORT_TRIP = "This trip is too short to cost anything!"
+
+
+
+# The routing status of a trip. The pending trips wait for a RouteJob
+# (settings.ROUTING_QUEUE) and have no distance, money and time yet.
+ROUTED = 'routed'
+PENDING = 'pending'
+FAILED = 'failed'
+
+TRIP_STATUSES = (
+    (ROUTED, "Routed"),
+    (PENDING, "Pending"),
+    (FAILED, "Failed"),
+)
+
+
+
+class RoutedTripMixin:
+    '''
+    What the Trip and the InternationalTrip models have in common
+    once a route (see accounts.routing) has been found for them.
+    '''
+
+    def capitalize(self):
+        self.From = self.From.capitalize()
+        self.to = self.to.capitalize()
+
+    def set_route(self, route):
+        ''' Capitalizes the trip and fills in the distance, money and time fields. '''
+
+        self.capitalize()
 
-            return True if check_city.lower() in country_list else False
+        self.distance = int(route['distance'])
+        self.money = calculate_money(self.fuel_consumption, self.distance, self.fuel_cost)
+        self.time = route['formattedTime']
+        self.status = ROUTED
 
-        except Exception as e:
-            print(type(e).__name__)
+    def is_saved(self):
+        ''' Whether save() writes the trip (see InternationalTrip.save()). '''
+
+        return True
+
+    def set_keys(self):
+        ''' Fills in from_key/to_key (saving does too), e.g. for validate_unique(). '''
+
+        self.from_key, self.to_key = normalize(self.From), normalize(self.to)
+
+    def is_duplicate(self):
+        '''
+        Whether the user already has a trip between the same towns (compared like the
+        from_key/to_key unique index does), so a form can say so before routing it.
+        '''
+
+        if self.user_id is None:
+            return False
+
+        self.set_keys()
+        duplicates = type(self).objects.filter(user_id=self.user_id, from_key=self.from_key, to_key=self.to_key)
+        if self.pk is not None:
+            duplicates = duplicates.exclude(pk=self.pk)
+        return duplicates.exists()
+
+    # Saving/deleting in a transaction, so that the receivers in accounts.signals
+    # (e.g. the per-user totals) are committed or rolled back together with the trip.
+    def save(self, *args, **kwargs):
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            return super().delete(*args, **kwargs)
 
 
 
@@ -54,7 +150,7 @@ class User(auth.models.User, auth.models.PermissionsMixin):
 
 
  
-class Trip(models.Model):
+class Trip(RoutedTripMixin, models.Model):
     '''
     The Trip Model is connected with the User model in
     (OneToMany)ForeignKey fashion, which means that
@@ -82,6 +178,9 @@ class Trip(models.Model):
     # Wrote it with a capital letter because 'from' is a keyword in Python
     From = models.CharField(max_length=60)
     to = models.CharField(max_length=60)
+    # The normalized From/to that the uniqueness of the trips is checked on.
+    from_key = LookupKeyField(source='From')
+    to_key = LookupKeyField(source='to')
     fuel_cost = models.DecimalField(decimal_places=2, 
                                     max_digits=3, 
                                     validators=[MinValueValidator(Decimal('0.01'))])
@@ -96,23 +195,25 @@ class Trip(models.Model):
     money = models.PositiveIntegerField(default=0, 
                                         validators=[MinValueValidator(1)])
     time = models.CharField(max_length=9)
+    status = models.CharField(max_length=7, choices=TRIP_STATUSES, default=ROUTED)
     
 
     class Meta:
         '''
-        Making each of our models unique by its From-to-User fields.
-        Ordering them by -date.
+        Making each of our models unique by its (normalized) From-to-User fields.
+        Ordering them by -date (the index serves the My Trips timeline).
         '''
-        unique_together = ('From', 'to', 'user')
+        unique_together = ('from_key', 'to_key', 'user')
         ordering = ['-date']
+        indexes = [models.Index(fields=['user', '-date'], name='trip_user_date_idx')]
 
 
     def validate_unique(self, exclude=None):
 
         try:
-            super().validate_unique()
-        except Exception:
-            raise ValidationError("You already have this trip in your My Trips tab!")
+            super().validate_unique(exclude)
+        except ValidationError:
+            raise ValidationError(DUPLICATE_TRIP)
  
 
     def clean(self):
@@ -125,23 +226,41 @@ class Trip(models.Model):
             raise ValidationError("A country with the name of {} does not exist in our data set!"\
                                     .format(self.country.capitalize()))
         
-        if not city_in_country(self.country, self.From):
+        cities = gazetteer.cities(self.country)
+
+        if normalize(self.From) not in cities:
             raise ValidationError("{} does not exist/is not in {}!"\
                                     .format(self.From, self.country.capitalize()))
         
-        if not city_in_country(self.country, self.to):
+        if normalize(self.to) not in cities:
             raise ValidationError("{} does not exist/is not in {}!"\
                                    .format(self.to, self.country.capitalize()))
         
-        if self.From == self.to:
+        if normalize(self.From) == normalize(self.to):
             raise ValidationError("The towns have to be different!")
 
+        # Before the trip gets routed (the views set the user before validating the form).
+        if self.is_duplicate():
+            raise ValidationError(DUPLICATE_TRIP)
+
 
     def __str__(self):
 
         return self.country + "/ " + self.From + ":" + self.to
 
 
+    def locations(self):
+        ''' The (From, country code, to, country code) tuple that the routing functions take. '''
+
+        country_code = countries_info.countries[self.country.lower()]
+        return (self.From, country_code, self.to, country_code)
+
+
+    def capitalize(self):
+        super().capitalize()
+        self.country = self.country.capitalize()
+
+
     def save_model(self, request, obj, form, change):
 
         obj.user = request.user
@@ -149,7 +268,7 @@ class Trip(models.Model):
 
 
 
-class InternationalTrip(models.Model):
+class InternationalTrip(RoutedTripMixin, models.Model):
     '''
     Almost identical to the Trip Model except for
     the first_country and second_country fields.
@@ -163,6 +282,8 @@ class InternationalTrip(models.Model):
     From = models.CharField(max_length=60)
     second_country = models.CharField(max_length=60)
     to = models.CharField(max_length=60)
+    from_key = LookupKeyField(source='From')
+    to_key = LookupKeyField(source='to')
     fuel_cost = models.DecimalField(decimal_places=2, 
                                     max_digits=3, 
                                     validators=[MinValueValidator(Decimal('0.01'))])
@@ -177,20 +298,22 @@ class InternationalTrip(models.Model):
     money = models.PositiveIntegerField(default=0, 
                                         validators=[MinValueValidator(1)])
     time = models.CharField(max_length=9)
+    status = models.CharField(max_length=7, choices=TRIP_STATUSES, default=ROUTED)
     
 
     class Meta:
 
-        unique_together = ('From', 'to', 'user')
+        unique_together = ('from_key', 'to_key', 'user')
         ordering = ['-date']
+        indexes = [models.Index(fields=['user', '-date'], name='inttrip_user_date_idx')]
 
 
     def validate_unique(self, exclude=None):
 
         try:
-            super().validate_unique()
-        except Exception:
-            raise ValidationError("You already have this trip in your My Trips tab!")
+            super().validate_unique(exclude)
+        except ValidationError:
+            raise ValidationError(DUPLICATE_TRIP)
  
 
     def clean(self):
@@ -218,9 +341,12 @@ class InternationalTrip(models.Model):
         if self.first_country == self.second_country:
             raise ValidationError("The countries have to be different!")
         
-        if self.From == self.to:
+        if normalize(self.From) == normalize(self.to):
             raise ValidationError("The towns have to be different!")
 
+        if self.is_duplicate():
+            raise ValidationError(DUPLICATE_TRIP)
+
 
 
     def __str__(self):
@@ -228,6 +354,19 @@ class InternationalTrip(models.Model):
         return self.first_country + "/ " + self.From + ":" + self.second_country + "/ " + self.to
 
 
+    def locations(self):
+        ''' The (From, country code, to, country code) tuple that the routing functions take. '''
+
+        return (self.From, countries_info.countries[self.first_country.lower()],
+                self.to, countries_info.countries[self.second_country.lower()])
+
+
+    def capitalize(self):
+        super().capitalize()
+        self.first_country = self.first_country.capitalize()
+        self.second_country = self.second_country.capitalize()
+
+
 
     def save_model(self, request, obj, form, change):
         ''' Defining the -user field as the current user and then saving the model.'''
@@ -235,6 +374,159 @@ class InternationalTrip(models.Model):
         obj.user = request.user
         super().save_model(request, obj, form, change)
 
+    def is_saved(self):
+        # A routed trip is only saved with its price, the queued ones get it later.
+        return self.money != 0 or self.status != ROUTED
+
     def save(self, *args, **kwargs):
-        if self.money != 0:
-            super().save(self, *args, **kwargs)
\ No newline at end of file
+        if self.is_saved():
+            super().save(*args, **kwargs)
+
+
+class RouteJob(models.Model):
+    '''
+    A pending trip's routing job in the DB-backed queue of accounts.route_queue
+    (worked off by `manage.py run_route_workers`). Exactly one of the trip
+    foreign keys is set and the job goes away with its trip.
+    '''
+
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    FAILED = 'failed'
+    STATUSES = (
+        (QUEUED, "Queued"),
+        (RUNNING, "Running"),
+        (FAILED, "Failed"),
+    )
+
+    trip = models.ForeignKey(Trip,
+                             on_delete=models.CASCADE,
+                             related_name="route_jobs",
+                             null=True)
+    international_trip = models.ForeignKey(InternationalTrip,
+                                           on_delete=models.CASCADE,
+                                           related_name="route_jobs",
+                                           null=True)
+
+    status = models.CharField(max_length=7, choices=STATUSES, default=QUEUED)
+    attempts = models.PositiveIntegerField(default=0)
+    # The job isn't picked up before run_after (the retries back off).
+    run_after = models.DateTimeField(default=timezone.now)
+    locked_by = models.CharField(max_length=100, blank=True)
+    locked_at = models.DateTimeField(null=True)
+    last_error = models.CharField(max_length=200, blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+
+
+    class Meta:
+
+        indexes = [models.Index(fields=['status', 'run_after'], name='routejob_status_idx')]
+
+
+    def __str__(self):
+
+        return "{} ({})".format(self.target, self.status)
+
+
+    @property
+    def target(self):
+        return self.trip if self.trip_id is not None else self.international_trip
+
+
+
+class CachedRoute(models.Model):
+    '''
+    A persistent (DB-backed, so it is shared by all of the worker processes)
+    cache of the routes that we got from the MapQuest API.
+
+    Keyed by the normalized From/to cities and their ISO country codes.
+    The entries expire after settings.ROUTE_CACHE_TTL seconds and the least
+    recently used ones get evicted once there are more than
+    settings.ROUTE_CACHE_MAX_ENTRIES of them.
+    '''
+
+    key = models.CharField(max_length=40, unique=True)
+    origin = models.CharField(max_length=60)
+    origin_country = models.CharField(max_length=2)
+    destination = models.CharField(max_length=60)
+    destination_country = models.CharField(max_length=2)
+
+    # The distance is stored in kilometers.
+    distance = models.FloatField(default=0)
+    formatted_time = models.CharField(max_length=9, blank=True)
+    status = models.IntegerField(default=0)
+
+    created = models.DateTimeField(auto_now_add=True, db_index=True)
+    last_used = models.DateTimeField(auto_now_add=True, db_index=True)
+    hits = models.PositiveIntegerField(default=0)
+
+
+    def __str__(self):
+
+        return self.origin + "," + self.origin_country + ":" + self.destination + "," + self.destination_country
+
+
+
+
+class TripTotals(models.Model):
+    '''
+    The lifetime totals of a user's trips (both kinds), shown on the Profile.
+    Kept up to date by the receivers in accounts.signals (see accounts.totals)
+    and rebuilt from scratch with `manage.py rebuild_trip_totals`.
+    '''
+
+    user = models.OneToOneField(usr,
+                                on_delete=models.CASCADE,
+                                related_name="trip_totals",
+                                primary_key=True)
+    trips = models.PositiveIntegerField(default=0)
+    international_trips = models.PositiveIntegerField(default=0)
+    # In km, € and seconds.
+    distance = models.BigIntegerField(default=0)
+    money = models.BigIntegerField(default=0)
+    seconds = models.BigIntegerField(default=0)
+    # When any of the user's trips last changed (the Last-Modified of the trip pages).
+    updated = models.DateTimeField(default=timezone.now)
+
+
+    def __str__(self):
+
+        return str(self.user)
+
+
+    @property
+    def trip_count(self):
+        return self.trips + self.international_trips
+
+
+    @property
+    def drive_time(self):
+        ''' The total drive time as an (hours, minutes) tuple. '''
+
+        return self.seconds // 3600, self.seconds % 3600 // 60
+
+
+
+class SubmissionToken(models.Model):
+    '''
+    A claimed one-time token of a trip form (see forms.SubmissionTokenMixin).
+    Kept in the DB, so that a double-clicked submission is caught whichever
+    worker gets the second POST. The claims expire after
+    settings.TRIP_SUBMISSION_TOKEN_TIMEOUT seconds.
+    '''
+
+    user = models.ForeignKey(usr,
+                             on_delete=models.CASCADE,
+                             related_name="submission_tokens")
+    token = models.CharField(max_length=32)
+    created = models.DateTimeField(default=timezone.now)
+
+
+    class Meta:
+
+        unique_together = ('user', 'token')
+
+
+    def __str__(self):
+
+        return "{} ({})".format(self.token, self.user)
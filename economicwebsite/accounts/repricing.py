@@ -0,0 +1,135 @@
+'''
+Repricing of the saved trips at a new fuel cost (e.g. when the fuel prices change).
+
+The trips of a user, of a country (at either end of the international
+ones) or of the whole table get the new fuel_cost and their money
+recomputed by the database, with one set-based
+
+    UPDATE ... SET fuel_cost = ?, money = fuel_consumption * distance * <cents> / 10000 WHERE ...
+
+per kind of trip (or per pk range of `batch_size` trips), so no trip is
+loaded into Python and nothing gets routed again. The money is computed
+in integer cents, which truncates exactly like models.calculate_money().
+
+UPDATE sends no signals, so like accounts.bulk this module does what the
+receivers would have done: it recounts the money totals of the owners
+(one UPDATE with a subquery per kind), which also invalidates their My
+Trips fragments. The date of the trips doesn't change.
+'''
+
+from django.db import transaction
+from django.db.models import BigIntegerField, F, Max, Min, OuterRef, Q, Subquery, Sum, Value
+from django.db.models.functions import Cast, Coalesce
+from django.utils import timezone
+
+from economicwebsite.database import retry_on_lock
+
+from .models import Trip, InternationalTrip, TripTotals
+
+
+MODELS = (Trip, InternationalTrip)
+
+
+def clean_fuel_cost(fuel_cost):
+    ''' The fuel cost as a Decimal that fits the fuel_cost fields (raises a ValidationError otherwise). '''
+
+    return Trip._meta.get_field('fuel_cost').clean(fuel_cost, None)
+
+
+def money_expression(fuel_cost):
+    '''
+    calculate_money() as an SQL expression: the fuel cost in cents keeps the whole
+    computation in integers (no float rounding) and the integer division truncates.
+    '''
+
+    cents = int(fuel_cost * 100)
+    return Cast('fuel_consumption', BigIntegerField()) * F('distance') * Value(cents) / Value(10000)
+
+
+def scope(model, user=None, country=None):
+    ''' The trips of one kind of the user and/or in the country (all of them without either). '''
+
+    trips = model.objects.order_by()
+    if user is not None:
+        trips = trips.filter(user=user)
+    if country and model is Trip:
+        trips = trips.filter(country__iexact=country)
+    elif country:
+        trips = trips.filter(Q(first_country__iexact=country) | Q(second_country__iexact=country))
+
+    return trips
+
+
+def owners(querysets):
+    ''' The TripTotals of the users that own any of the trips in the querysets. '''
+
+    condition = Q()
+    for trips in querysets:
+        condition |= Q(user__in=trips.exclude(user=None).values('user'))
+    return TripTotals.objects.filter(condition)
+
+
+def recount_money(totals_rows):
+    ''' Sets the money of the TripTotals rows to the sum of their user's trips, with one UPDATE. '''
+
+    sums = [Coalesce(Subquery(model.objects.filter(user=OuterRef('user')).order_by().values('user')
+                              .annotate(money=Sum('money')).values('money')),
+                     Value(0), output_field=BigIntegerField())
+            for model in MODELS]
+
+    return totals_rows.update(money=sums[0] + sums[1], updated=timezone.now())
+
+
+def pk_ranges(trips, batch_size):
+    ''' The [start, end) pk ranges of at most `batch_size` trips that cover the queryset. '''
+
+    bounds = trips.aggregate(first=Min('pk'), last=Max('pk'))
+    if bounds['first'] is None:
+        return
+
+    for start in range(bounds['first'], bounds['last'] + 1, batch_size):
+        yield start, start + batch_size
+
+
+@retry_on_lock
+def update(trips, fuel_cost):
+    return trips.update(fuel_cost=fuel_cost, money=money_expression(fuel_cost))
+
+
+@retry_on_lock
+def finish(querysets):
+    ''' Recounts the totals (and so invalidates the fragments) of the owners of the repriced trips. '''
+
+    recount_money(owners(querysets))
+
+
+@retry_on_lock
+def reprice_at_once(querysets, fuel_cost):
+    with transaction.atomic():
+        repriced = sum(update(trips, fuel_cost) for trips in querysets)
+        finish(querysets)
+    return repriced
+
+
+def reprice(fuel_cost, user=None, country=None, batch_size=None):
+    '''
+    Reprices the trips of the user and/or in the country (every trip without
+    either) at `fuel_cost`, see the module docstring. Without `batch_size` it
+    is one transaction, with it every pk range of `batch_size` trips is its
+    own transaction (the write lock is never held for long) and the totals
+    are recounted at the end. Returns the number of repriced trips.
+    '''
+
+    fuel_cost = clean_fuel_cost(fuel_cost)
+    querysets = [scope(model, user, country) for model in MODELS]
+
+    if batch_size is None:
+        return reprice_at_once(querysets, fuel_cost)
+
+    repriced = 0
+    for trips in querysets:
+        for start, end in pk_ranges(trips, batch_size):
+            repriced += update(trips.filter(pk__gte=start, pk__lt=end), fuel_cost)
+    finish(querysets)
+
+    return repriced
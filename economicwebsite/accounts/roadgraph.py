@@ -0,0 +1,200 @@
+'''
+A compact, array-backed road graph for the local routing backend.
+
+The graph lives in a directory of .npy files (CSR adjacency) that are
+memory-mapped, not loaded as Python objects:
+
+    nodes.npy    float64 (n, 2)  latitude/longitude of every node
+    offsets.npy  int64   (n + 1) the edges of node u are offsets[u]:offsets[u + 1]
+    targets.npy  int32   (m)     the node every edge leads to
+    lengths.npy  float32 (m)     the length of every edge in km
+    times.npy    float32 (m)     the travel time of every edge in seconds
+    places.json  {"city,CC": node}  the node of every city we can route from/to
+    meta.json    {"max_speed": ...} the top speed (km/h) in the graph
+
+build() writes that directory out of plain CSV files. A small sample of
+the main Bulgarian roads (SAMPLE_DIR) is bundled, for development and the
+tests; a real deployment builds its graph from an OpenStreetMap extract
+converted to the same CSV columns.
+'''
+
+import csv
+import heapq
+import json
+import math
+import os
+
+import numpy as np
+
+from .gazetteer import normalize
+
+
+EARTH_RADIUS = 6371.0088
+
+# The nodes.csv, edges.csv and places.csv of the bundled sample graph.
+SAMPLE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'road_graph')
+
+
+def place_key(city, country_code):
+    return normalize(city) + "," + country_code.upper()
+
+
+def haversine(lat1, lon1, lat2, lon2):
+    ''' The great-circle distance between two points in km. '''
+
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + \
+        math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+
+    return 2 * EARTH_RADIUS * math.asin(math.sqrt(a))
+
+
+class RoadGraph:
+    ''' A memory-mapped road graph (see the module docstring for the format). '''
+
+    def __init__(self, path):
+        self.path = path
+        self.nodes = np.load(os.path.join(path, 'nodes.npy'), mmap_mode='r')
+        self.offsets = np.load(os.path.join(path, 'offsets.npy'), mmap_mode='r')
+        self.targets = np.load(os.path.join(path, 'targets.npy'), mmap_mode='r')
+        self.lengths = np.load(os.path.join(path, 'lengths.npy'), mmap_mode='r')
+        self.times = np.load(os.path.join(path, 'times.npy'), mmap_mode='r')
+
+        with open(os.path.join(path, 'places.json')) as f:
+            self.places = json.load(f)
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+
+        # The heuristic has to stay admissible, so it assumes the top speed everywhere.
+        self.max_speed = float(meta['max_speed'])
+
+    def node(self, city, country_code):
+        return self.places.get(place_key(city, country_code))
+
+    def edges(self, u):
+        start, end = int(self.offsets[u]), int(self.offsets[u + 1])
+        return zip(self.targets[start:end].tolist(),
+                   self.lengths[start:end].tolist(),
+                   self.times[start:end].tolist())
+
+    def heuristic(self, u, target):
+        ''' A lower bound (in seconds) of the travel time from u to target. '''
+
+        lat1, lon1 = self.nodes[u]
+        lat2, lon2 = self.nodes[target]
+
+        return haversine(lat1, lon1, lat2, lon2) / self.max_speed * 3600
+
+    def shortest_path(self, source, target):
+        '''
+        A* search for the fastest path from source to target.
+        Returns a (length in km, time in seconds) tuple, or None if the
+        target can't be reached.
+        '''
+
+        if source == target:
+            return 0.0, 0.0
+
+        best = {source: 0.0}
+        length = {source: 0.0}
+        queue = [(self.heuristic(source, target), 0.0, source)]
+
+        while queue:
+            _, time, u = heapq.heappop(queue)
+            if u == target:
+                return length[u], time
+            if time > best[u]:
+                continue
+            for v, edge_length, edge_time in self.edges(u):
+                candidate = time + edge_time
+                if candidate < best.get(v, math.inf):
+                    best[v] = candidate
+                    length[v] = length[u] + edge_length
+                    heapq.heappush(queue, (candidate + self.heuristic(v, target), candidate, v))
+
+        return None
+
+    def shortest_paths_from(self, source, targets):
+        '''
+        Dijkstra from source until all of the targets are settled.
+        Returns a dict of target -> (length in km, time in seconds)
+        for the reachable targets.
+        '''
+
+        remaining = set(targets)
+        found = {}
+        best = {source: 0.0}
+        length = {source: 0.0}
+        queue = [(0.0, source)]
+
+        while queue and remaining:
+            time, u = heapq.heappop(queue)
+            if time > best[u]:
+                continue
+            if u in remaining:
+                remaining.discard(u)
+                found[u] = (length[u], time)
+            for v, edge_length, edge_time in self.edges(u):
+                candidate = time + edge_time
+                if candidate < best.get(v, math.inf):
+                    best[v] = candidate
+                    length[v] = length[u] + edge_length
+                    heapq.heappush(queue, (candidate, v))
+
+        return found
+
+
+def build(nodes_csv, edges_csv, places_csv, path):
+    '''
+    Builds the graph directory out of three CSV files:
+
+        nodes:  id,lat,lon
+        edges:  source,target,length_km,time_s[,oneway]  (two-way unless oneway is 1)
+        places: city,country_code,node
+
+    The node ids can be any strings, they get renumbered.
+    Returns the (node count, edge count) tuple.
+    '''
+
+    ids = {}
+    coordinates = []
+    with open(nodes_csv) as f:
+        for row in csv.DictReader(f):
+            ids[row['id']] = len(coordinates)
+            coordinates.append((float(row['lat']), float(row['lon'])))
+
+    edges = []
+    with open(edges_csv) as f:
+        for row in csv.DictReader(f):
+            u, v = ids[row['source']], ids[row['target']]
+            length, time = float(row['length_km']), float(row['time_s'])
+            edges.append((u, v, length, time))
+            if row.get('oneway', '0') != '1':
+                edges.append((v, u, length, time))
+
+    edges.sort()
+    n = len(coordinates)
+    sources = np.array([e[0] for e in edges], dtype=np.int64)
+    offsets = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(np.bincount(sources, minlength=n), out=offsets[1:])
+
+    max_speed = max((length / time * 3600 for u, v, length, time in edges if time > 0), default=130.0)
+
+    places = {}
+    with open(places_csv) as f:
+        for row in csv.DictReader(f):
+            places[place_key(row['city'], row['country_code'])] = ids[row['node']]
+
+    os.makedirs(path, exist_ok=True)
+    np.save(os.path.join(path, 'nodes.npy'), np.array(coordinates, dtype=np.float64).reshape(n, 2))
+    np.save(os.path.join(path, 'offsets.npy'), offsets)
+    np.save(os.path.join(path, 'targets.npy'), np.array([e[1] for e in edges], dtype=np.int32))
+    np.save(os.path.join(path, 'lengths.npy'), np.array([e[2] for e in edges], dtype=np.float32))
+    np.save(os.path.join(path, 'times.npy'), np.array([e[3] for e in edges], dtype=np.float32))
+
+    with open(os.path.join(path, 'places.json'), 'w') as f:
+        json.dump(places, f)
+    with open(os.path.join(path, 'meta.json'), 'w') as f:
+        json.dump({'max_speed': max_speed}, f)
+
+    return n, len(edges)
@@ -0,0 +1,335 @@
+'''
+The routes that MapQuest gave for a pair of cities, in the CachedRoute table
+(shared by all of the workers) with a small in-process LRU of the hottest
+routes in front of it (`hot`), which warmup() fills when a worker starts.
+'''
+
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError
+from django.db.models import F
+from django.utils import timezone
+
+from economicwebsite.database import retry_on_lock
+
+from . import metrics
+from .gazetteer import normalize
+from .models import CachedRoute
+
+
+# MapQuest status codes that always give the same answer for the same pair
+# of cities, so they are safe to cache (0 - OK, 402 - impossible route,
+# 602/603 - unable to geocode/route between the locations).
+CACHEABLE_STATUSES = (0, 402, 602, 603)
+
+
+def ttl():
+    return getattr(settings, 'ROUTE_CACHE_TTL', 30 * 24 * 60 * 60)
+
+
+def max_entries():
+    return getattr(settings, 'ROUTE_CACHE_MAX_ENTRIES', 50000)
+
+
+def evict_every():
+    return getattr(settings, 'ROUTE_CACHE_EVICT_EVERY', 100)
+
+
+def hot_size():
+    return getattr(settings, 'ROUTE_CACHE_HOT_SIZE', 1000)
+
+
+def hot_touch():
+    return getattr(settings, 'ROUTE_CACHE_HOT_TOUCH', 60)
+
+
+class HotRoutes:
+    '''
+    The in-process LRU of key -> (route, created). A hit here doesn't query the
+    database; the last_used/hits of the row are updated at most once every
+    ROUTE_CACHE_HOT_TOUCH seconds per key, so the LRU eviction of the table
+    still sees the route as used.
+    '''
+
+    def __init__(self):
+        self._entries = OrderedDict()
+        self._touched = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key, route, created, touched=True):
+        ''' `touched`: the row's last_used/hits have just been written. '''
+
+        size = hot_size()
+        if size <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (route, created)
+            self._entries.move_to_end(key)
+            if touched:
+                self._touched[key] = time.monotonic()
+            while len(self._entries) > size:
+                old, _ = self._entries.popitem(last=False)
+                self._touched.pop(old, None)
+
+    def discard(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._touched.pop(key, None)
+
+    def should_touch(self, key):
+        ''' Whether the hit should be written to the table (and marks it as written). '''
+
+        now = time.monotonic()
+        with self._lock:
+            if now - self._touched.get(key, float('-inf')) < hot_touch():
+                return False
+            self._touched[key] = now
+            return True
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._touched.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+hot = HotRoutes()
+
+_writes = 0
+_writes_lock = threading.Lock()
+
+
+def make_key(origin, origin_country, destination, destination_country):
+    '''
+    Builds the cache key out of the normalized cities and
+    their (upper case) ISO country codes.
+    '''
+
+    raw = "|".join((normalize(origin), origin_country.upper(),
+                    normalize(destination), destination_country.upper()))
+
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+
+def as_route(entry):
+    route = {'statuscode': entry.status}
+    if entry.status == 0:
+        route['distance'] = entry.distance
+        route['formattedTime'] = entry.formatted_time
+
+    return route
+
+
+def route_of(values):
+    return as_route(CachedRoute(status=values['status'], distance=values['distance'],
+                                formatted_time=values['formatted_time']))
+
+
+def is_expired(entry, now):
+    return is_stale(entry.created, now)
+
+
+def is_stale(created, now):
+    return created + timedelta(seconds=ttl()) < now
+
+
+def get(origin, origin_country, destination, destination_country):
+    '''
+    Returns the cached route as a dict with the statuscode key
+    (and the distance (km) and formattedTime keys if the route was found),
+    or None on a miss.
+    '''
+
+    key = make_key(origin, origin_country, destination, destination_country)
+    now = timezone.now()
+
+    cached = hot.get(key)
+    if cached is not None:
+        route, created = cached
+        if not is_stale(created, now):
+            if hot.should_touch(key):
+                CachedRoute.objects.filter(key=key).update(last_used=now, hits=F('hits') + 1)
+            metrics.record_route_cache(1, 0)
+            return dict(route)
+        hot.discard(key)
+
+    entry = CachedRoute.objects.filter(key=key).first()
+
+    if entry is None:
+        metrics.record_route_cache(0, 1)
+        return None
+
+    if is_expired(entry, now):
+        entry.delete()
+        metrics.record_route_cache(0, 1)
+        return None
+
+    CachedRoute.objects.filter(pk=entry.pk).update(last_used=now, hits=F('hits') + 1)
+    hot.put(key, as_route(entry), entry.created)
+
+    metrics.record_route_cache(1, 0)
+    return as_route(entry)
+
+
+def get_many(locations):
+    '''
+    The bulk version of get(): takes a list of
+    (origin, origin_country, destination, destination_country) tuples
+    and returns a dict of the tuples that were found -> route, with one
+    query per 500 of the tuples that aren't in the in-process LRU.
+    '''
+
+    keys = {make_key(*location): location for location in locations}
+    now = timezone.now()
+    found, missing, touched = {}, [], []
+
+    for key, location in keys.items():
+        cached = hot.get(key)
+        if cached is not None and not is_stale(cached[1], now):
+            found[location] = dict(cached[0])
+            if hot.should_touch(key):
+                touched.append(key)
+        else:
+            missing.append(key)
+
+    for start in range(0, len(touched), 500):
+        CachedRoute.objects.filter(key__in=touched[start:start + 500]).update(last_used=now, hits=F('hits') + 1)
+
+    for start in range(0, len(missing), 500):
+        batch = missing[start:start + 500]
+        entries = [entry for entry in CachedRoute.objects.filter(key__in=batch) if not is_expired(entry, now)]
+        for entry in entries:
+            found[keys[entry.key]] = as_route(entry)
+            hot.put(entry.key, as_route(entry), entry.created)
+        CachedRoute.objects.filter(pk__in=[entry.pk for entry in entries]).update(last_used=now, hits=F('hits') + 1)
+
+    metrics.record_route_cache(len(found), len(keys) - len(found))
+    return found
+
+
+@retry_on_lock
+def store(origin, origin_country, destination, destination_country, route):
+    ''' Stores a route (a dict like the one returned by get()) in the cache. '''
+
+    if route['statuscode'] not in CACHEABLE_STATUSES:
+        return
+
+    key = make_key(origin, origin_country, destination, destination_country)
+    values = {'origin': normalize(origin),
+              'origin_country': origin_country.upper(),
+              'destination': normalize(destination),
+              'destination_country': destination_country.upper(),
+              'distance': route.get('distance', 0),
+              'formatted_time': route.get('formattedTime', ''),
+              'status': route['statuscode'],
+              'created': timezone.now(),
+              'last_used': timezone.now()}
+
+    hot.put(key, route_of(values), values['created'])
+
+    # Two single-statement writes instead of update_or_create(), whose SELECT and then
+    # INSERT in one transaction can't wait for the SQLite write lock (see economicwebsite.database).
+    if not CachedRoute.objects.filter(key=key).update(**values):
+        try:
+            CachedRoute.objects.create(key=key, **values)
+        except IntegrityError:
+            # Another worker has cached the same route in the meantime.
+            return
+
+    written(1)
+
+
+def store_many(routes):
+    ''' The bulk version of store(): takes a dict of location tuples -> route. '''
+
+    entries = []
+    for (origin, origin_country, destination, destination_country), route in routes.items():
+        if route['statuscode'] not in CACHEABLE_STATUSES:
+            continue
+        entries.append(CachedRoute(key=make_key(origin, origin_country, destination, destination_country),
+                                   origin=normalize(origin),
+                                   origin_country=origin_country.upper(),
+                                   destination=normalize(destination),
+                                   destination_country=destination_country.upper(),
+                                   distance=route.get('distance', 0),
+                                   formatted_time=route.get('formattedTime', ''),
+                                   status=route['statuscode']))
+
+    # The routes that someone else has cached in the meantime are skipped.
+    CachedRoute.objects.bulk_create(entries, batch_size=500, ignore_conflicts=True)
+    now = timezone.now()
+    for entry in entries:
+        hot.put(entry.key, as_route(entry), now)
+
+    written(len(entries))
+
+
+def preload_hot(limit=None):
+    '''
+    Fills the in-process LRU with the `limit` (ROUTE_CACHE_HOT_SIZE by default)
+    most used routes that haven't expired. Returns how many were loaded.
+    '''
+
+    limit = hot_size() if limit is None else min(limit, hot_size())
+    if limit <= 0:
+        return 0
+
+    fresh = CachedRoute.objects.filter(created__gte=timezone.now() - timedelta(seconds=ttl()))
+    entries = list(fresh.order_by('-hits', '-last_used')[:limit])
+    # The least used first, so they are the first ones that the LRU drops.
+    for entry in reversed(entries):
+        hot.put(entry.key, as_route(entry), entry.created, touched=False)
+
+    return len(entries)
+
+
+def written(count):
+    '''
+    Counts the routes that this process has stored and runs evict() once every
+    ROUTE_CACHE_EVICT_EVERY of them (never with 0, e.g. when `manage.py evict_routes`
+    runs periodically), so a cache write doesn't pay for the two table-wide queries.
+    '''
+
+    global _writes
+
+    every = evict_every()
+    if count <= 0 or every <= 0:
+        return
+
+    with _writes_lock:
+        before = _writes
+        _writes += count
+        due = _writes // every != before // every
+
+    if due:
+        evict()
+
+
+def evict():
+    '''
+    Deletes the expired entries and then the least recently used ones above the size limit.
+    Returns how many were deleted.
+    '''
+
+    deleted, _ = CachedRoute.objects.filter(created__lt=timezone.now() - timedelta(seconds=ttl())).delete()
+
+    overflow = CachedRoute.objects.count() - max_entries()
+    if overflow > 0:
+        stale = CachedRoute.objects.order_by('last_used').values_list('pk', flat=True)[:overflow]
+        deleted += CachedRoute.objects.filter(pk__in=list(stale)).delete()[0]
+
+    return deleted
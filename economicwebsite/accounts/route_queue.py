@@ -0,0 +1,227 @@
+'''
+The background routing of the trips (settings.ROUTING_QUEUE).
+
+The trip views save a submitted trip as pending and enqueue() a RouteJob
+for it in the same transaction, so the request returns without waiting
+for the routing backend. `manage.py run_route_workers` processes work
+off the queue: every round claims a batch of due jobs, routes them
+concurrently (routing.get_routes(), which also goes through the route
+cache) and fills in the trips.
+
+A job that hit a routing error is retried with an exponential backoff,
+up to settings.ROUTE_QUEUE_MAX_ATTEMPTS times, and then its trip is
+marked as failed. A job for a route that doesn't exist fails right away.
+Any other error of a job (e.g. its trip was deleted in the meantime) is
+logged and only affects that job, the worker goes on with the rest.
+Several worker processes can run at the same time: the jobs are claimed
+with a conditional UPDATE, so every job goes to exactly one of them.
+'''
+
+import datetime
+import logging
+import os
+import socket
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from economicwebsite.database import retry_on_lock
+
+from . import routing
+from .models import Trip, RouteJob, PENDING, FAILED, TOO_SHORT_TRIP
+from .timeline import KINDS
+
+
+logger = logging.getLogger(__name__)
+
+# The error of a job that failed for a reason other than the routing.
+JOB_ERROR = "We couldn't save this trip, please try again later!"
+
+
+def enabled():
+    return getattr(settings, 'ROUTING_QUEUE', False)
+
+
+def max_attempts():
+    return getattr(settings, 'ROUTE_QUEUE_MAX_ATTEMPTS', 5)
+
+
+def backoff(attempts):
+    ''' The delay before the retry that follows the given number of attempts. '''
+
+    base = getattr(settings, 'ROUTE_QUEUE_BACKOFF', 30)
+    return datetime.timedelta(seconds=min(base * 2 ** (attempts - 1), getattr(settings, 'ROUTE_QUEUE_MAX_BACKOFF', 3600)))
+
+
+def worker_name():
+    return "{}:{}".format(socket.gethostname(), os.getpid())
+
+
+@retry_on_lock
+def enqueue(trip):
+    ''' Saves the trip as pending and queues its routing job. '''
+
+    trip.status = PENDING
+    trip.capitalize()
+
+    with transaction.atomic():
+        trip.save()
+        field = 'trip' if isinstance(trip, Trip) else 'international_trip'
+        return RouteJob.objects.create(**{field: trip})
+
+
+def requeue_stale():
+    ''' Gives the jobs of crashed workers (running for longer than the lock timeout) back to the queue. '''
+
+    timeout = datetime.timedelta(seconds=getattr(settings, 'ROUTE_QUEUE_LOCK_TIMEOUT', 300))
+    return RouteJob.objects.filter(status=RouteJob.RUNNING, locked_at__lt=timezone.now() - timeout) \
+                           .update(status=RouteJob.QUEUED, locked_by='', locked_at=None)
+
+
+def claim(worker, limit):
+    ''' Claims up to `limit` due jobs for the worker and returns them (with their trips). '''
+
+    now = timezone.now()
+    due = list(RouteJob.objects.filter(status=RouteJob.QUEUED, run_after__lte=now)
+                               .order_by('run_after').values_list('id', flat=True)[:limit])
+    if not due:
+        return []
+
+    # Another worker may claim some of the same jobs in the meantime, the status check settles it.
+    RouteJob.objects.filter(id__in=due, status=RouteJob.QUEUED) \
+                    .update(status=RouteJob.RUNNING, locked_by=worker, locked_at=now)
+
+    return list(RouteJob.objects.filter(id__in=due, status=RouteJob.RUNNING, locked_by=worker)
+                                .select_related('trip', 'international_trip'))
+
+
+def route_error(trip, route):
+    if isinstance(route, routing.RoutingError):
+        return "We couldn't calculate this trip, please try again later!"
+    if route['statuscode'] == 402:
+        return "It is impossible to travel by a car from {} to {}".format(trip.From.title(), trip.to.title())
+    if 'distance' not in route:
+        return "One of the cities does not exist in our data set!"
+
+
+# The fields that retry_or_fail() changes. Saving only them raises a DatabaseError
+# when the job is gone (with its trip), instead of inserting it again.
+JOB_FIELDS = ['attempts', 'last_error', 'locked_by', 'locked_at', 'status', 'run_after']
+
+
+def retry_or_fail(job, error, retry):
+    job.attempts += 1
+    job.last_error = error[:200]
+    job.locked_by, job.locked_at = '', None
+
+    if retry and job.attempts < max_attempts():
+        job.status = RouteJob.QUEUED
+        job.run_after = timezone.now() + backoff(job.attempts)
+        job.save(update_fields=JOB_FIELDS)
+        return False
+
+    job.status = RouteJob.FAILED
+    with transaction.atomic():
+        job.save(update_fields=JOB_FIELDS)
+        trip = job.target
+        trip.status = FAILED
+        trip.save(update_fields=['status'])
+    return True
+
+
+def finish(job, route):
+    '''
+    Fills in the trip of the job and deletes the job, or retries/fails it.
+    Returns 'routed', 'retried' or 'failed'.
+    '''
+
+    trip = job.target
+    error = route_error(trip, route)
+    # Only the routing errors (timeouts, the backend being down) are worth retrying.
+    retry = isinstance(route, routing.RoutingError)
+
+    if not error:
+        trip.set_route(route)
+        if not trip.is_saved():
+            error = TOO_SHORT_TRIP
+
+    if error:
+        return 'failed' if retry_or_fail(job, error, retry) else 'retried'
+
+    with transaction.atomic():
+        # The trip keeps its date, so it stays in its place on My Trips.
+        trip.save(update_fields=['distance', 'money', 'time', 'status'])
+        job.delete()
+    return 'routed'
+
+
+def give_up(job):
+    ''' Retries (or fails) a job after an unexpected error. Returns 'retried', 'failed' or 'lost'. '''
+
+    try:
+        # In a savepoint, so that a failed save doesn't break an outer transaction.
+        with transaction.atomic():
+            return 'failed' if retry_or_fail(job, JOB_ERROR, retry=True) else 'retried'
+    except Exception:
+        # E.g. the trip (and so the job) has been deleted. If the job is still
+        # there, requeue_stale() gives it back to the queue after the lock timeout.
+        logger.exception("Could not retry route job %s.", job.pk)
+        return 'lost'
+
+
+def process(jobs, workers=None):
+    '''
+    Routes the claimed jobs and fills in their trips. An error of one job
+    is logged and retries (or fails) that job only.
+    Returns the (routed, retried, failed) counts.
+    '''
+
+    try:
+        routes = routing.get_routes([job.target.locations() for job in jobs], workers=workers)
+    except Exception:
+        logger.exception("Could not route a batch of %d job(s).", len(jobs))
+        outcomes = [give_up(job) for job in jobs]
+    else:
+        outcomes = []
+        for job in jobs:
+            try:
+                outcomes.append(finish(job, routes[job.target.locations()]))
+            except Exception:
+                logger.exception("Route job %s failed.", job.pk)
+                outcomes.append(give_up(job))
+
+    return outcomes.count('routed'), outcomes.count('retried'), outcomes.count('failed') + outcomes.count('lost')
+
+
+def run_once(worker=None, batch_size=None, workers=None):
+    ''' Claims and processes one batch of jobs. Returns the (routed, retried, failed) counts. '''
+
+    batch_size = batch_size or getattr(settings, 'ROUTE_QUEUE_BATCH_SIZE', 50)
+    jobs = claim(worker or worker_name(), batch_size)
+    if not jobs:
+        return 0, 0, 0
+
+    return process(jobs, workers)
+
+
+def status(user, ids):
+    '''
+    The status of the user's trips with the {"local": [ids], "international": [ids]}
+    ids, as {"local": {id: {...}}, ...}. The routed trips come with their route
+    and the failed ones with the reason.
+    '''
+
+    result = {}
+    for kind, pks in ids.items():
+        model = KINDS[kind]
+        trips = model.objects.filter(user=user, pk__in=pks).values('id', 'status', 'distance', 'money', 'time')
+        result[kind] = {trip.pop('id'): trip for trip in trips}
+
+        failed = [pk for pk, trip in result[kind].items() if trip['status'] == FAILED]
+        if failed:
+            field = 'trip' if model is Trip else 'international_trip'
+            for pk, error in RouteJob.objects.filter(**{field + '__in': failed}).values_list(field, 'last_error'):
+                result[kind][pk]['error'] = error
+
+    return result
@@ -0,0 +1,464 @@
+import asyncio
+import json
+import threading
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from . import route_cache
+from .backends import get_backend, format_time
+
+
+MAPQUEST_URL = "http://www.mapquestapi.com/directions/v2/optimizedroute"
+MAPQUEST_MATRIX_URL = "http://www.mapquestapi.com/directions/v2/routematrix"
+
+# The most locations that one routematrix call accepts.
+MATRIX_LIMIT = 25
+
+# HTTP status codes that are worth retrying.
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+class RoutingError(Exception):
+    ''' Raised when the routing service could not give us an answer. '''
+
+
+class RoutingUnavailable(RoutingError):
+    ''' Raised (without calling the service) while the circuit breaker is open. '''
+
+
+class CircuitBreaker:
+    '''
+    A simple thread-safe circuit breaker.
+
+    After `failure_threshold` consecutive failures the circuit opens and
+    every call fails fast for `reset_timeout` seconds. After that one trial
+    call is let through (half-open): a success closes the circuit again,
+    a failure re-opens it.
+    '''
+
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at = None
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self):
+        return self._opened_at is not None
+
+    def allow(self):
+        ''' Checks whether a call may be made right now. '''
+
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if time.monotonic() - self._opened_at >= self.reset_timeout:
+                # Half-open: let this call through and push the deadline
+                # so that the concurrent ones still fail fast.
+                self._opened_at = time.monotonic()
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+
+
+class MapQuestClient:
+    '''
+    A client for the MapQuest directions API that uses one pooled
+    (keep-alive) requests.Session, connect/read timeouts, a bounded number
+    of retries with exponential backoff and a circuit breaker.
+
+    `base_url` can point to a local stub server (see accounts.stub_routing).
+    '''
+
+    def __init__(self, base_url=MAPQUEST_URL, api_key='', timeout=(3.05, 10),
+                 retries=2, backoff=0.25, pool_size=10, breaker=None, matrix_url=MAPQUEST_MATRIX_URL):
+        # requests is imported by the first client, not by every worker that loads the views.
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        self.base_url = base_url
+        self.matrix_url = matrix_url
+        self.api_key = api_key
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.breaker = breaker or CircuitBreaker()
+
+        self._requests = requests
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def record_call(self, url, status, start):
+        endpoint = 'matrix' if url is not None and url == self.matrix_url else 'route'
+        for hook in _call_hooks:
+            hook(endpoint, status, time.perf_counter() - start)
+
+    def params(self, locations, options=None):
+        body = {'locations': locations}
+        if options:
+            body['options'] = options
+
+        return {'key': self.api_key,
+                'json': json.dumps(body)}
+
+    def request(self, locations, options=None, url=None):
+        '''
+        Makes the HTTP call (with retries) and returns the decoded JSON.
+        Raises RoutingError if there is no usable answer.
+        '''
+
+        if not self.breaker.allow():
+            raise RoutingUnavailable("The routing service is unavailable.")
+
+        error = None
+        for attempt in range(self.retries + 1):
+            if attempt:
+                time.sleep(self.backoff * 2 ** (attempt - 1))
+            start = time.perf_counter()
+            try:
+                response = self.session.get(url or self.base_url, params=self.params(locations, options),
+                                            timeout=self.timeout)
+                self.record_call(url, response.status_code, start)
+                if response.status_code in RETRY_STATUSES:
+                    error = RoutingError("The routing service answered with {}.".format(response.status_code))
+                    continue
+                if response.status_code >= 400:
+                    # A client error will not go away by retrying.
+                    raise RoutingError("The routing service answered with {}.".format(response.status_code))
+                json_obj = response.json()
+            except self._requests.RequestException as e:
+                self.record_call(url, 'error', start)
+                error = RoutingError(str(e))
+                continue
+            except ValueError as e:
+                error = RoutingError(str(e))
+                continue
+
+            self.breaker.record_success()
+            return json_obj
+
+        self.breaker.record_failure()
+        raise error
+
+    def route(self, origin, origin_country, destination, destination_country):
+        '''
+        Returns the route between two cities as a dict with the
+        statuscode key (and distance (km) and formattedTime if it was found).
+        '''
+
+        json_obj = self.request([origin + ',' + origin_country,
+                                 destination + ',' + destination_country])
+
+        return self.parse(json_obj)
+
+    def parse(self, json_obj):
+        ''' Turns the API's answer into our route dict. '''
+
+        try:
+            route = {'statuscode': json_obj['info']['statuscode']}
+        except (KeyError, TypeError):
+            raise RoutingError("Unexpected answer from the routing service.")
+
+        if 'distance' in json_obj.get('route', {}):
+            route['distance'] = json_obj['route']['distance']*1.609344
+            route['formattedTime'] = json_obj['route']['formattedTime']
+
+        return route
+
+    def matrix(self, places):
+        '''
+        Routes every pair of the (city, country code) places with one
+        routematrix call (at most MATRIX_LIMIT places).
+        Returns a dict of (i, j) -> route, or None if the call as a whole failed
+        (e.g. one of the places couldn't be geocoded).
+        '''
+
+        json_obj = self.request([city + ',' + country_code for city, country_code in places],
+                                options={'allToAll': True}, url=self.matrix_url)
+
+        try:
+            if json_obj['info']['statuscode'] != 0:
+                return None
+            distances, times = json_obj['distance'], json_obj['time']
+        except (KeyError, TypeError):
+            return None
+
+        routes = {}
+        for i in range(len(places)):
+            for j in range(len(places)):
+                if i == j:
+                    continue
+                if distances[i][j] <= 0:
+                    routes[i, j] = {'statuscode': 402}
+                else:
+                    routes[i, j] = {'statuscode': 0,
+                                    'distance': distances[i][j]*1.609344,
+                                    'formattedTime': format_time(times[i][j])}
+        return routes
+
+
+class AsyncMapQuestClient(MapQuestClient):
+    '''
+    The asyncio counterpart of the MapQuestClient (used by the async trip views).
+    Uses a pooled httpx.AsyncClient and shares the circuit breaker with the
+    sync client, so both see the same upstream health.
+    '''
+
+    def __init__(self, base_url=MAPQUEST_URL, api_key='', timeout=(3.05, 10),
+                 retries=2, backoff=0.25, pool_size=100, breaker=None, matrix_url=MAPQUEST_MATRIX_URL):
+        import httpx
+
+        self.base_url = base_url
+        self.matrix_url = matrix_url
+        self.api_key = api_key
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.breaker = breaker or CircuitBreaker()
+
+        self._httpx = httpx
+        self.session = httpx.AsyncClient(
+            timeout=httpx.Timeout(timeout[1], connect=timeout[0]),
+            limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size))
+
+    async def request(self, locations, options=None, url=None):
+        if not self.breaker.allow():
+            raise RoutingUnavailable("The routing service is unavailable.")
+
+        error = None
+        for attempt in range(self.retries + 1):
+            if attempt:
+                await asyncio.sleep(self.backoff * 2 ** (attempt - 1))
+            start = time.perf_counter()
+            try:
+                response = await self.session.get(url or self.base_url, params=self.params(locations, options))
+                self.record_call(url, response.status_code, start)
+                if response.status_code in RETRY_STATUSES:
+                    error = RoutingError("The routing service answered with {}.".format(response.status_code))
+                    continue
+                if response.status_code >= 400:
+                    raise RoutingError("The routing service answered with {}.".format(response.status_code))
+                json_obj = response.json()
+            except self._httpx.HTTPError as e:
+                self.record_call(url, 'error', start)
+                error = RoutingError(str(e))
+                continue
+            except ValueError as e:
+                error = RoutingError(str(e))
+                continue
+
+            self.breaker.record_success()
+            return json_obj
+
+        self.breaker.record_failure()
+        raise error
+
+    async def route(self, origin, origin_country, destination, destination_country):
+        json_obj = await self.request([origin + ',' + origin_country,
+                                       destination + ',' + destination_country])
+
+        return self.parse(json_obj)
+
+
+_call_hooks = []
+
+
+def add_call_hook(hook):
+    ''' hook(endpoint, status code (or 'error'), duration in seconds) gets called after every routing API call. '''
+
+    if hook not in _call_hooks:
+        _call_hooks.append(hook)
+
+
+_client = None
+_breaker = None
+_async_clients = weakref.WeakKeyDictionary()
+_client_lock = threading.Lock()
+
+
+def client_settings():
+    return dict(base_url=getattr(settings, 'MAPQUEST_URL', MAPQUEST_URL),
+                matrix_url=getattr(settings, 'MAPQUEST_MATRIX_URL', MAPQUEST_MATRIX_URL),
+                api_key=settings.MAPQUEST_KEY,
+                timeout=getattr(settings, 'ROUTING_TIMEOUT', (3.05, 10)),
+                retries=getattr(settings, 'ROUTING_RETRIES', 2),
+                backoff=getattr(settings, 'ROUTING_BACKOFF', 0.25))
+
+
+def get_breaker():
+    ''' Returns the process-wide circuit breaker (shared by the sync and the async client). '''
+
+    global _breaker
+
+    with _client_lock:
+        if _breaker is None:
+            _breaker = CircuitBreaker(
+                failure_threshold=getattr(settings, 'ROUTING_BREAKER_THRESHOLD', 5),
+                reset_timeout=getattr(settings, 'ROUTING_BREAKER_RESET', 30))
+        return _breaker
+
+
+def get_client():
+    ''' Returns the process-wide MapQuestClient (built from the settings on first use). '''
+
+    global _client
+
+    if _client is None:
+        breaker = get_breaker()
+        with _client_lock:
+            if _client is None:
+                _client = MapQuestClient(pool_size=getattr(settings, 'ROUTING_POOL_SIZE', 10),
+                                         breaker=breaker, **client_settings())
+    return _client
+
+
+def get_async_client():
+    '''
+    Returns the AsyncMapQuestClient of the running event loop
+    (an httpx.AsyncClient can't be shared between event loops).
+    '''
+
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        client = AsyncMapQuestClient(pool_size=getattr(settings, 'ROUTING_ASYNC_POOL_SIZE', 100),
+                                     breaker=get_breaker(), **client_settings())
+        _async_clients[loop] = client
+    return client
+
+
+def get_route(origin, origin_country, destination, destination_country):
+    '''
+    Returns the route between two cities from the settings.ROUTING_BACKEND
+    (see accounts.backends). Looks the route up in the route cache first
+    and only calls the backend on a miss.
+    '''
+
+    backend = get_backend()
+    if not backend.cacheable:
+        return backend.route(origin, origin_country, destination, destination_country)
+
+    route = route_cache.get(origin, origin_country, destination, destination_country)
+    if route is not None:
+        return route
+
+    route = backend.route(origin, origin_country, destination, destination_country)
+    route_cache.store(origin, origin_country, destination, destination_country, route)
+
+    return route
+
+
+def get_cached_route(origin, origin_country, destination, destination_country):
+    ''' The route from the route cache only (None on a miss or when the backend isn't cached). '''
+
+    if not get_backend().cacheable:
+        return None
+
+    return route_cache.get(origin, origin_country, destination, destination_country)
+
+
+def get_routes(locations, workers=None):
+    '''
+    The bulk version of get_route(): takes a list of
+    (origin, origin_country, destination, destination_country) tuples and
+    returns a dict of tuple -> route (or the RoutingError raised for it).
+
+    The cache is read and written in bulk from the calling thread and the
+    misses are routed concurrently through a bounded thread pool (the
+    worker threads never touch the DB).
+    '''
+
+    backend = get_backend()
+    locations = list(dict.fromkeys(locations))
+    routes = route_cache.get_many(locations) if backend.cacheable else {}
+    missing = [location for location in locations if location not in routes]
+
+    def route(location):
+        try:
+            return backend.route(*location)
+        except RoutingError as e:
+            return e
+
+    workers = workers or getattr(settings, 'ROUTING_BULK_WORKERS', 8)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        fresh = dict(zip(missing, executor.map(route, missing)))
+
+    if backend.cacheable:
+        route_cache.store_many({location: route for location, route in fresh.items()
+                                if not isinstance(route, RoutingError)})
+
+    routes.update(fresh)
+    return routes
+
+
+def get_matrix(places, workers=None):
+    '''
+    Routes every ordered pair of the (city, country code) places.
+    Returns a dict of (i, j) -> route (or the RoutingError raised for it).
+
+    The cached pairs are read in bulk, the rest are routed with the
+    backend's batched matrix() calls and whatever those could not answer
+    falls back to routing the single pairs concurrently.
+    '''
+
+    backend = get_backend()
+    pairs = {(i, j): places[i] + places[j]
+             for i in range(len(places)) for j in range(len(places)) if i != j}
+
+    routes = route_cache.get_many(list(pairs.values())) if backend.cacheable else {}
+    missing = {pair: location for pair, location in pairs.items() if location not in routes}
+
+    if missing:
+        # Only the places that are part of a missing pair go to the backend.
+        involved = sorted({i for pair in missing for i in pair})
+        position = {i: n for n, i in enumerate(involved)}
+        try:
+            batched = backend.matrix([places[i] for i in involved])
+        except RoutingError:
+            batched = {}
+        fresh = {location: batched[position[i], position[j]]
+                 for (i, j), location in missing.items()
+                 if (position[i], position[j]) in batched}
+        if backend.cacheable:
+            route_cache.store_many(fresh)
+        routes.update(fresh)
+
+        leftover = [location for location in missing.values() if location not in routes]
+        if leftover:
+            routes.update(get_routes(leftover, workers=workers))
+
+    return {pair: routes[location] for pair, location in pairs.items()}
+
+
+async def aget_route(origin, origin_country, destination, destination_country):
+    ''' The async version of get_route(). '''
+
+    backend = get_backend()
+    if not backend.cacheable:
+        return await backend.aroute(origin, origin_country, destination, destination_country)
+
+    route = await sync_to_async(route_cache.get)(origin, origin_country, destination, destination_country)
+    if route is not None:
+        return route
+
+    route = await backend.aroute(origin, origin_country, destination, destination_country)
+    await sync_to_async(route_cache.store)(origin, origin_country, destination, destination_country, route)
+
+    return route
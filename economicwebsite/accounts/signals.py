@@ -0,0 +1,62 @@
+'''
+The receivers that keep the denormalized data about the trips (the
+per-user totals, which the cached My Trips fragments are versioned by)
+in sync with the Trip and InternationalTrip tables.
+They are connected in AccountsConfig.ready().
+'''
+
+import threading
+from contextlib import contextmanager
+
+from django.db.models.signals import pre_save, post_save, post_delete
+
+from . import totals
+from .models import Trip, InternationalTrip
+
+
+TRIP_MODELS = (Trip, InternationalTrip)
+
+_paused = threading.local()
+
+
+@contextmanager
+def totals_paused():
+    '''
+    Stops update_totals_on_delete (in this thread) for the code that subtracts
+    the trips it deletes from the totals itself, see accounts.bulk.
+    '''
+
+    _paused.totals = True
+    try:
+        yield
+    finally:
+        _paused.totals = False
+
+
+def remember_old_values(sender, instance, **kwargs):
+    ''' Keeps what an updated trip used to add to the totals, so only the difference gets applied. '''
+
+    instance._totals_old = None
+    if instance.pk is not None:
+        instance._totals_old = sender.objects.filter(pk=instance.pk).values('user', 'distance', 'money', 'time').first()
+
+
+def update_totals_on_save(sender, instance, created, **kwargs):
+    old = getattr(instance, '_totals_old', None)
+    if old is not None:
+        totals.add(old['user'], sender, -1, -old['distance'], -old['money'], -totals.time_to_seconds(old['time']))
+
+    totals.add_trip(instance)
+
+
+def update_totals_on_delete(sender, instance, **kwargs):
+    if getattr(_paused, 'totals', False):
+        return
+
+    totals.add_trip(instance, sign=-1)
+
+
+for model in TRIP_MODELS:
+    pre_save.connect(remember_old_values, sender=model)
+    post_save.connect(update_totals_on_save, sender=model)
+    post_delete.connect(update_totals_on_delete, sender=model)
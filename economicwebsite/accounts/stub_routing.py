@@ -0,0 +1,133 @@
+'''
+A tiny local stand-in for the MapQuest directions API, meant for tests
+and benchmarks:
+
+    with StubRoutingServer(latency=0.2) as server:
+        client = MapQuestClient(base_url=server.url)
+        ...
+
+Distances are derived from a hash of the two locations, so the same pair
+always gets the same answer (routematrix calls are answered too).
+`latency` adds a delay to every answer and `fail_every` makes every n-th
+request answer with a 503.
+'''
+
+import hashlib
+import json
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import urlparse, parse_qs
+
+
+def fake_route(locations):
+    ''' Returns a deterministic (distance in miles, formattedTime) pair for the locations. '''
+
+    digest = hashlib.md5("|".join(locations).lower().encode('utf-8')).hexdigest()
+    distance = 10 + int(digest[:6], 16) % 1000
+    seconds = int(distance * 60)
+
+    return distance, "{:02d}:{:02d}:{:02d}".format(seconds // 3600, seconds % 3600 // 60, seconds % 60)
+
+
+def seconds(formatted_time):
+    hours, minutes, secs = map(int, formatted_time.split(':'))
+    return hours * 3600 + minutes * 60 + secs
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # The client has given up (e.g. on a read timeout) before it got the answer.
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+class _Handler(BaseHTTPRequestHandler):
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        stub = self.server.stub
+        with stub.lock:
+            stub.requests += 1
+            count = stub.requests
+
+        if stub.latency:
+            time.sleep(stub.latency)
+
+        if stub.fail_every and count % stub.fail_every == 0:
+            self.send_response(503)
+            self.end_headers()
+            return
+
+        query = parse_qs(urlparse(self.path).query)
+        try:
+            locations = json.loads(query['json'][0])['locations']
+        except (KeyError, ValueError):
+            self.send_response(400)
+            self.end_headers()
+            return
+
+        if urlparse(self.path).path.endswith('/routematrix'):
+            with stub.lock:
+                stub.matrix_requests += 1
+            routes = [[fake_route([a, b]) if a != b else (0, "00:00:00") for b in locations] for a in locations]
+            body = {'info': {'statuscode': 0},
+                    'distance': [[distance for distance, formatted_time in row] for row in routes],
+                    'time': [[seconds(formatted_time) for distance, formatted_time in row] for row in routes]}
+        elif stub.unroutable & {location.lower() for location in locations}:
+            body = {'info': {'statuscode': 402}, 'route': {}}
+        else:
+            distance, formatted_time = fake_route(locations)
+            body = {'info': {'statuscode': 0},
+                    'route': {'distance': distance, 'formattedTime': formatted_time}}
+
+        payload = json.dumps(body).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+
+class StubRoutingServer:
+    ''' Runs the stub API in a background thread on 127.0.0.1. '''
+
+    def __init__(self, latency=0, fail_every=0, unroutable=(), port=0):
+        self.latency = latency
+        self.fail_every = fail_every
+        self.unroutable = {location.lower() for location in unroutable}
+        self.requests = 0
+        self.matrix_requests = 0
+        self.lock = threading.Lock()
+        self._server = _ThreadingHTTPServer(('127.0.0.1', port), _Handler)
+        self._server.stub = self
+        self._thread = None
+
+    @property
+    def url(self):
+        return "http://127.0.0.1:{}/directions/v2/optimizedroute".format(self._server.server_address[1])
+
+    @property
+    def matrix_url(self):
+        return "http://127.0.0.1:{}/directions/v2/routematrix".format(self._server.server_address[1])
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
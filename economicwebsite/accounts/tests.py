@@ -1,3 +1,1130 @@
-from django.test import TestCase
+import base64
+import io
+import json
+import tempfile
+import time
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from django.core.management import CommandError, call_command
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from . import bulk, checks, costgrid, fragments, importer, matrix, repricing, route_queue, routing, timeline, totals
+from .backends import LocalGraphBackend, MapQuestBackend
+from .models import User, Trip, InternationalTrip, TripTotals, RouteJob, SubmissionToken, DUPLICATE_TRIP, TOO_SHORT_TRIP, FAILED, PENDING, ROUTED, calculate_money
+from .gazetteer import gazetteer
+from .routing import CircuitBreaker, MapQuestClient, RoutingError, RoutingUnavailable
+from .stub_routing import StubRoutingServer, fake_route
+
+
+# The cities that the tests know (the gazetteer file isn't in the repo).
+CITIES = {
+    'bulgaria': {'sofia', 'plovdiv', 'varna', 'burgas'},
+    'germany': {'berlin', 'munich'},
+}
+
+
+def make_trip(user, From='Sofia', to='Varna', model=Trip, **kwargs):
+    ''' A routed trip of the user (the routing fields are made up). '''
+
+    if model is Trip:
+        kwargs.setdefault('country', 'Bulgaria')
+    else:
+        kwargs.setdefault('first_country', 'Bulgaria')
+        kwargs.setdefault('second_country', 'Germany')
+    kwargs.setdefault('fuel_cost', Decimal('1.50'))
+    kwargs.setdefault('fuel_consumption', 7)
+    kwargs.setdefault('distance', 100)
+    kwargs.setdefault('money', 10)
+    kwargs.setdefault('time', '01:00:00')
+    return model.objects.create(user=user, From=From, to=to, **kwargs)
+
+
+def fixed_routes(distance, before=None):
+    ''' A routing.get_routes() stand-in that routes every pair with the distance (after calling `before`). '''
+
+    def get_routes(locations, workers=None):
+        if before is not None:
+            before()
+        return {location: {'statuscode': 0, 'distance': distance, 'formattedTime': '01:00:00'} for location in locations}
+
+    return get_routes
+
+
+def make_user(username='driver'):
+    return User.objects.create_user(username, username + '@example.com', 'pw12345678!')
+
+
+class StubRoutingMixin:
+    ''' Routes the trips of a TestCase through the stub MapQuest server, with the CITIES gazetteer. '''
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = StubRoutingServer().start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+        super().tearDownClass()
+
+    def setUp(self):
+        super().setUp()
+        self.server.requests = 0
+        self.server.fail_every = 0
+        self.server.unroutable = set()
+
+        settings = override_settings(MAPQUEST_URL=self.server.url, MAPQUEST_KEY='stub', ROUTING_QUEUE=False,
+                                     ROUTING_BACKEND='accounts.backends.MapQuestBackend')
+        settings.enable()
+        self.addCleanup(settings.disable)
+        for patcher in (mock.patch.object(routing, '_client', None),
+                        mock.patch.object(gazetteer, '_get_index', return_value=CITIES)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+
+class MapQuestClientTests(SimpleTestCase):
+    ''' The MapQuest client against the local stub server (accounts.stub_routing). '''
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = StubRoutingServer().start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+        super().tearDownClass()
+
+    def setUp(self):
+        self.server.requests = 0
+        self.server.latency = 0
+        self.server.fail_every = 0
+        self.server.unroutable = set()
+
+    def mapquest(self, **kwargs):
+        kwargs.setdefault('retries', 0)
+        kwargs.setdefault('timeout', (1, 1))
+        client = MapQuestClient(base_url=self.server.url, **kwargs)
+        self.addCleanup(client.session.close)
+        return client
+
+    def test_route(self):
+        route = self.mapquest().route('Sofia', 'BG', 'Plovdiv', 'BG')
+
+        distance, formatted_time = fake_route(['Sofia,BG', 'Plovdiv,BG'])
+        self.assertEqual(route, {'statuscode': 0, 'distance': distance * 1.609344, 'formattedTime': formatted_time})
+        self.assertEqual(self.server.requests, 1)
+
+    def test_unroutable(self):
+        self.server.unroutable = {'atlantis,bg'}
+
+        self.assertEqual(self.mapquest().route('Atlantis', 'BG', 'Sofia', 'BG'), {'statuscode': 402})
+
+    def test_retries_with_backoff(self):
+        # The stub answers every 2nd request with a 503.
+        self.server.fail_every = 2
+        client = self.mapquest(retries=2, backoff=0.1)
+        client.route('Sofia', 'BG', 'Plovdiv', 'BG')
+
+        with mock.patch('accounts.routing.time.sleep') as sleep:
+            route = client.route('Sofia', 'BG', 'Varna', 'BG')
+
+        self.assertEqual(route['statuscode'], 0)
+        self.assertEqual(self.server.requests, 3)
+        sleep.assert_called_once_with(0.1)
+
+    def test_gives_up_after_the_retries(self):
+        self.server.fail_every = 1
+        client = self.mapquest(retries=2, backoff=0.1)
+
+        with mock.patch('accounts.routing.time.sleep') as sleep, self.assertRaises(RoutingError):
+            client.route('Sofia', 'BG', 'Plovdiv', 'BG')
+
+        self.assertEqual(self.server.requests, 3)
+        self.assertEqual([call.args[0] for call in sleep.call_args_list], [0.1, 0.2])
+
+    def test_client_errors_are_not_retried(self):
+        client = self.mapquest(retries=2)
+
+        # The stub answers a request without locations with a 400.
+        with mock.patch.object(client, 'params', return_value={'key': ''}), self.assertRaises(RoutingError):
+            client.route('Sofia', 'BG', 'Plovdiv', 'BG')
+        self.assertEqual(self.server.requests, 1)
+
+    def test_timeout(self):
+        self.server.latency = 0.5
+        client = self.mapquest(timeout=(1, 0.1))
+
+        started = time.monotonic()
+        with self.assertRaises(RoutingError):
+            client.route('Sofia', 'BG', 'Plovdiv', 'BG')
+        self.assertLess(time.monotonic() - started, 0.5)
+
+    def test_circuit_breaker_opens(self):
+        self.server.fail_every = 1
+        client = self.mapquest(breaker=CircuitBreaker(failure_threshold=2, reset_timeout=60))
+
+        for _ in range(2):
+            with self.assertRaises(RoutingError):
+                client.route('Sofia', 'BG', 'Plovdiv', 'BG')
+        self.assertTrue(client.breaker.is_open)
+
+        with self.assertRaises(RoutingUnavailable):
+            client.route('Sofia', 'BG', 'Plovdiv', 'BG')
+        self.assertEqual(self.server.requests, 2)
+
+    def test_circuit_breaker_half_open(self):
+        self.server.fail_every = 1
+        client = self.mapquest(breaker=CircuitBreaker(failure_threshold=1, reset_timeout=0.1))
+
+        with self.assertRaises(RoutingError):
+            client.route('Sofia', 'BG', 'Plovdiv', 'BG')
+        time.sleep(0.15)
+
+        # The trial call fails, so the circuit opens again.
+        with self.assertRaises(RoutingError):
+            client.route('Sofia', 'BG', 'Plovdiv', 'BG')
+        with self.assertRaises(RoutingUnavailable):
+            client.route('Sofia', 'BG', 'Plovdiv', 'BG')
+        self.assertEqual(self.server.requests, 2)
+
+        time.sleep(0.15)
+        self.server.fail_every = 0
+
+        # The trial call succeeds, so the circuit closes.
+        self.assertEqual(client.route('Sofia', 'BG', 'Plovdiv', 'BG')['statuscode'], 0)
+        self.assertFalse(client.breaker.is_open)
+        self.assertEqual(client.route('Sofia', 'BG', 'Varna', 'BG')['statuscode'], 0)
+        self.assertEqual(self.server.requests, 4)
+
+
+
+class MapQuestKeyTests(SimpleTestCase):
+    ''' Without MAPQUEST_KEY the routing fails like an unavailable service and the system check reports it. '''
+
+    @override_settings(MAPQUEST_KEY='', ROUTING_BACKEND='accounts.backends.MapQuestBackend')
+    def test_missing_key(self):
+        with self.assertRaises(RoutingError):
+            MapQuestBackend().route('Sofia', 'BG', 'Plovdiv', 'BG')
+        self.assertEqual([error.id for error in checks.check_routing_key(None)], ['accounts.E001'])
+
+    @override_settings(MAPQUEST_KEY='key', ROUTING_BACKEND='accounts.backends.MapQuestBackend')
+    def test_key(self):
+        self.assertEqual(checks.check_routing_key(None), [])
+
+
+
+@override_settings(METRICS_TOKEN='secret')
+class MetricsAccessTests(TestCase):
+    ''' /metrics is only served with the bearer token (or to the staff). '''
+
+    def test_without_token(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+
+    def test_wrong_token(self):
+        self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer wrong').status_code, 403)
+
+    def test_non_ascii_token(self):
+        self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer \u00e9').status_code, 403)
+
+    def test_token(self):
+        response = self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer secret')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'# TYPE', response.content)
+
+    @override_settings(METRICS_TOKEN='')
+    def test_no_token_configured(self):
+        self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer ').status_code, 403)
+
+
+
+class TripSectionTests(TestCase):
+    ''' The My Trips section fragments (see accounts.timeline and accounts.fragments). '''
+
+    def test_anonymous(self):
+        url = reverse('accounts:trip_section', kwargs={'kind': 'all'})
+        response = self.client.get(url)
+
+        self.assertRedirects(response, reverse('accounts:login') + '?next=' + url, fetch_redirect_response=False)
+
+
+
+    def test_section(self):
+        user = make_user()
+        trip = make_trip(user)
+        self.client.force_login(user)
+
+        response = self.client.get(reverse('accounts:trip_section', kwargs={'kind': 'local'}))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'value="{}"'.format(trip.pk))
+
+    def test_invalid_cursor(self):
+        self.client.force_login(make_user())
+
+        response = self.client.get(reverse('accounts:trip_section', kwargs={'kind': 'all'}), {'cursor': 'garbage'})
+
+        self.assertEqual(response.status_code, 404)
+
+
+class TimelineTests(TestCase):
+    ''' The keyset paginated My Trips timeline (see accounts.timeline). '''
+
+    def setUp(self):
+        self.user = make_user()
+
+    def pages(self, limit, kinds=('local', 'international')):
+        ''' Every (kind, id) of the timeline, page by page. '''
+
+        seen, cursor = [], None
+        while True:
+            rows, cursor = timeline.timeline(self.user, kinds, cursor, limit)
+            self.assertLessEqual(len(rows), limit)
+            seen += [(row['kind'], row['id']) for row in rows]
+            if cursor is None:
+                return seen
+
+    def test_ties(self):
+        # The ids of the two tables overlap and every trip has the same date.
+        for to in ('Varna', 'Plovdiv', 'Burgas'):
+            make_trip(self.user, 'Sofia', to)
+            make_trip(self.user, 'Sofia', to, model=InternationalTrip)
+        date = timezone.now()
+        Trip.objects.update(date=date)
+        InternationalTrip.objects.update(date=date)
+
+        expected = sorted([('local', pk) for pk in Trip.objects.values_list('pk', flat=True)] +
+                          [('international', pk) for pk in InternationalTrip.objects.values_list('pk', flat=True)],
+                          reverse=True)
+        for limit in range(1, 8):
+            self.assertEqual(self.pages(limit), expected, limit)
+
+    def test_newest_first(self):
+        trips = [make_trip(self.user, 'Sofia', to) for to in ('Varna', 'Plovdiv', 'Burgas')]
+        for days, trip in enumerate(trips):
+            Trip.objects.filter(pk=trip.pk).update(date=timezone.now() - timedelta(days=days))
+
+        self.assertEqual(self.pages(2, kinds=('local',)), [('local', trip.pk) for trip in trips])
+
+    def test_last_page(self):
+        for to in ('Varna', 'Plovdiv'):
+            make_trip(self.user, 'Sofia', to)
+
+        rows, cursor = timeline.timeline(self.user, limit=2)
+        self.assertEqual((len(rows), cursor), (2, None))
+
+        rows, cursor = timeline.timeline(self.user, limit=1)
+        self.assertEqual(timeline.timeline(self.user, cursor=cursor, limit=1)[1], None)
+
+    def test_only_the_users_trips(self):
+        make_trip(make_user('other'))
+
+        self.assertEqual(timeline.timeline(self.user), ([], None))
+
+    def test_invalid_cursor(self):
+        forged = [
+            'garbage',
+            base64.urlsafe_b64encode(b'2026-01-01T00:00:00|boats|1').decode(),
+            base64.urlsafe_b64encode(b'2026-01-01T00:00:00|local|one').decode(),
+            base64.urlsafe_b64encode(b'yesterday|local|1').decode(),
+            base64.urlsafe_b64encode(b'2026-01-01T00:00:00|local').decode(),
+        ]
+        for cursor in forged:
+            with self.assertRaises(timeline.InvalidCursor, msg=cursor):
+                timeline.timeline(self.user, cursor=cursor)
+
+    def test_naive_cursor(self):
+        make_trip(self.user)
+        cursor = base64.urlsafe_b64encode(b'2100-01-01T00:00:00|local|1').decode()
+
+        self.assertEqual(len(timeline.timeline(self.user, cursor=cursor)[0]), 1)
+
+    def test_filtered(self):
+        make_trip(self.user, 'Sofia', 'Varna')
+        international = make_trip(self.user, 'Sofia', 'Berlin', model=InternationalTrip)
+        Trip.objects.update(date=timezone.now() - timedelta(days=10))
+
+        self.assertEqual(timeline.filtered('local', self.user, since=timezone.now().date()).count(), 0)
+        self.assertEqual(timeline.filtered('local', self.user, country='BULGARIA').count(), 1)
+        self.assertEqual(list(timeline.filtered('international', self.user, country='germany')), [international])
+        self.assertEqual(timeline.filtered('international', self.user, country='France').count(), 0)
+
+
+class TripTotalsTests(TestCase):
+    ''' The TripTotals rows that the receivers in accounts.signals keep up to date. '''
+
+    def setUp(self):
+        self.user = User.objects.create_user('driver', 'driver@example.com', 'pw12345678!')
+
+    def assertTotals(self, trips, international_trips, distance, money, seconds):
+        row = TripTotals.objects.get(user=self.user)
+        self.assertEqual((row.trips, row.international_trips, row.distance, row.money, row.seconds),
+                         (trips, international_trips, distance, money, seconds))
+
+    def test_create(self):
+        make_trip(self.user)
+        make_trip(self.user, 'Sofia', 'Berlin', model=InternationalTrip, distance=1000, money=100, time='10:00:30')
+
+        self.assertTotals(1, 1, 1100, 110, 39630)
+
+    def test_update(self):
+        trip = make_trip(self.user)
+        trip.distance, trip.money, trip.time = 300, 30, '03:00:00'
+        trip.save()
+
+        self.assertTotals(1, 0, 300, 30, 3 * 3600)
+
+    def test_update_moves_the_trip_to_another_user(self):
+        other = User.objects.create_user('other', 'other@example.com', 'pw12345678!')
+        trip = make_trip(self.user)
+        trip.user = other
+        trip.save()
+
+        self.assertTotals(0, 0, 0, 0, 0)
+        self.assertEqual(TripTotals.objects.get(user=other).trips, 1)
+
+    def test_delete(self):
+        make_trip(self.user).delete()
+        make_trip(self.user, 'Sofia', 'Plovdiv')
+
+        self.assertTotals(1, 0, 100, 10, 3600)
+
+    def test_rebuild(self):
+        make_trip(self.user)
+        make_trip(self.user, 'Sofia', 'Plovdiv', time='bogus')
+        TripTotals.objects.filter(user=self.user).update(trips=7, money=0)
+
+        self.assertEqual(totals.rebuild(), 1)
+        self.assertTotals(2, 0, 200, 20, 3600)
+
+
+
+class BulkDeleteTests(TestCase):
+    ''' accounts.bulk.delete_trips() and the My Trips bulk delete. '''
+
+    def setUp(self):
+        self.user = User.objects.create_user('driver', 'driver@example.com', 'pw12345678!')
+        self.other = User.objects.create_user('other', 'other@example.com', 'pw12345678!')
+
+    def test_delete_trips(self):
+        trips = [make_trip(self.user, 'Sofia', to) for to in ('Varna', 'Plovdiv', 'Burgas')]
+        international = make_trip(self.user, 'Sofia', 'Berlin', model=InternationalTrip, distance=1000, money=100)
+        foreign = make_trip(self.other)
+        RouteJob.objects.create(trip=trips[0])
+        RouteJob.objects.create(trip=foreign)
+
+        deleted = bulk.delete_trips(self.user, [Trip.objects.filter(pk__in=[trips[0].pk, trips[1].pk, foreign.pk]),
+                                                InternationalTrip.objects.filter(pk=international.pk)])
+
+        self.assertEqual(deleted, 3)
+        self.assertEqual(list(Trip.objects.filter(user=self.user)), [trips[2]])
+        self.assertTrue(Trip.objects.filter(pk=foreign.pk).exists())
+        self.assertEqual(list(RouteJob.objects.values_list('trip', flat=True)), [foreign.pk])
+
+        row = TripTotals.objects.get(user=self.user)
+        self.assertEqual((row.trips, row.international_trips, row.distance, row.money, row.seconds), (1, 0, 100, 10, 3600))
+        self.assertEqual(TripTotals.objects.get(user=self.other).trips, 1)
+
+    def test_totals_receiver_is_resumed(self):
+        bulk.delete_trips(self.user, [Trip.objects.filter(pk=make_trip(self.user).pk)])
+        make_trip(self.user, 'Sofia', 'Plovdiv').delete()
+
+        self.assertEqual(TripTotals.objects.get(user=self.user).trips, 0)
+
+    def test_view(self):
+        trips = [make_trip(self.user, 'Sofia', to) for to in ('Varna', 'Plovdiv')]
+        self.client.force_login(self.user)
+
+        response = self.client.post(reverse('accounts:delete_trips'), {'local': [trips[0].pk]})
+
+        self.assertRedirects(response, reverse('accounts:my_trips'), fetch_redirect_response=False)
+        self.assertEqual(list(Trip.objects.all()), [trips[1]])
+        self.assertEqual(TripTotals.objects.get(user=self.user).trips, 1)
+
+
+
+class TripApiTests(StubRoutingMixin, TestCase):
+    ''' The JSON API (see accounts.api). '''
+
+    def setUp(self):
+        super().setUp()
+        self.user = make_user()
+        self.client.force_login(self.user)
+        self.url = reverse('accounts:api_trips')
+
+    def json(self, method, data, url=None):
+        return getattr(self.client, method)(url or self.url, json.dumps(data), content_type='application/json')
+
+    def test_list(self):
+        local = make_trip(self.user)
+        international = make_trip(self.user, 'Sofia', 'Berlin', model=InternationalTrip)
+        Trip.objects.filter(pk=local.pk).update(date=timezone.now() - timedelta(days=1))
+
+        response = self.client.get(self.url, {'fields': 'id,kind,From,first_country'})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {'results': [
+            {'id': international.pk, 'kind': 'international', 'From': 'Sofia', 'first_country': 'Bulgaria'},
+            {'id': local.pk, 'kind': 'local', 'From': 'Sofia', 'first_country': 'Bulgaria'},
+        ], 'next': None})
+
+    def test_pages(self):
+        for to in ('Varna', 'Plovdiv', 'Burgas'):
+            make_trip(self.user, 'Sofia', to)
+            make_trip(self.user, to, 'Berlin', model=InternationalTrip)
+
+        seen, cursor = [], None
+        while True:
+            data = self.client.get(self.url, dict({'fields': 'id,kind', 'limit': 4}, **({'cursor': cursor} if cursor else {}))).json()
+            seen += [(row['kind'], row['id']) for row in data['results']]
+            cursor = data['next']
+            if cursor is None:
+                break
+
+        self.assertEqual(len(seen), 6)
+        self.assertEqual(len(set(seen)), 6)
+
+    def test_invalid_cursor(self):
+        for cursor in ('garbage', 'bm90|a|cursor', timeline.encode_cursor({'date': timezone.now(), 'kind': 'x', 'id': 1})):
+            response = self.client.get(self.url, {'cursor': cursor})
+            self.assertEqual(response.status_code, 400, cursor)
+            self.assertIn('cursor', response.json()['error'])
+
+    def test_invalid_query(self):
+        self.assertEqual(self.client.get(self.url, {'fields': 'id,password'}).status_code, 400)
+        self.assertEqual(self.client.get(self.url, {'kind': 'boats'}).status_code, 400)
+        self.assertEqual(self.client.get(self.url, {'limit': 'ten'}).status_code, 400)
+
+    def test_create(self):
+        response = self.json('post', {'trips': [
+            {'country': 'Bulgaria', 'From': 'Sofia', 'to': 'Plovdiv', 'fuel_cost': '1.50', 'fuel_consumption': 7},
+            {'country': 'Bulgaria', 'From': 'Sofia', 'to': 'Atlantis', 'fuel_cost': '1.50', 'fuel_consumption': 7},
+        ]})
+
+        self.assertEqual(response.status_code, 201)
+        data = response.json()
+        self.assertEqual([(trip['kind'], trip['to']) for trip in data['created']], [('local', 'Plovdiv')])
+        self.assertEqual([error['index'] for error in data['errors']], [1])
+        self.assertEqual(Trip.objects.get(user=self.user).to, 'Plovdiv')
+
+    def test_delete(self):
+        trips = [make_trip(self.user, 'Sofia', to) for to in ('Varna', 'Plovdiv')]
+        foreign = make_trip(make_user('other'))
+
+        response = self.json('delete', {'local': [trips[0].pk, foreign.pk]})
+
+        self.assertEqual(response.json(), {'deleted': 1})
+        self.assertEqual(list(Trip.objects.order_by('pk')), [trips[1], foreign])
+
+    def test_delete_needs_numbers(self):
+        trip = make_trip(self.user)
+
+        for ids in ({'local': [True]}, {'local': ['1']}, {'local': 1}, {'boats': [1]}, [trip.pk]):
+            self.assertEqual(self.json('delete', ids).status_code, 400, ids)
+        self.assertTrue(Trip.objects.filter(pk=trip.pk).exists())
+
+    def test_delete_one(self):
+        trip = make_trip(self.user)
+        url = reverse('accounts:api_trip', kwargs={'kind': 'local', 'pk': trip.pk})
+
+        self.assertEqual(self.client.delete(url).status_code, 204)
+        self.assertEqual(self.client.delete(url).status_code, 404)
+
+    def test_anonymous(self):
+        self.client.logout()
+
+        self.assertEqual(self.client.get(self.url).status_code, 403)
+
+
+
+class ImporterTests(TestCase):
+    ''' The CSV import (see accounts.importer), with made up routes. '''
+
+    def setUp(self):
+        self.user = make_user()
+        patcher = mock.patch.object(gazetteer, '_get_index', return_value=CITIES)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def import_csv(self, text, distance=100, before=None):
+        with mock.patch('accounts.importer.routing.get_routes', fixed_routes(distance, before)):
+            return importer.import_trips(self.user, io.StringIO(text))
+
+    def test_import(self):
+        make_trip(self.user, 'Sofia', 'Burgas')
+
+        report = self.import_csv("country,From,to,fuel_cost,fuel_consumption\n"
+                                 "Bulgaria,Sofia,Varna,1.50,7\n"
+                                 "Bulgaria,sofia ,VARNA,1.50,7\n"
+                                 "Bulgaria,Sofia,Burgas,1.50,7\n"
+                                 "Bulgaria,Sofia,Atlantis,1.50,7\n"
+                                 "Bulgaria,Varna,Plovdiv,1.50,7\n")
+
+        self.assertEqual(report.created, 2)
+        self.assertEqual([line for line, error in report.errors], [3, 4, 5])
+        self.assertEqual(report.errors[0][1], DUPLICATE_TRIP)
+        self.assertEqual(TripTotals.objects.get(user=self.user).trips, 3)
+
+    def test_free_international_trips_are_not_saved(self):
+        report = self.import_csv("first_country,From,second_country,to,fuel_cost,fuel_consumption\n"
+                                 "Bulgaria,Sofia,Germany,Berlin,0.01,1\n", distance=1)
+
+        self.assertEqual(report.created, 0)
+        self.assertEqual(report.errors, [(2, TOO_SHORT_TRIP)])
+        self.assertFalse(InternationalTrip.objects.exists())
+
+    def test_trip_created_during_the_import(self):
+        # The same trip comes from a form submission while the import is routing.
+        report = self.import_csv("country,From,to,fuel_cost,fuel_consumption\n"
+                                 "Bulgaria,Sofia,Varna,1.50,7\n"
+                                 "Bulgaria,Sofia,Plovdiv,1.50,7\n",
+                                 before=lambda: make_trip(self.user, 'Sofia', 'Varna'))
+
+        self.assertEqual(report.created, 1)
+        self.assertEqual(report.errors, [(2, DUPLICATE_TRIP)])
+        self.assertEqual(Trip.objects.filter(user=self.user).count(), 2)
+        self.assertEqual(TripTotals.objects.get(user=self.user).trips, 2)
+
+
+class MatrixSaveTests(TestCase):
+    ''' Saving the pairs of a distance matrix as trips. '''
+
+    def test_save_trips(self):
+        user = make_user()
+        make_trip(user, 'Sofia', 'Varna')
+        cities = [matrix.City('Sofia', 'Bulgaria'), matrix.City('Varna', 'Bulgaria'), matrix.City('Berlin', 'Germany')]
+        route = {'statuscode': 0, 'distance': 400, 'formattedTime': '04:00:00'}
+        free = {'statuscode': 0, 'distance': 1, 'formattedTime': '00:01:00'}
+
+        saved = matrix.save_trips(user, cities, {(0, 1): route, (1, 0): route, (0, 2): free, (2, 0): route},
+                                  Decimal('1.00'), 7)
+
+        self.assertEqual(saved, 2)
+        self.assertEqual(sorted(Trip.objects.values_list('From', 'to')), [('Sofia', 'Varna'), ('Varna', 'Sofia')])
+        self.assertEqual(list(InternationalTrip.objects.values_list('From', 'to')), [('Berlin', 'Sofia')])
+        self.assertEqual(TripTotals.objects.get(user=user).trip_count, 3)
+
+
+
+class LocalGraphBackendTests(SimpleTestCase):
+    ''' The offline routing over the bundled sample graph (built with `manage.py build_road_graph`). '''
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.directory = tempfile.TemporaryDirectory()
+        call_command('build_road_graph', '--output', cls.directory.name, stdout=io.StringIO())
+        cls.backend = LocalGraphBackend(cls.directory.name)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.directory.cleanup()
+        super().tearDownClass()
+
+    def test_route(self):
+        # The fastest way is through Plovdiv, Stara Zagora and Burgas (the one through Shumen is shorter, but slower).
+        self.assertEqual(self.backend.route('Sofia', 'BG', 'varna', 'bg'),
+                         {'statuscode': 0, 'distance': 550.0, 'formattedTime': '06:20:00'})
+
+    def test_unknown_city(self):
+        self.assertEqual(self.backend.route('Sofia', 'BG', 'Atlantis', 'BG'), {'statuscode': 602})
+
+    def test_matrix_matches_the_routes(self):
+        places = [('Sofia', 'BG'), ('Varna', 'BG'), ('Vidin', 'BG')]
+        routes = self.backend.matrix(places)
+
+        self.assertEqual(len(routes), 6)
+        for (i, j), route in routes.items():
+            self.assertEqual(route, self.backend.route(*places[i], *places[j]))
+
+
+
+class FragmentCacheTests(TestCase):
+    ''' The cached My Trips fragments are invalidated by every change of the user's trips (see accounts.fragments). '''
+
+    def setUp(self):
+        fragments.get_cache().clear()
+        self.user = make_user()
+        self.trip = make_trip(self.user)
+        self.client.force_login(self.user)
+        self.url = reverse('accounts:trip_section', kwargs={'kind': 'all'})
+
+        # The fragments are cached per CSRF cookie, which the first response sets.
+        self.get()
+        fragments.reset_stats()
+
+    def get(self):
+        return self.client.get(self.url).content.decode()
+
+    def test_hit(self):
+        first = self.get()
+
+        self.assertEqual(self.get(), first)
+        self.assertEqual(fragments.stats()['hits'], 1)
+        self.assertEqual(fragments.stats()['misses'], 1)
+
+    def test_new_trip(self):
+        self.get()
+        trip = make_trip(self.user, 'Sofia', 'Plovdiv')
+
+        self.assertIn('value="{}"'.format(trip.pk), self.get())
+        self.assertEqual(fragments.stats()['misses'], 2)
+
+    def test_updated_trip(self):
+        self.get()
+        self.trip.money = 4321
+        self.trip.save()
+
+        self.assertIn('4321', self.get())
+
+    def test_bulk_delete(self):
+        self.get()
+        bulk.delete_trips(self.user, [Trip.objects.filter(pk=self.trip.pk)])
+
+        self.assertNotIn('value="{}"'.format(self.trip.pk), self.get())
+
+    def test_other_users_trips(self):
+        self.get()
+        make_trip(make_user('other'))
+
+        self.get()
+        self.assertEqual(fragments.stats()['hits'], 1)
+
+
+
+class ConditionalGetTests(TestCase):
+    ''' The ETag/Last-Modified of the trip pages (see accounts.conditional). '''
+
+    def setUp(self):
+        self.user = make_user()
+        make_trip(self.user)
+        self.client.force_login(self.user)
+        self.url = reverse('accounts:my_trips')
+
+        # The ETag covers the CSRF cookie, which the first response sets.
+        self.client.get(self.url)
+
+    def test_not_modified(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+        self.assertEqual(self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified']).status_code, 304)
+
+    def test_modified_by_a_new_trip(self):
+        etag = self.client.get(self.url)['ETag']
+        make_trip(self.user, 'Sofia', 'Plovdiv')
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_per_user(self):
+        etag = self.client.get(self.url)['ETag']
+        self.client.force_login(make_user('other'))
+
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_not_with_pending_messages(self):
+        etag = self.client.get(self.url)['ETag']
+        # The bulk delete redirects with a message that the next page shows.
+        self.client.post(reverse('accounts:delete_trips'), {})
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.has_header('ETag'))
+
+    def test_anonymous(self):
+        self.client.logout()
+
+        self.assertFalse(self.client.get(self.url).has_header('ETag'))
+
+
+
+class RouteQueueTests(TestCase):
+    ''' The background routing of the pending trips (see accounts.route_queue), with made up routes. '''
+
+    ROUTE = {'statuscode': 0, 'distance': 400, 'formattedTime': '04:00:00'}
+
+    def setUp(self):
+        self.user = make_user()
+        self.answers = {}
+
+    def enqueue(self, to='Varna', model=Trip, **kwargs):
+        kwargs.setdefault('country' if model is Trip else 'first_country', 'Bulgaria')
+        if model is InternationalTrip:
+            kwargs.setdefault('second_country', 'Germany')
+        trip = model(user=self.user, From='sofia', to=to, fuel_cost=Decimal('1.50'), fuel_consumption=7, **kwargs)
+        route_queue.enqueue(trip)
+        return trip
+
+    def get_routes(self, locations, workers=None):
+        ''' Answers self.answers[destination] (or ROUTE) for every trip. '''
+
+        return {location: self.answers.get(location[2], self.ROUTE) for location in locations}
+
+    def run_once(self, worker='test'):
+        with mock.patch('accounts.route_queue.routing.get_routes', self.get_routes):
+            return route_queue.run_once(worker)
+
+    def test_enqueue(self):
+        trip = self.enqueue()
+
+        self.assertEqual((trip.status, trip.From), (PENDING, 'Sofia'))
+        self.assertEqual(RouteJob.objects.get().target, trip)
+
+    def test_claim(self):
+        self.enqueue()
+        later = self.enqueue('Plovdiv')
+        RouteJob.objects.filter(trip=later).update(run_after=timezone.now() + timedelta(minutes=1))
+
+        jobs = route_queue.claim('one', 10)
+
+        self.assertEqual([(job.trip.to, job.status, job.locked_by) for job in jobs], [('Varna', RouteJob.RUNNING, 'one')])
+        self.assertEqual(route_queue.claim('two', 10), [])
+
+    def test_routed(self):
+        trip = self.enqueue()
+
+        self.assertEqual(self.run_once(), (1, 0, 0))
+
+        trip.refresh_from_db()
+        self.assertEqual((trip.status, trip.distance, trip.money, trip.time), (ROUTED, 400, 42, '04:00:00'))
+        self.assertFalse(RouteJob.objects.exists())
+        self.assertEqual(TripTotals.objects.get(user=self.user).money, 42)
+
+    def test_retry_with_backoff(self):
+        trip = self.enqueue()
+        self.answers['Varna'] = routing.RoutingError("down")
+
+        started = timezone.now()
+        self.assertEqual(self.run_once(), (0, 1, 0))
+
+        job = RouteJob.objects.get()
+        self.assertEqual((job.status, job.attempts, job.locked_by), (RouteJob.QUEUED, 1, ''))
+        self.assertGreaterEqual(job.run_after, started + route_queue.backoff(1))
+        self.assertEqual(route_queue.claim('test', 10), [])
+        trip.refresh_from_db()
+        self.assertEqual(trip.status, PENDING)
+
+    @override_settings(ROUTE_QUEUE_MAX_ATTEMPTS=2)
+    def test_fail_after_the_attempts(self):
+        trip = self.enqueue()
+        self.answers['Varna'] = routing.RoutingError("down")
+
+        self.assertEqual(self.run_once(), (0, 1, 0))
+        RouteJob.objects.update(run_after=timezone.now())
+        self.assertEqual(self.run_once(), (0, 0, 1))
+
+        trip.refresh_from_db()
+        self.assertEqual(trip.status, FAILED)
+        self.assertEqual(route_queue.status(self.user, {'local': [trip.pk]})['local'][trip.pk]['error'],
+                         "We couldn't calculate this trip, please try again later!")
+
+    def test_unroutable_fails_right_away(self):
+        self.enqueue()
+        self.answers['Varna'] = {'statuscode': 402}
+
+        self.assertEqual(self.run_once(), (0, 0, 1))
+        self.assertEqual(RouteJob.objects.get().attempts, 1)
+
+    def test_free_international_trip_fails(self):
+        trip = self.enqueue('Berlin', model=InternationalTrip)
+        self.answers['Berlin'] = {'statuscode': 0, 'distance': 1, 'formattedTime': '00:01:00'}
+
+        self.assertEqual(self.run_once(), (0, 0, 1))
+        trip.refresh_from_db()
+        self.assertEqual((trip.status, RouteJob.objects.get().last_error), (FAILED, TOO_SHORT_TRIP))
+
+    def test_batch_error_retries_every_job(self):
+        self.enqueue()
+        self.enqueue('Plovdiv')
+
+        with mock.patch('accounts.route_queue.routing.get_routes', side_effect=RuntimeError("boom")):
+            self.assertEqual(route_queue.run_once('test'), (0, 2, 0))
+        self.assertEqual(sorted(RouteJob.objects.values_list('last_error', flat=True)), [route_queue.JOB_ERROR] * 2)
+
+    def test_deleted_trip_only_loses_its_job(self):
+        gone = self.enqueue()
+        kept = self.enqueue('Plovdiv')
+        jobs = route_queue.claim('test', 10)
+        gone.delete()
+
+        with mock.patch('accounts.route_queue.routing.get_routes', self.get_routes):
+            self.assertEqual(route_queue.process(jobs), (1, 0, 1))
+
+        kept.refresh_from_db()
+        self.assertEqual(kept.status, ROUTED)
+        self.assertFalse(RouteJob.objects.exists())
+
+    def test_requeue_stale(self):
+        self.enqueue()
+        route_queue.claim('crashed', 10)
+        RouteJob.objects.update(locked_at=timezone.now() - timedelta(hours=1))
+
+        self.assertEqual(route_queue.requeue_stale(), 1)
+        self.assertEqual(len(route_queue.claim('test', 10)), 1)
+
+
+
+class RepricingTests(TestCase):
+    ''' accounts.repricing, the My Trips reprice form and the reprice_trips command. '''
+
+    def setUp(self):
+        self.user = make_user()
+        self.other = make_user('other')
+        self.trips = [make_trip(self.user, 'Sofia', to, distance=distance, fuel_consumption=consumption)
+                      for to, distance, consumption in [('Varna', 443, 7), ('Plovdiv', 146, 13), ('Burgas', 387, 5)]]
+        self.international = make_trip(self.user, 'Sofia', 'Berlin', model=InternationalTrip, distance=1719, fuel_consumption=9)
+        self.foreign = make_trip(self.other, distance=443)
+
+    def assertPriced(self, trip, fuel_cost):
+        trip.refresh_from_db()
+        self.assertEqual((trip.fuel_cost, trip.money),
+                         (fuel_cost, calculate_money(trip.fuel_consumption, trip.distance, fuel_cost)))
+
+    def test_money_is_truncated_like_calculate_money(self):
+        for fuel_cost in (Decimal('2.37'), Decimal('0.01'), Decimal('9.99')):
+            self.assertEqual(repricing.reprice(fuel_cost, user=self.user), 4)
+            for trip in self.trips + [self.international]:
+                self.assertPriced(trip, fuel_cost)
+
+    def test_scope(self):
+        self.assertEqual(repricing.reprice(Decimal('2.00'), user=self.user, country='germany'), 1)
+
+        self.assertPriced(self.international, Decimal('2.00'))
+        self.trips[0].refresh_from_db()
+        self.foreign.refresh_from_db()
+        self.assertEqual((self.trips[0].money, self.foreign.money), (10, 10))
+
+    def test_batches(self):
+        self.assertEqual(repricing.reprice(Decimal('1.75'), batch_size=2), 5)
+
+        for trip in self.trips + [self.international, self.foreign]:
+            self.assertPriced(trip, Decimal('1.75'))
+
+    def test_totals(self):
+        repricing.reprice(Decimal('2.00'), user=self.user)
+
+        money = sum(calculate_money(trip.fuel_consumption, trip.distance, Decimal('2.00'))
+                    for trip in self.trips + [self.international])
+        self.assertEqual(TripTotals.objects.get(user=self.user).money, money)
+        self.assertEqual(TripTotals.objects.get(user=self.other).money, 10)
+
+    def test_view(self):
+        self.client.force_login(self.user)
+
+        response = self.client.post(reverse('accounts:reprice_trips'), {'fuel_cost': '2.00', 'country': 'Bulgaria'})
+
+        self.assertRedirects(response, reverse('accounts:my_trips'), fetch_redirect_response=False)
+        for trip in self.trips + [self.international]:
+            self.assertPriced(trip, Decimal('2.00'))
+        self.foreign.refresh_from_db()
+        self.assertEqual(self.foreign.money, 10)
+
+    def test_view_invalid(self):
+        self.client.force_login(self.user)
+
+        response = self.client.post(reverse('accounts:reprice_trips'), {'fuel_cost': '0'}, follow=True)
+
+        self.assertEqual(len(list(response.context['messages'])), 1)
+        self.trips[0].refresh_from_db()
+        self.assertEqual(self.trips[0].money, 10)
+
+    def test_command(self):
+        out = io.StringIO()
+        call_command('reprice_trips', '1.20', user='other', stdout=out)
+
+        self.assertIn("Repriced 1 trip(s) at 1.20.", out.getvalue())
+        self.assertPriced(self.foreign, Decimal('1.20'))
+
+        with self.assertRaises(CommandError):
+            call_command('reprice_trips', 'cheap', stdout=out)
+        with self.assertRaises(CommandError):
+            call_command('reprice_trips', '1.20', user='nobody', stdout=out)
+
+
+
+class CostGridTests(TestCase):
+    ''' accounts.costgrid and the cost table view. '''
+
+    def setUp(self):
+        fragments.get_cache().clear()
+        self.user = make_user()
+        self.trip = make_trip(self.user, distance=443)
+        self.client.force_login(self.user)
+        self.url = reverse('accounts:cost_grid')
+
+    def get(self, **params):
+        return self.client.get(self.url, params)
+
+    def test_money_is_truncated_like_calculate_money(self):
+        table = costgrid.build(443, (Decimal('0.01'), Decimal('9.99'), Decimal('0.37')), (1, 100, 9))
+
+        self.assertEqual(len(table['money']), len(table['fuel_consumptions']))
+        for consumption, row in zip(table['fuel_consumptions'], table['money']):
+            self.assertEqual(row, [calculate_money(consumption, 443, Decimal(cost)) for cost in table['fuel_costs']])
+
+    def test_default_ranges(self):
+        table = costgrid.build(100)
+
+        self.assertEqual(table['fuel_costs'][:3], ['1.00', '1.25', '1.50'])
+        self.assertEqual(table['fuel_costs'][-1], '3.00')
+        self.assertEqual(table['fuel_consumptions'], list(range(4, 13)))
+
+    def test_invalid_ranges(self):
+        for costs, consumptions in [((Decimal('2.00'), Decimal('1.00'), Decimal('0.10')), (4, 12, 1)),
+                                    ((Decimal('1.00'), Decimal('2.00'), Decimal('0.00')), (4, 12, 1)),
+                                    ((Decimal('0.01'), Decimal('9.99'), Decimal('0.01')), (1, 100, 1))]:
+            with self.assertRaises(costgrid.GridError):
+                costgrid.build(100, costs, consumptions)
+
+    def test_trip(self):
+        response = self.get(kind='local', id=self.trip.pk, cost_from='1.50', cost_to='1.50', consumption_from=7,
+                            consumption_to=7)
+
+        self.assertEqual(response.json()['money'], [[calculate_money(7, 443, Decimal('1.50'))]])
+
+    def test_trip_without_route(self):
+        pending = make_trip(self.user, 'Sofia', 'Plovdiv', status=PENDING)
+        foreign = make_trip(make_user('other'))
+
+        for pk in (pending.pk, foreign.pk):
+            self.assertEqual(self.get(kind='local', id=pk).status_code, 400)
+
+    def test_known_route(self):
+        route = {'statuscode': 0, 'distance': 443.2, 'formattedTime': '04:50:00'}
+        params = {'From': 'Sofia', 'from_country': 'Bulgaria', 'to': 'Varna', 'to_country': 'Bulgaria'}
+
+        with mock.patch('accounts.costgrid.routing.get_cached_route', return_value=route) as get_cached_route:
+            self.assertEqual(self.get(**params).json()['distance'], 443)
+        get_cached_route.assert_called_once_with('Sofia', 'BG', 'Varna', 'BG')
+
+        with mock.patch('accounts.costgrid.routing.get_cached_route', return_value=None):
+            self.assertEqual(self.get(**params).status_code, 400)
+        self.assertEqual(self.get(**dict(params, to_country='Atlantis')).status_code, 400)
+
+    def test_invalid_request(self):
+        self.assertIn('__all__', self.get().json()['errors'])
+        self.assertEqual(self.get(kind='local', id=self.trip.pk, cost_step='0').status_code, 400)
+
+    def test_html_fragment(self):
+        self.get(kind='local', id=self.trip.pk, format='html')
+        fragments.reset_stats()
+
+        content = self.get(kind='local', id=self.trip.pk, format='html').content.decode()
+
+        self.assertIn(str(calculate_money(7, 443, Decimal('1.50'))), content)
+        self.assertEqual(fragments.stats()['hits'], 1)
+
+
+
+class SubmissionTokenTests(StubRoutingMixin, TestCase):
+    ''' The one-time tokens of the trip forms, which stop a double-clicked submission (see RoutedTripMixin.claim_token()). '''
+
+    TOKEN = '0123456789abcdef0123456789abcdef'
+
+    def setUp(self):
+        super().setUp()
+        self.user = make_user()
+        self.client.force_login(self.user)
+        self.url = reverse('accounts:non_international')
+        self.data = {'country': 'Bulgaria', 'From': 'Sofia', 'to': 'Varna', 'fuel_cost': '1.50',
+                     'fuel_consumption': 7, 'token': self.TOKEN}
+
+    def post(self, **data):
+        return self.client.post(self.url, dict(self.data, **data))
+
+    def test_form_has_a_token(self):
+        first, second = (self.client.get(self.url).context['form'].initial['token'] for _ in range(2))
+
+        self.assertRegex(first, r'^[0-9a-f]{32}$')
+        self.assertNotEqual(first, second)
+
+    def test_double_submit(self):
+        self.assertRedirects(self.post(), reverse('accounts:my_trips'), fetch_redirect_response=False)
+        requests = self.server.requests
+
+        # Not routed again and not shown as a duplicate: it just goes where the first one went.
+        self.assertRedirects(self.post(), reverse('accounts:my_trips'), fetch_redirect_response=False)
+        self.assertEqual(self.server.requests, requests)
+        self.assertEqual(Trip.objects.count(), 1)
+
+    def test_released_on_form_error(self):
+        response = self.post(fuel_consumption='')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(SubmissionToken.objects.exists())
+        self.assertRedirects(self.post(), reverse('accounts:my_trips'), fetch_redirect_response=False)
+        self.assertEqual(Trip.objects.count(), 1)
+
+    def test_released_on_exception(self):
+        with mock.patch('accounts.views.routing.get_route', side_effect=RuntimeError("boom")):
+            with self.assertRaises(RuntimeError):
+                self.post()
+
+        self.assertFalse(SubmissionToken.objects.exists())
+
+    def test_expired_claim(self):
+        SubmissionToken.objects.create(user=self.user, token=self.TOKEN, created=timezone.now() - timedelta(hours=1))
+
+        self.assertRedirects(self.post(), reverse('accounts:my_trips'), fetch_redirect_response=False)
+        self.assertEqual(Trip.objects.count(), 1)
+
+    def test_per_user(self):
+        other = make_user('other')
+        SubmissionToken.objects.create(user=other, token=self.TOKEN)
+
+        self.post()
+
+        self.assertEqual(Trip.objects.filter(user=self.user).count(), 1)
+
+
+class DedupeTripsTests(TestCase):
+    ''' The dedupe_trips command, which clears the way for the 0007_trip_lookup_keys unique index. '''
+
+    def setUp(self):
+        self.user = make_user()
+        self.other = make_user('other')
+        self.original = make_trip(self.user)
+        self.duplicate = self.make_duplicate(make_trip(self.user, 'Sofia', 'Plovdiv'), ' sofia', 'VARNA  ')
+        self.international = make_trip(self.user, 'Sofia', 'Berlin', model=InternationalTrip)
+        self.international_duplicate = self.make_duplicate(
+            make_trip(self.user, 'Sofia', 'Munich', model=InternationalTrip), 'Sofia', 'berlin')
+        # The same towns as a trip of another user aren't a duplicate.
+        self.foreign = make_trip(self.other)
+
+    def make_duplicate(self, trip, From, to):
+        # The unique index doesn't let such a trip be saved any more, so the keys are faked.
+        type(trip).objects.filter(pk=trip.pk).update(From=From, to=to, from_key='x{}'.format(trip.pk), to_key='x')
+        return trip
+
+    def dedupe(self, *args):
+        out = io.StringIO()
+        call_command('dedupe_trips', *args, stdout=out)
+        return out.getvalue()
+
+    def test_report(self):
+        out = self.dedupe()
+
+        self.assertIn("Trip {} of user {}: ' sofia' -> 'VARNA  ' (same as Trip {})".format(
+            self.duplicate.pk, self.user.pk, self.original.pk), out)
+        self.assertIn("InternationalTrip {} of user".format(self.international_duplicate.pk), out)
+        self.assertIn("Found 2 duplicate trip(s)", out)
+        self.assertEqual(Trip.objects.count() + InternationalTrip.objects.count(), 5)
+
+    def test_delete(self):
+        self.assertIn("Deleted 2 duplicate trip(s).", self.dedupe('--delete'))
+
+        self.assertEqual(set(Trip.objects.all()), {self.original, self.foreign})
+        self.assertEqual(list(InternationalTrip.objects.all()), [self.international])
+        row = TripTotals.objects.get(user=self.user)
+        self.assertEqual((row.trips, row.international_trips, row.distance, row.money), (1, 1, 200, 20))
+        self.assertEqual(TripTotals.objects.get(user=self.other).trips, 1)
+        self.assertIn("Found 0 duplicate trip(s)", self.dedupe())
@@ -0,0 +1,141 @@
+'''
+The My Trips timeline: both kinds of trips merged into one list, newest
+first, with keyset (date, kind, id) pagination (the ids of the two
+tables overlap, so the kind breaks the ties between them).
+
+Every page is one query (a UNION of the Trip and the InternationalTrip
+rows when both kinds are asked for) that is served by the
+(user, -date) indexes of the two tables. Every part of the UNION is
+limited to the page size (through a pk IN subquery, since SQLite allows
+no LIMIT in the parts themselves), so a deep page doesn't read all of
+the user's older trips.
+'''
+
+import base64
+from datetime import datetime
+
+from django.conf import settings
+from django.db.models import CharField, F, Q, Value
+from django.utils import timezone
+
+from .models import Trip, InternationalTrip
+
+
+KINDS = {
+    'local': Trip,
+    'international': InternationalTrip,
+}
+
+COLUMNS = ('id', 'date', 'From', 'to', 'money', 'time', 'distance', 'status')
+
+
+class InvalidCursor(ValueError):
+    ''' Raised for a ?cursor= that timeline() didn't make (a client restarting from page 1 could loop). '''
+
+
+def page_size():
+    return getattr(settings, 'TRIPS_PAGE_SIZE', 20)
+
+
+def encode_cursor(row):
+    raw = "{}|{}|{}".format(row['date'].isoformat(), row['kind'], row['id'])
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    ''' Returns the (date, kind, id) of a cursor, or None if the cursor is invalid. '''
+
+    try:
+        date, kind, pk = base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8').split('|')
+        date = datetime.fromisoformat(date)
+        if kind not in KINDS:
+            return None
+        if settings.USE_TZ and timezone.is_naive(date):
+            date = timezone.make_aware(date)
+        return date, kind, int(pk)
+    except (ValueError, UnicodeError):
+        return None
+
+
+def after_cursor(kind, after):
+    '''
+    The rows of one kind that come after the cursor in the (-date, -kind, -id) order.
+    Within one part of the UNION the kind is constant, so it only decides what
+    happens to the rows with the cursor's date.
+    '''
+
+    date, cursor_kind, pk = after
+    if kind < cursor_kind:
+        return Q(date__lte=date)
+    if kind == cursor_kind:
+        return Q(date__lt=date) | Q(date=date, id__lt=pk)
+    return Q(date__lt=date)
+
+
+def filtered(kind, user, since=None, until=None, country=None):
+    ''' The user's trips of one kind, filtered by a date range and/or a country (at either end). '''
+
+    model = KINDS[kind]
+    queryset = model.objects.filter(user=user)
+
+    if since:
+        queryset = queryset.filter(date__date__gte=since)
+    if until:
+        queryset = queryset.filter(date__date__lte=until)
+    if country and model is Trip:
+        queryset = queryset.filter(country__iexact=country)
+    elif country:
+        queryset = queryset.filter(Q(first_country__iexact=country) | Q(second_country__iexact=country))
+
+    return queryset
+
+
+def rows(kind, user, after=None, columns=COLUMNS, limit=None):
+    '''
+    The values() queryset of one kind of trips, with the same columns for both kinds
+    (`columns` have to be fields of both models), with at most `limit` of the
+    newest trips after the cursor.
+    '''
+
+    model = KINDS[kind]
+    queryset = model.objects.filter(user=user)
+
+    if after is not None:
+        queryset = queryset.filter(after_cursor(kind, after))
+    if limit is not None:
+        queryset = model.objects.filter(pk__in=queryset.order_by('-date', '-id').values('pk')[:limit])
+
+    # A local trip has the same country at both ends.
+    if model is Trip:
+        country_a, country_b = F('country'), F('country')
+    else:
+        country_a, country_b = F('first_country'), F('second_country')
+
+    # The ordering of the parts of a UNION has to be cleared (the Meta ordering included).
+    return queryset.order_by().values(*columns,
+                                      kind=Value(kind, output_field=CharField()),
+                                      country_a=country_a,
+                                      country_b=country_b)
+
+
+def timeline(user, kinds=('local', 'international'), cursor=None, limit=None, columns=COLUMNS):
+    '''
+    Returns one page of the user's trips of the given kinds, newest first,
+    as a (rows, next cursor) tuple. The next cursor is None on the last page.
+    Raises InvalidCursor if the cursor can't be decoded.
+    '''
+
+    limit = limit or page_size()
+    after = decode_cursor(cursor) if cursor else None
+    if cursor and after is None:
+        raise InvalidCursor("The cursor is invalid, start from the first page!")
+
+    # The cursor is made of the date, the kind and the id, so they are always selected.
+    columns = ('id', 'date') + tuple(column for column in columns if column not in ('id', 'date'))
+    parts = [rows(kind, user, after, columns, limit + 1) for kind in kinds]
+    queryset = parts[0].union(*parts[1:], all=True) if len(parts) > 1 else parts[0]
+
+    page = list(queryset.order_by('-date', '-kind', '-id')[:limit + 1])
+    next_cursor = encode_cursor(page[limit - 1]) if len(page) > limit else None
+
+    return page[:limit], next_cursor
@@ -0,0 +1,93 @@
+'''
+The per-user trip totals (the TripTotals rows) that the Profile shows.
+
+The receivers in accounts.signals apply the difference that every saved
+or deleted trip makes with add(); the code that inserts trips with
+bulk_create (which sends no signals) calls add_trips() itself.
+rebuild() recomputes the rows from scratch.
+'''
+
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from economicwebsite.database import retry_on_lock
+
+from .models import Trip, InternationalTrip, TripTotals
+
+
+# The TripTotals counter of every kind of trip.
+COUNTERS = {
+    Trip: 'trips',
+    InternationalTrip: 'international_trips',
+}
+
+
+def time_to_seconds(time):
+    ''' Turns a formattedTime ("HH:MM:SS") into seconds (0 if it is not one). '''
+
+    try:
+        hours, minutes, seconds = map(int, time.split(':'))
+    except (AttributeError, ValueError):
+        return 0
+
+    return hours * 3600 + minutes * 60 + seconds
+
+
+@retry_on_lock
+def add(user_id, model, count=1, distance=0, money=0, seconds=0):
+    ''' Adds to (or, with negative numbers, subtracts from) the totals of a user. '''
+
+    if user_id is None:
+        return
+
+    with transaction.atomic():
+        # Only adding creates the row: a subtraction may come from the
+        # cascade of a deleted user, whose row may already be gone.
+        if count > 0:
+            TripTotals.objects.get_or_create(user_id=user_id)
+        TripTotals.objects.filter(user_id=user_id).update(**{
+            COUNTERS[model]: F(COUNTERS[model]) + count,
+            'distance': F('distance') + distance,
+            'money': F('money') + money,
+            'seconds': F('seconds') + seconds,
+            'updated': timezone.now(),
+        })
+
+
+def add_trip(trip, sign=1):
+    add(trip.user_id, type(trip), sign, sign * trip.distance, sign * trip.money, sign * time_to_seconds(trip.time))
+
+
+def add_trips(user, model, trips):
+    ''' add() for trips that were inserted with bulk_create. '''
+
+    if trips:
+        add(user.pk, model, len(trips),
+            sum(trip.distance for trip in trips),
+            sum(trip.money for trip in trips),
+            sum(time_to_seconds(trip.time) for trip in trips))
+
+
+def rebuild(user=None):
+    ''' Recomputes the totals of every user (or just of `user`) from the trip tables. '''
+
+    rows = {}
+    for model, counter in COUNTERS.items():
+        trips = model.objects.exclude(user=None)
+        if user is not None:
+            trips = trips.filter(user=user)
+
+        for user_id, distance, money, time in trips.values_list('user', 'distance', 'money', 'time').iterator():
+            row = rows.setdefault(user_id, TripTotals(user_id=user_id))
+            setattr(row, counter, getattr(row, counter) + 1)
+            row.distance += distance
+            row.money += money
+            row.seconds += time_to_seconds(time)
+
+    with transaction.atomic():
+        existing = TripTotals.objects.all() if user is None else TripTotals.objects.filter(user=user)
+        existing.delete()
+        TripTotals.objects.bulk_create(rows.values(), batch_size=500)
+
+    return len(rows)
@@ -1,18 +1,36 @@
+from django.conf import settings
 from django.urls import path, re_path
 from django.contrib.auth import views as auth_views
 from . import views
 
 app_name = 'accounts'
 
+# The async trip views only pay off when the project is served through economicwebsite.asgi.
+if getattr(settings, 'ASYNC_TRIP_VIEWS', False):
+    trip_view, international_trip_view = views.AsyncTripView, views.AsyncInternationalTripView
+else:
+    trip_view, international_trip_view = views.TripView, views.InternationalTripView
+
 urlpatterns = [
     path('login/', auth_views.LoginView.as_view(template_name='accounts/login.html'), name='login'),
     path('logout/', auth_views.LogoutView.as_view(), name='logout'),
     path('signup/', views.SignUp.as_view(), name='signup'),
     path('profile/<slug:slug>/', views.Profile.as_view(), name='profile'),
     path('my_trips/', views.TripList.as_view(), name='my_trips'),
+    path('my_trips/<slug:kind>/', views.TripSection.as_view(), name='trip_section'),
     path('create_trip/', views.ChooseTripTypeView.as_view(), name='create_trip'),
-    path('non_international/', views.TripView.as_view(), name='non_international'),
-    path('international/', views.InternationalTripView.as_view(), name='international'),
+    path('non_international/', trip_view.as_view(), name='non_international'),
+    path('international/', international_trip_view.as_view(), name='international'),
+    path('import_trips/', views.ImportTripsView.as_view(), name='import_trips'),
+    path('route_matrix/', views.RouteMatrixView.as_view(), name='route_matrix'),
+    path('cost_grid/', views.CostGridView.as_view(), name='cost_grid'),
+    path('trip_status/', views.TripStatusView.as_view(), name='trip_status'),
+    path('export_trips/', views.TripExportView.as_view(), name='export_trips'),
+    path('api/trips/', views.TripApiView.as_view(), name='api_trips'),
+    path('api/trips/<slug:kind>/<int:pk>/', views.TripApiDetailView.as_view(), name='api_trip'),
+    path('autocomplete/', views.AutocompleteView.as_view(), name='autocomplete'),
+    path('delete_trips/', views.BulkTripDeleteView.as_view(), name='delete_trips'),
+    path('reprice_trips/', views.RepriceTripsView.as_view(), name='reprice_trips'),
     re_path(r'^delete_trip/(?P<pk>[0-9]+)$', views.TripDelete.as_view(), name='delete_trip'),
     re_path(r'^delete_inttrip/(?P<pk>[0-9]+)$', views.InternationalTripDelete.as_view(), name='delete_inttrip'),
 ]
\ No newline at end of file
@@ -1,12 +1,20 @@
-import requests
+import json
+import re
+from datetime import timedelta
 
+from asgiref.sync import sync_to_async
+
+from django.conf import settings
 from django.shortcuts import render
 from django.urls import reverse_lazy
-from django.views.generic import CreateView, DetailView, ListView, DeleteView, TemplateView
-from .models import User, Trip, InternationalTrip
+from django.views.generic import CreateView, DetailView, ListView, DeleteView, TemplateView, View, FormView
+from .models import User, Trip, InternationalTrip, TripTotals, SubmissionToken, DUPLICATE_TRIP
 from django.core.exceptions import ValidationError
-from django.db import IntegrityError
-from django.http import HttpResponseRedirect
+from django.db import IntegrityError, transaction
+from django.http import Http404, HttpResponse, HttpResponseRedirect, JsonResponse, StreamingHttpResponse
+from django.utils.cache import patch_cache_control
+from django.utils import timezone
+from django.utils.decorators import method_decorator
 
 from django.contrib.auth import authenticate, login
 
@@ -16,13 +24,21 @@ from django.contrib.messages.views import SuccessMessageMixin
 
 from braces.views import LoginRequiredMixin
 
+from . import api
+from . import bulk
+from . import conditional
 from . import forms
+from . import fragments
 from . import countries_info
+from . import route_queue
+from . import routing
+from . import importer
+from . import timeline
+from .autocomplete import autocomplete
 
 
+ROUTING_UNAVAILABLE = "We can't calculate your trip right now, please try again later!"
 
-# MapQuest API Key
-key = "03cXzah4oYwdKkvyfkPeeatkbBn2z3LO"
 
 
 class SignUp(CreateView):
@@ -44,8 +60,11 @@ class SignUp(CreateView):
         return valid
 
 
+@method_decorator(conditional.trips_condition, name='dispatch')
 class Profile(DetailView):
 
+    read_only = True  # served from the replica, see economicwebsite.database
+
     model = User
     slug_field = "username"
     template_name = "accounts/profile.html"
@@ -53,22 +72,77 @@ class Profile(DetailView):
     def get_object(self, *args, **kwargs):
         return self.request.user
 
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        # One primary key lookup instead of scanning both trip tables.
+        context['totals'] = TripTotals.objects.filter(user=self.request.user).first() or TripTotals()
 
-class TripList(ListView):
+        return context
+
+
+@method_decorator(conditional.trips_condition, name='dispatch')
+class TripList(TemplateView):
+    '''
+    The My Trips page. It is only the accordion: every section is loaded
+    (as a TripSection fragment) when it is opened.
+    '''
+
+    read_only = True
 
-    model = Trip
-    context_object_name = "trips"
     template_name = "accounts/my_trips.html"
-    # paginate_by = 3
 
-    def get_queryset(self):
-        return self.model.objects.filter(user=self.request.user)
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['status_poll'] = getattr(settings, 'TRIP_STATUS_POLL', 2000)
+
+        return context
+
+
+
+@method_decorator(conditional.trips_condition, name='dispatch')
+class TripSection(LoginRequiredMixin, TemplateView):
+    '''
+    One page of a My Trips section ('all', 'local' or 'international')
+    as an HTML fragment, see accounts.timeline.
+    The next page is asked for with the ?cursor= that this page links to.
+    '''
+
+    read_only = True
+
+    template_name = "accounts/trip_section.html"
+    sections = {
+        'all': ('local', 'international'),
+        'local': ('local',),
+        'international': ('international',),
+    }
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['international_trips'] = InternationalTrip.objects.filter(user=self.request.user)
+        kinds = self.sections.get(kwargs['kind'])
+        if kinds is None:
+            raise Http404
+
+        cursor = self.request.GET.get('cursor')
+        try:
+            context['trips'], context['next_cursor'] = timeline.timeline(self.request.user, kinds, cursor)
+        except timeline.InvalidCursor:
+            raise Http404
+        context['cursor'] = cursor
+
         return context
 
+    def get(self, request, *args, **kwargs):
+        # The rendered fragment only changes with the user's trips (see accounts.fragments).
+        key = fragments.make_key(request, kwargs['kind'], request.GET.get('cursor'))
+        content = fragments.get(key)
+        if content is not None:
+            return HttpResponse(content)
+
+        # Rendered by the handler, so MetricsMiddleware times the rendering.
+        response = super().get(request, *args, **kwargs)
+        response.add_post_render_callback(lambda response: fragments.store(key, response.content))
+        return response
+
 
 
 class ChooseTripTypeView(TemplateView):
@@ -77,62 +151,175 @@ class ChooseTripTypeView(TemplateView):
 
 
 
-class TripView(CreateView):
+class RoutedTripMixin:
+    '''
+    The common part of the (sync and async) TripView and InternationalTripView.
+    Gets the route between the two towns from the routing client and fills
+    in the distance, money and time fields before saving the trip.
+    '''
 
-    model = Trip
-    template_name = "accounts/non_international.html"
-    fields = ['country', 'From', 'to', 'fuel_cost', 'fuel_consumption']
-    success_url = reverse_lazy("accounts:my_trips")
+    def route_error(self, trip, route):
+        ''' Returns the error that should be shown for the route (None if the route is fine). '''
 
-    def get_context_data(self, **kwargs):
-        context = super().get_context_data(**kwargs)
-        context["non_international"] = context["form"]
+        # Checking whether the API statuscode signals an error.
+        if route['statuscode'] == 402:
+            return "It is impossible to travel by a car from {} to {}".format(trip.From.title(), trip.to.title())
 
-        return context
+        if 'distance' not in route:
+            return "One of the cities does not exist in our data set!"
+
+    def apply_route(self, form, route):
+        form.instance.set_route(route)
+        form.instance.user = self.request.user
+
+    def get_route(self, trip):
+        ''' The route of the trip, or None if it has to go through the background queue. '''
+
+        # With the queue only the routes that are already cached are answered right away.
+        if route_queue.enabled():
+            return routing.get_cached_route(*trip.locations())
+
+        return routing.get_route(*trip.locations())
+
+    def new_trip(self):
+        # The user is set before the validation, so Trip.clean() can find a duplicate before it gets routed.
+        user = self.request.user
+        return self.model(user=user if user.is_authenticated else None)
+
+    def get_form_kwargs(self):
+        kwargs = super().get_form_kwargs()
+        kwargs['instance'] = self.new_trip()
+        return kwargs
+
+    def submission_token(self):
+        '''
+        The form's one-time token (see forms.SubmissionTokenMixin), None if the
+        form was posted without one or by an anonymous user.
+        '''
+
+        token = self.request.POST.get('token', '')
+        if not self.request.user.is_authenticated or not re.fullmatch(r'[0-9a-f]{32}', token):
+            return None
+        return token
+
+    def claim_token(self):
+        '''
+        Claims the token of the posted form (the unique index of SubmissionToken
+        makes it atomic across the workers). False if another request has claimed
+        it: a double click, whose first submission is routing and saving the trip
+        (or has already done it).
+        '''
+
+        token = self.submission_token()
+        if token is None:
+            return True
+
+        # The user's expired claims go away first (so an expired token can be claimed again).
+        timeout = getattr(settings, 'TRIP_SUBMISSION_TOKEN_TIMEOUT', 10 * 60)
+        SubmissionToken.objects.filter(user=self.request.user,
+                                       created__lt=timezone.now() - timedelta(seconds=timeout)).delete()
+
+        try:
+            with transaction.atomic():
+                SubmissionToken.objects.create(user=self.request.user, token=token)
+        except IntegrityError:
+            return False
+        return True
+
+    def release_token(self):
+        '''
+        Gives the token back when the form is shown again with errors (or the
+        submission failed), so it can be resubmitted.
+        '''
+
+        token = self.submission_token()
+        if token is not None:
+            SubmissionToken.objects.filter(user=self.request.user, token=token).delete()
+
+    def post(self, request, *args, **kwargs):
+        if not self.claim_token():
+            return HttpResponseRedirect(self.success_url)
+
+        try:
+            return super().post(request, *args, **kwargs)
+        except Exception:
+            self.release_token()
+            raise
+
+    def form_invalid(self, form):
+        self.release_token()
+        return super().form_invalid(form)
 
+    def enqueue(self, form):
+        ''' Saves the trip as pending (see accounts.route_queue). Returns False if it is a duplicate. '''
+
+        form.instance.user = self.request.user
+        try:
+            route_queue.enqueue(form.instance)
+        except IntegrityError:
+            form.add_error('__all__', DUPLICATE_TRIP)
+            return False
+        return True
 
     def form_valid(self, form):
-        super().form_valid(form)
+        self.object = form.save(commit=False)
 
         try:
-            url = 'http://www.mapquestapi.com/directions/v2/optimizedroute?key=' + key + \
-                  '&json={"locations":["' + self.object.From + ',' + countries_info.countries[form.instance.country.lower()] + \
-                  '","' + self.object.to + ',' + countries_info.countries[form.instance.country.lower()] + '"]}'
+            route = self.get_route(self.object)
+        except routing.RoutingError:
+            form.add_error('__all__', ROUTING_UNAVAILABLE)
+            return self.form_invalid(form)
 
-            req = requests.get(url)
+        if route is None:
+            if not self.enqueue(form):
+                return self.form_invalid(form)
+            return HttpResponseRedirect(self.success_url)
 
-            json_obj = req.json()
+        error = self.route_error(self.object, route)
+        if error:
+            form.add_error('__all__', error)
+            return self.form_invalid(form)
 
-            self.object.country = self.object.country.capitalize()
-            self.object.From = self.object.From.capitalize()
-            self.object.to = self.object.to.capitalize()
+        self.apply_route(form, route)
 
+        try:
+            return super().form_valid(form)
+        except IntegrityError:
+            form.add_error('__all__', DUPLICATE_TRIP)
+            return self.form_invalid(form)
 
-            form.instance.distance = int(json_obj['route']['distance']*1.609344)
 
-            fuel_used = self.object.fuel_consumption*form.instance.distance
-        
-            form.instance.money = int(fuel_used*self.object.fuel_cost/100)
-            form.instance.time = json_obj['route']['formattedTime']
-            form.instance.user = self.request.user
-            
-        except (KeyError, IntegrityError):
-            form.add_error('__all__', "One of the cities does not exist in our data set!")
-            return super().form_invalid(form)
-        else:
-            try:
-                return super().form_valid(form)
-            except:
-                form.add_error('__all__', "You already have this trip in your MY TRIPS tab!")
-                return super().form_invalid(form)
+
+class LocalTripMixin(RoutedTripMixin):
+
+    model = Trip
+    template_name = "accounts/non_international.html"
+    form_class = forms.TripForm
 
 
 
-class InternationalTripView(CreateView):
+class InternationalTripMixin(RoutedTripMixin):
 
     model = InternationalTrip
     template_name = "accounts/international.html"
-    fields = ['first_country', 'From', 'second_country', 'to', 'fuel_cost', 'fuel_consumption']
+    form_class = forms.InternationalTripForm
+
+
+
+class TripView(LocalTripMixin, CreateView):
+
+    success_url = reverse_lazy("accounts:my_trips")
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context["non_international"] = context["form"]
+
+        return context
+
+
+
+class InternationalTripView(InternationalTripMixin, CreateView):
+
     success_url = reverse_lazy("accounts:my_trips")
 
     def get_context_data(self, **kwargs):
@@ -142,47 +329,204 @@ class InternationalTripView(CreateView):
 
         return context
 
+
+
+class AsyncRoutedTripView(RoutedTripMixin, View):
+    '''
+    An async version of the trip CreateViews (served through economicwebsite.asgi).
+    The routing call is awaited, so a worker can keep many trip creations
+    in flight. Everything that touches the DB (the auth user, the form
+    validation, saving and rendering) goes through sync_to_async.
+
+    The subclasses get the model, fields and template_name from the same
+    mixins as the sync views and define the `form_name` under which the
+    form is given to the template.
+    '''
+
+    form_name = None
+    success_url = reverse_lazy("accounts:my_trips")
+
+    def get_form_class(self):
+        return self.form_class
+
+    async def render_form(self, form):
+        if form.errors:
+            await sync_to_async(self.release_token)()
+
+        context = {'form': form, self.form_name: form}
+        return await sync_to_async(render)(self.request, self.template_name, context)
+
+    async def get(self, request, *args, **kwargs):
+        return await self.render_form(self.get_form_class()())
+
+    async def post(self, request, *args, **kwargs):
+        # Resolving the lazy user here, so that it isn't loaded inside the event loop.
+        await sync_to_async(lambda: request.user.pk)()
+
+        if not await sync_to_async(self.claim_token)():
+            return HttpResponseRedirect(self.success_url)
+
+        try:
+            return await self.submit(request)
+        except Exception:
+            await sync_to_async(self.release_token)()
+            raise
+
+    async def submit(self, request):
+        form = self.get_form_class()(request.POST, instance=self.new_trip())
+        if not await sync_to_async(form.is_valid)():
+            return await self.render_form(form)
+
+        self.object = form.save(commit=False)
+
+        try:
+            if route_queue.enabled():
+                route = await sync_to_async(self.get_route)(self.object)
+            else:
+                route = await routing.aget_route(*self.object.locations())
+        except routing.RoutingError:
+            form.add_error('__all__', ROUTING_UNAVAILABLE)
+            return await self.render_form(form)
+
+        if route is None:
+            if not await sync_to_async(self.enqueue)(form):
+                return await self.render_form(form)
+            return HttpResponseRedirect(self.success_url)
+
+        error = self.route_error(self.object, route)
+        if error:
+            form.add_error('__all__', error)
+            return await self.render_form(form)
+
+        self.apply_route(form, route)
+
+        try:
+            await sync_to_async(self.object.save)()
+        except IntegrityError:
+            form.add_error('__all__', DUPLICATE_TRIP)
+            return await self.render_form(form)
+
+        return HttpResponseRedirect(self.success_url)
+
+
+
+class AsyncTripView(LocalTripMixin, AsyncRoutedTripView):
+
+    form_name = "non_international"
+
+
+
+class AsyncInternationalTripView(InternationalTripMixin, AsyncRoutedTripView):
+
+    form_name = "international"
+
+
+
+class ImportTripsView(LoginRequiredMixin, FormView):
+    '''
+    Bulk creation of trips out of an uploaded CSV file (see accounts.importer).
+    Shows the report of the import on the same page.
+    '''
+
+    template_name = "accounts/import_trips.html"
+    form_class = forms.TripImportForm
+
     def form_valid(self, form):
+        try:
+            report = importer.import_uploaded_file(self.request.user, form.cleaned_data['file'])
+        except (importer.InvalidImportFile, UnicodeDecodeError) as e:
+            form.add_error('file', str(e))
+            return self.form_invalid(form)
+
+        return self.render_to_response(self.get_context_data(form=forms.TripImportForm(), report=report))
 
-        super().form_valid(form)
+
+
+class RouteMatrixView(LoginRequiredMixin, View):
+    '''
+    Takes a JSON body like:
+
+        {"cities": [{"city": "Sofia", "country": "Bulgaria"}, ...],
+         "fuel_cost": 1.5, "fuel_consumption": 7, "save": false}
+
+    and returns the distance, time and money of every ordered pair of
+    the cities (see accounts.matrix). With "save" the routed pairs are
+    also saved as trips.
+    '''
+
+    def post(self, request, *args, **kwargs):
+        # Imported by the first matrix request instead of by every worker that loads the views.
+        from . import matrix
 
         try:
-            url = 'http://www.mapquestapi.com/directions/v2/optimizedroute?key=' + key + \
-                  '&json={"locations":["' + self.object.From + ',' + countries_info.countries[form.instance.first_country.lower()] + \
-                  '","' + self.object.to + ',' + countries_info.countries[form.instance.second_country.lower()] + '"]}'
+            data = json.loads(request.body.decode('utf-8'))
+        except ValueError:
+            return JsonResponse({'error': "The body has to be JSON!"}, status=400)
+        if not isinstance(data, dict):
+            return JsonResponse({'error': "The body has to be a JSON object!"}, status=400)
 
-            req = requests.get(url)
+        form = forms.RouteMatrixForm(data)
+        if not form.is_valid():
+            return JsonResponse({'errors': form.errors}, status=400)
+        fuel_cost, fuel_consumption = form.cleaned_data['fuel_cost'], form.cleaned_data['fuel_consumption']
 
-            json_obj = req.json()
+        try:
+            cities = matrix.parse_cities(data.get('cities'))
+        except matrix.MatrixError as e:
+            return JsonResponse({'error': str(e)}, status=400)
 
-            # Checking whether the API statuscode signals an error.
-            if json_obj['info']['statuscode'] == 402:
-                form.add_error('__all__', "It is impossible to travel by a car from {} to {}".format(self.object.From.title(), self.object.to.title()))
-                return super().form_invalid(form)
+        results, routes = matrix.route_matrix(cities, fuel_cost, fuel_consumption)
 
-            self.object.first_country = self.object.first_country.capitalize()
-            self.object.second_country = self.object.second_country.capitalize()
-            self.object.From = self.object.From.capitalize()
-            self.object.to = self.object.to.capitalize()
+        response = {'cities': [{'city': city.name, 'country': city.country} for city in cities],
+                    'routes': results}
+        if form.cleaned_data['save']:
+            response['saved'] = matrix.save_trips(request.user, cities, routes, fuel_cost, fuel_consumption)
 
-            form.instance.distance = int(json_obj['route']['distance']*1.609344)
+        return JsonResponse(response)
 
-            fuel_used = self.object.fuel_consumption*form.instance.distance
-        
-            form.instance.money = int(fuel_used*self.object.fuel_cost/100)
-            form.instance.time = json_obj['route']['formattedTime']
-            form.instance.user = self.request.user
 
-            
-        except (KeyError, IntegrityError):
-            form.add_error('__all__', "One of the cities does not exist in our data set!")
-            return super().form_invalid(form)
-        else:
-            try:
-                return super().form_valid(form)
-            except:
-                form.add_error('__all__', "You already have this trip in your MY TRIPS tab!")
-                return super().form_invalid(form)
+
+class CostGridView(LoginRequiredMixin, View):
+    '''
+    GET the what-if cost table of a route (see accounts.costgrid): of a trip of
+    the user (?kind=local&id=1) or of a route that is already known
+    (?From=Sofia&from_country=Bulgaria&to=Varna&to_country=Bulgaria), over
+    ?cost_from=&cost_to=&cost_step= and ?consumption_from=&consumption_to=&consumption_step=.
+    Answers JSON, or with ?format=html a table fragment (cached like the My Trips ones).
+    '''
+
+    read_only = True
+
+    def get(self, request, *args, **kwargs):
+        from . import costgrid
+
+        form = forms.CostGridForm(request.GET)
+        if not form.is_valid():
+            return JsonResponse({'errors': form.errors}, status=400)
+        data = form.cleaned_data
+        costs, consumptions = form.ranges(costgrid.DEFAULT_COSTS, costgrid.DEFAULT_CONSUMPTIONS)
+
+        try:
+            if data['kind'] and data['id']:
+                distance = costgrid.trip_distance(timeline.KINDS[data['kind']], request.user, data['id'])
+            else:
+                distance = costgrid.route_distance(data['From'], data['from_country'], data['to'], data['to_country'])
+
+            if data['format'] != 'html':
+                return JsonResponse(costgrid.build(distance, costs, consumptions))
+
+            key = fragments.make_key(request, 'cost_grid', distance, costs, consumptions)
+            content = fragments.get(key)
+            if content is None:
+                table = costgrid.build(distance, costs, consumptions)
+                content = render(request, "accounts/cost_grid.html", {
+                    'table': table, 'rows': zip(table['fuel_consumptions'], table['money'])}).content
+                fragments.store(key, content)
+        except costgrid.GridError as e:
+            return JsonResponse({'error': str(e)}, status=400)
+
+        return HttpResponse(content)
+
 
 
 class TripDelete(SuccessMessageMixin, DeleteView):
@@ -191,6 +535,10 @@ class TripDelete(SuccessMessageMixin, DeleteView):
     success_url = reverse_lazy('accounts:my_trips')
     success_message = 'Your trip has been deleted successfully!'
 
+    def get_queryset(self):
+        # Only the user's own trips can be deleted.
+        return super().get_queryset().filter(user=self.request.user)
+
     def delete(self, request, *args, **kwargs):
         messages.warning(self.request, self.success_message)
         return super().delete(request, *args, **kwargs)
@@ -201,6 +549,197 @@ class InternationalTripDelete(SuccessMessageMixin, DeleteView):
     success_url = reverse_lazy('accounts:my_trips')
     success_message = 'Your international trip has been deleted successfully!'
 
+    def get_queryset(self):
+        # Only the user's own trips can be deleted.
+        return super().get_queryset().filter(user=self.request.user)
+
     def delete(self, request, *args, **kwargs):
         messages.warning(self.request, self.success_message)
-        return super().delete(request, *args, **kwargs)
\ No newline at end of file
+        return super().delete(request, *args, **kwargs)
+
+
+class BulkTripDeleteView(LoginRequiredMixin, View):
+    '''
+    Deletes the checked trips of My Trips, or all of the trips that match
+    the filters, with one DELETE per kind of trip (see accounts.bulk).
+    '''
+
+    success_url = reverse_lazy('accounts:my_trips')
+
+    def post(self, request, *args, **kwargs):
+        form = forms.BulkDeleteForm(request.POST)
+        if not form.is_valid():
+            for errors in form.errors.values():
+                messages.error(request, errors[0])
+            return HttpResponseRedirect(self.success_url)
+        data = form.cleaned_data
+
+        if data['matching']:
+            kinds = TripSection.sections[data['kind'] or 'all']
+            querysets = [timeline.filtered(kind, request.user, data['since'], data['until'], data['country'])
+                         for kind in kinds]
+        else:
+            querysets = [timeline.KINDS[kind].objects.filter(pk__in=data[kind]) for kind in timeline.KINDS if data[kind]]
+
+        deleted = bulk.delete_trips(request.user, querysets)
+        messages.warning(request, "{} trip(s) have been deleted successfully!".format(deleted))
+        return HttpResponseRedirect(self.success_url)
+
+
+
+class RepriceTripsView(LoginRequiredMixin, View):
+    '''
+    Reprices the user's trips (or the ones in a country) at today's fuel cost
+    with a set-based UPDATE, without routing them again (see accounts.repricing).
+    '''
+
+    success_url = reverse_lazy('accounts:my_trips')
+
+    def post(self, request, *args, **kwargs):
+        from . import repricing
+
+        form = forms.RepriceTripsForm(request.POST)
+        if not form.is_valid():
+            for errors in form.errors.values():
+                messages.error(request, errors[0])
+            return HttpResponseRedirect(self.success_url)
+
+        repriced = repricing.reprice(form.cleaned_data['fuel_cost'], user=request.user,
+                                     country=form.cleaned_data['country'])
+        messages.success(request, "{} trip(s) have been repriced at {}!".format(repriced, form.cleaned_data['fuel_cost']))
+        return HttpResponseRedirect(self.success_url)
+
+
+
+class TripExportView(LoginRequiredMixin, View):
+    '''
+    Streams the user's trips as a CSV (the default) or an NDJSON download,
+    filtered by ?kind=, ?since=/?until= (dates) and ?country=.
+    With ?gzip=1 the download is gzipped on the fly (see accounts.export).
+    '''
+
+    content_types = {
+        'csv': 'text/csv',
+        'ndjson': 'application/x-ndjson',
+    }
+
+    def get(self, request, *args, **kwargs):
+        from . import export
+
+        form = forms.TripExportForm(request.GET)
+        if not form.is_valid():
+            return JsonResponse({'errors': form.errors}, status=400)
+        data = form.cleaned_data
+
+        format = data['format'] or 'csv'
+        kinds = TripSection.sections[data['kind'] or 'all']
+        rows = export.rows(request.user, kinds, data['since'], data['until'], data['country'])
+
+        filename = "trips.{}".format(format)
+        content_type = self.content_types[format]
+        if data['gzip']:
+            filename, content_type = filename + ".gz", 'application/gzip'
+
+        response = StreamingHttpResponse(export.stream(rows, format, data['gzip']), content_type=content_type)
+        response['Content-Disposition'] = 'attachment; filename="{}"'.format(filename)
+        return response
+
+
+
+class TripStatusView(LoginRequiredMixin, View):
+    '''
+    GET ?local=1,2&international=3 returns the status (and, once routed,
+    the route) of those trips, for the pending trips on My Trips to poll.
+    '''
+
+    def get(self, request, *args, **kwargs):
+        ids = {}
+        for kind in timeline.KINDS:
+            try:
+                ids[kind] = [int(pk) for pk in request.GET.get(kind, '').split(',') if pk]
+            except ValueError:
+                return JsonResponse({'error': "The ids have to be numbers!"}, status=400)
+
+        return JsonResponse(route_queue.status(request.user, ids))
+
+
+
+class TripApiMixin(LoginRequiredMixin):
+    ''' The JSON API views (see accounts.api) answer a 403 instead of redirecting to the login. '''
+
+    raise_exception = True
+
+    def dispatch(self, request, *args, **kwargs):
+        try:
+            return super().dispatch(request, *args, **kwargs)
+        except api.ApiError as e:
+            return JsonResponse({'error': str(e)}, status=400)
+
+
+
+class TripApiView(TripApiMixin, View):
+    ''' Lists (GET), creates (POST) and deletes (DELETE) trips in batches. '''
+
+    def get(self, request, *args, **kwargs):
+        kinds = TripSection.sections.get(request.GET.get('kind') or 'all')
+        if kinds is None:
+            raise api.ApiError("The kind has to be all, local or international!")
+
+        fields = api.parse_fields(request.GET.get('fields'))
+        limit = api.parse_limit(request.GET.get('limit'))
+
+        return JsonResponse(api.list_trips(request.user, kinds, fields, request.GET.get('cursor'), limit))
+
+    def post(self, request, *args, **kwargs):
+        data = api.json_body(request)
+        items = data.get('trips') if isinstance(data, dict) and 'trips' in data else [data]
+        fields = api.parse_fields(request.GET.get('fields'))
+
+        result = api.create_trips(request.user, items, fields)
+        return JsonResponse(result, status=201 if result['created'] else 400)
+
+    def delete(self, request, *args, **kwargs):
+        return JsonResponse({'deleted': api.delete_trips(request.user, api.json_body(request))})
+
+
+
+class TripApiDetailView(TripApiMixin, View):
+    ''' Deletes one trip. '''
+
+    def delete(self, request, *args, **kwargs):
+        if kwargs['kind'] not in timeline.KINDS:
+            raise Http404
+
+        if not api.delete_trips(request.user, {kwargs['kind']: [kwargs['pk']]}):
+            raise Http404
+        return HttpResponse(status=204)
+
+
+
+class AutocompleteView(View):
+    '''
+    GET ?field=country|city&q=<prefix>[&country=<country>][&limit=<k>]
+    returns {"results": [...]}: the names that start with the prefix
+    (case and accents are ignored), the most used ones first.
+    The answers only change with the dataset, so they are cacheable.
+    '''
+
+    def get(self, request, *args, **kwargs):
+        field = request.GET.get('field', 'city')
+        prefix = request.GET.get('q', '')
+        max_results = getattr(settings, 'AUTOCOMPLETE_MAX_RESULTS', 10)
+        try:
+            limit = min(max(int(request.GET.get('limit', max_results)), 1), max_results)
+        except ValueError:
+            limit = max_results
+
+        if field == 'country':
+            results = autocomplete.countries(prefix, limit)
+        elif field == 'city':
+            results = autocomplete.cities(prefix, limit, request.GET.get('country'))
+        else:
+            return JsonResponse({'error': "The field has to be either country or city!"}, status=400)
+
+        response = JsonResponse({'results': list(results)})
+        patch_cache_control(response, public=True, max_age=getattr(settings, 'AUTOCOMPLETE_MAX_AGE', 3600))
+        return response
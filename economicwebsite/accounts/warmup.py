@@ -0,0 +1,184 @@
+'''
+The warm start of a worker: the loading that the first requests would otherwise pay for.
+
+    preload() - the cheap steps without database access: the gazetteer's city
+                index and the country table. AccountsConfig.ready() runs it
+                when WARMUP_ON_READY is set
+    warmup()  - preload() plus the routing backend (the requests import and the
+                MapQuest client's connection pool, or the road graph), the hot
+                slice of the route cache (the ROUTE_CACHE_HOT_SIZE most used
+                routes, see accounts.route_cache), the autocomplete index, a
+                database connection and the templates. economicwebsite.wsgi/asgi
+                run it when a server process starts (WARMUP_ON_START), so the
+                manage.py commands don't pay for it, and `manage.py warmup`
+                runs it on demand
+
+Both return the report of the steps: a list of (name, seconds, detail or error).
+A step that fails is logged and reported, it never stops the worker from starting.
+
+import_times() profiles the imports of a starting worker (python -X importtime),
+for `manage.py warmup --imports`.
+'''
+
+import logging
+import os
+import re
+import subprocess
+import sys
+import time
+from collections import namedtuple
+
+from django.conf import settings
+
+
+logger = logging.getLogger(__name__)
+
+# The templates of the pages that a user sees first.
+TEMPLATES = ('home.html', 'accounts/login.html', 'accounts/my_trips.html', 'accounts/trip_section.html',
+             'accounts/profile.html', 'accounts/non_international.html', 'accounts/international.html')
+
+
+def load_gazetteer():
+    from .gazetteer import gazetteer
+
+    if not os.path.exists(gazetteer.path):
+        return "no {}".format(gazetteer.path)
+    gazetteer.preload()
+    index = gazetteer.index()
+    return "{} countries, {} cities".format(len(index), sum(len(cities) for cities in index.values()))
+
+
+def load_countries():
+    from . import countries_info
+
+    return "{} countries".format(len(countries_info.countries))
+
+
+def load_routing():
+    from . import routing
+    from .backends import MapQuestBackend, get_backend
+
+    backend = get_backend()
+    if isinstance(backend, MapQuestBackend):
+        routing.get_client()
+    return type(backend).__name__
+
+
+def load_hot_routes(limit=None):
+    from . import route_cache
+
+    return "{} routes".format(route_cache.preload_hot(limit))
+
+
+def load_autocomplete():
+    from .autocomplete import autocomplete
+
+    autocomplete.preload()
+    return "ready"
+
+
+def connect():
+    from django.db import connections
+
+    for alias in connections:
+        connections[alias].ensure_connection()
+    return ", ".join(connections)
+
+
+def load_templates():
+    from django.template.loader import get_template
+
+    for name in TEMPLATES:
+        get_template(name)
+    return "{} templates".format(len(TEMPLATES))
+
+
+def run(steps):
+    report = []
+    for name, step in steps:
+        started = time.perf_counter()
+        try:
+            detail = step()
+        except Exception as e:
+            logger.warning("Warm-up step %s failed: %s", name, e)
+            detail = e
+        report.append((name, time.perf_counter() - started, detail))
+    return report
+
+
+def preload():
+    ''' The steps without database access (safe in AppConfig.ready(), which every manage.py command runs). '''
+
+    return run([('gazetteer', load_gazetteer),
+                ('countries', load_countries)])
+
+
+def warmup(routes=None):
+    '''
+    preload() plus the steps that use the database. `routes` is the size of the
+    hot slice of the route cache (ROUTE_CACHE_HOT_SIZE by default).
+    '''
+
+    from django.db import connections
+
+    report = preload()
+    try:
+        report += run([('routing', load_routing),
+                       ('database', connect),
+                       ('route cache', lambda: load_hot_routes(routes)),
+                       ('autocomplete', load_autocomplete),
+                       ('templates', load_templates)])
+    finally:
+        # With gunicorn --preload this runs before the workers get forked,
+        # and they must not share the connection.
+        connections.close_all()
+
+    return report
+
+
+def on_start():
+    ''' The warm-up of a server process (see economicwebsite.wsgi), if WARMUP_ON_START is set. '''
+
+    if not getattr(settings, 'WARMUP_ON_START', False):
+        return None
+
+    report = warmup()
+    logger.info("Warmed up in %.1f ms: %s", sum(seconds for name, seconds, detail in report) * 1000,
+                ", ".join("{} {:.1f} ms".format(name, seconds * 1000) for name, seconds, detail in report))
+    return report
+
+
+ImportTimes = namedtuple('ImportTimes', 'modules total')
+
+# "import time:  <self us> | <cumulative us> | <two spaces per nesting level><module>"
+_IMPORT_TIME = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \| ( *)(\S+)$')
+
+
+def import_times(modules=None):
+    '''
+    Sets Django up and imports the `modules` (the ROOT_URLCONF, so all of the
+    views, by default) in a fresh interpreter with -X importtime. Returns
+    ImportTimes: `modules` is a list of (module, self, cumulative) and `total`
+    the sum of the top-level imports, in microseconds.
+    '''
+
+    modules = modules or [settings.ROOT_URLCONF]
+    code = "import django; django.setup(); " + "; ".join("import " + module for module in modules)
+    env = dict(os.environ, DJANGO_SETTINGS_MODULE=os.environ.get('DJANGO_SETTINGS_MODULE', 'economicwebsite.settings'))
+
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], cwd=settings.BASE_DIR, env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, universal_newlines=True)
+    if result.returncode:
+        raise RuntimeError("The import profile failed:\n" + result.stderr[-2000:])
+
+    rows, total = [], 0
+    for line in result.stderr.splitlines():
+        match = _IMPORT_TIME.match(line)
+        if match is None:
+            continue
+        own, cumulative, indent, module = int(match.group(1)), int(match.group(2)), match.group(3), match.group(4)
+        rows.append((module, own, cumulative))
+        if not indent:
+            total += cumulative
+
+    return ImportTimes(rows, total)
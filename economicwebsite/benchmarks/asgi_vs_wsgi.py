@@ -0,0 +1,95 @@
+"""
+Compares the concurrent trip-creation throughput of the project served
+through economicwebsite.wsgi (gunicorn, sync views) and economicwebsite.asgi
+(uvicorn, async views) against the stub routing server with injected latency.
+
+    python benchmarks/asgi_vs_wsgi.py --requests 500 --concurrency 100 --latency 0.3
+
+Needs gunicorn, uvicorn and httpx on top of the project's requirements.
+The results are printed and written as JSON (--output).
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from accounts.stub_routing import StubRoutingServer
+from benchmarks import common
+
+
+def submit_trips(base_url, pairs, concurrency):
+    ''' Posts the trips from `concurrency` logged in sessions and measures them. '''
+
+    sessions = [common.login_session(base_url, 'bench{}'.format(i)) for i in range(concurrency)]
+    url = base_url + '/account/non_international/'
+
+    def submit(item):
+        i, (origin, destination) = item
+        session = sessions[i % concurrency]
+        started = time.monotonic()
+        response = session.post(url, data={'country': common.BENCH_COUNTRY, 'From': origin, 'to': destination,
+                                           'fuel_cost': '1.50', 'fuel_consumption': 7,
+                                           'csrfmiddlewaretoken': common.csrf_token(session)},
+                                headers={'Referer': url}, allow_redirects=False)
+        return response.status_code == 302, time.monotonic() - started
+
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(submit, enumerate(pairs)))
+    elapsed = time.monotonic() - started
+
+    latencies = [latency for ok, latency in results]
+    return {
+        'requests': len(results),
+        'errors': sum(1 for ok, latency in results if not ok),
+        'seconds': round(elapsed, 3),
+        'throughput': round(len(results) / elapsed, 2),
+        'p50_ms': round(common.percentile(latencies, 0.5) * 1000, 1),
+        'p95_ms': round(common.percentile(latencies, 0.95) * 1000, 1),
+    }
+
+
+def run(kind, args, workdir, stub):
+    env = common.bench_env(workdir, stub.url, ASYNC_TRIP_VIEWS='1' if kind == 'asgi' else '0')
+    common.prepare_database(env, ['bench{}'.format(i) for i in range(args.concurrency)])
+
+    port = common.free_port()
+    server = common.start_server(kind, env, port, workers=args.workers, threads=args.threads)
+    try:
+        # Every server gets its own, never routed before, pairs of cities.
+        pairs = list(common.city_pairs(args.requests, args.cities))
+        return submit_trips('http://127.0.0.1:{}'.format(port), pairs, args.concurrency)
+    finally:
+        common.stop_server(server)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=500)
+    parser.add_argument('--concurrency', type=int, default=100)
+    parser.add_argument('--latency', type=float, default=0.3, help="The stub routing server's latency in seconds.")
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--threads', type=int, default=4, help="Threads per gunicorn worker (WSGI only).")
+    parser.add_argument('--cities', type=int, default=100)
+    parser.add_argument('--output', default='asgi_vs_wsgi.json')
+    args = parser.parse_args()
+
+    results = {'parameters': vars(args)}
+    with tempfile.TemporaryDirectory() as workdir, StubRoutingServer(latency=args.latency) as stub:
+        common.write_gazetteer(os.path.join(workdir, 'countries.csv'), args.cities)
+        for kind in ('wsgi', 'asgi'):
+            results[kind] = run(kind, args, workdir, stub)
+            print(kind, results[kind])
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,154 @@
+"""
+Helpers shared by the benchmark scripts: a throwaway environment
+(database, gazetteer, stub routing server) and real server processes.
+"""
+
+import os
+import re
+import socket
+import subprocess
+import sys
+import time
+
+import requests
+
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+BENCH_COUNTRY = "Bulgaria"
+BENCH_PASSWORD = "bench-password-123"
+
+
+def city(i):
+    return "benchcity{}".format(i)
+
+
+def city_pairs(count, cities):
+    ''' Yields `count` distinct (From, to) pairs of the generated cities. '''
+
+    n = 0
+    for a in range(cities):
+        for b in range(cities):
+            if a == b:
+                continue
+            yield city(a), city(b)
+            n += 1
+            if n == count:
+                return
+
+
+def write_gazetteer(path, cities, countries=(BENCH_COUNTRY,)):
+    ''' Writes a countries.csv with the same `cities` generated cities in every one of the countries. '''
+
+    with open(path, 'w') as f:
+        f.write(",".join(countries) + "\n")
+        for i in range(cities):
+            f.write(",".join([city(i)] * len(countries)) + "\n")
+
+
+def bench_env(workdir, stub_url, **extra):
+    ''' The environment for the manage.py/server subprocesses. '''
+
+    env = dict(os.environ)
+    env.update({
+        'DJANGO_SETTINGS_MODULE': 'benchmarks.settings',
+        'BENCH_DB': os.path.join(workdir, 'bench.sqlite3'),
+        'BENCH_GAZETTEER': os.path.join(workdir, 'countries.csv'),
+        'MAPQUEST_URL': stub_url,
+        'PYTHONPATH': PROJECT_DIR,
+    })
+    env.update(extra)
+    return env
+
+
+def manage(env, *args):
+    subprocess.run([sys.executable, os.path.join(PROJECT_DIR, 'manage.py')] + list(args),
+                   env=env, cwd=PROJECT_DIR, check=True, stdout=subprocess.DEVNULL)
+
+
+def prepare_database(env, usernames):
+    ''' Migrates a fresh database and creates the benchmark users. '''
+
+    if os.path.exists(env['BENCH_DB']):
+        os.remove(env['BENCH_DB'])
+    manage(env, 'migrate', '--noinput')
+
+    code = ("from accounts.models import User\n"
+            "for name in {!r}:\n"
+            "    User.objects.create_user(name, name + '@example.com', {!r})\n").format(list(usernames), BENCH_PASSWORD)
+    manage(env, 'shell', '-c', code)
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def wait_for_port(port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=1):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError("The server did not start listening on port {}.".format(port))
+
+
+def start_server(kind, env, port, workers=1, threads=1):
+    '''
+    Starts a real server process for the project:
+    'wsgi' runs gunicorn (sync workers with threads), 'asgi' runs uvicorn.
+    '''
+
+    bind = '127.0.0.1:{}'.format(port)
+    if kind == 'wsgi':
+        command = [sys.executable, '-m', 'gunicorn', 'economicwebsite.wsgi:application',
+                   '--bind', bind, '--workers', str(workers), '--threads', str(threads),
+                   '--log-level', 'warning']
+    elif kind == 'asgi':
+        command = [sys.executable, '-m', 'uvicorn', 'economicwebsite.asgi:application',
+                   '--host', '127.0.0.1', '--port', str(port), '--workers', str(workers),
+                   '--log-level', 'warning']
+    else:
+        raise ValueError("Unknown server kind: {}".format(kind))
+
+    process = subprocess.Popen(command, env=env, cwd=PROJECT_DIR)
+    try:
+        wait_for_port(port)
+    except RuntimeError:
+        process.terminate()
+        raise
+    return process
+
+
+def stop_server(process):
+    process.terminate()
+    try:
+        process.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+
+def login_session(base_url, username):
+    ''' Returns a requests.Session that is logged in as `username`. '''
+
+    session = requests.Session()
+    page = session.get(base_url + '/account/login/')
+    token = re.search(r'name="csrfmiddlewaretoken" value="([^"]+)"', page.text).group(1)
+    session.post(base_url + '/account/login/',
+                 data={'username': username, 'password': BENCH_PASSWORD, 'csrfmiddlewaretoken': token},
+                 headers={'Referer': base_url + '/account/login/'}, allow_redirects=False)
+    return session
+
+
+def csrf_token(session):
+    return session.cookies.get('csrftoken')
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
@@ -0,0 +1,30 @@
+"""
+Settings for the benchmarks: the project's settings pointed at a throwaway
+database, a generated gazetteer and the stub routing server.
+The benchmark scripts fill in the environment variables.
+"""
+
+import os
+
+from economicwebsite.settings import *
+
+DEBUG = False
+
+ALLOWED_HOSTS = ['127.0.0.1', 'localhost', 'testserver']
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.environ.get('BENCH_DB', os.path.join(BASE_DIR, 'bench.sqlite3')),
+        'OPTIONS': {'timeout': 30},
+    }
+}
+
+GAZETTEER_PATH = os.environ.get('BENCH_GAZETTEER', os.path.join(BASE_DIR, 'countries.csv'))
+
+MAPQUEST_URL = os.environ.get('MAPQUEST_URL', MAPQUEST_URL)
+# The stub server doesn't check the key.
+MAPQUEST_KEY = MAPQUEST_KEY or 'stub'
+ROUTING_RETRIES = 0
+
+ASYNC_TRIP_VIEWS = os.environ.get('ASYNC_TRIP_VIEWS') == '1'
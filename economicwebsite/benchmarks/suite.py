@@ -0,0 +1,317 @@
+"""
+The benchmark suite: seeds a throwaway database with users that have a
+lot of trips (10-100k) and measures, against the stub routing server
+with injected latency:
+
+    - the trip creation throughput
+    - the My Trips (TripList and its sections) and Profile latency
+    - the signup and login cost
+    - the delete throughput (one by one and in bulk)
+
+in-process through the Django test client and, with --server, through a
+real gunicorn process. Every view that is measured through the test
+client also has its SQL queries counted against QUERY_BUDGETS; the
+suite exits with 1 when a view goes over its budget.
+
+    python benchmarks/suite.py --trips 100000 --latency 0.05 --output bench.json
+    python benchmarks/suite.py --baseline bench-before.json
+
+The results are written as JSON (with the git commit), --baseline prints
+the change of every timing against an earlier run.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from accounts.stub_routing import StubRoutingServer, fake_route
+from benchmarks import asgi_vs_wsgi, common
+
+
+SECOND_COUNTRY = "Germany"
+
+# The most SQL queries that a request to the view may make (what the views make
+# today; lower a budget when a view gets cheaper, never raise it quietly).
+QUERY_BUDGETS = {
+    'my_trips': 5,
+    'trip_section': 5,
+    'trip_section_page': 5,
+    'profile': 7,
+    'api_list': 3,
+    'create_trip': 17,
+    'signup': 15,
+    'login': 9,
+    'delete_trip': 10,
+    'bulk_delete': 10,
+}
+
+
+def setup_django(workdir, stub):
+    ''' Points the benchmark settings at the workdir and sets Django up in this process. '''
+
+    os.environ.update(common.bench_env(workdir, stub.url))
+
+    import django
+    django.setup()
+
+    from django.core.management import call_command
+    call_command('migrate', verbosity=0)
+
+
+def seed(username, trips, international, cities):
+    '''
+    Creates a user with `trips` routed trips (the `international` share of them
+    international) with bulk_create, like an import would.
+    '''
+
+    from accounts import totals
+    from accounts.models import User, Trip, InternationalTrip
+
+    user = User.objects.create_user(username, username + '@example.com', common.BENCH_PASSWORD)
+    international_count = int(trips * international)
+
+    def fill(trip):
+        distance, formatted_time = fake_route([trip.From, trip.to])
+        trip.user = user
+        trip.fuel_cost, trip.fuel_consumption = Decimal('1.50'), 7
+        trip.set_route({'statuscode': 0, 'distance': distance, 'formattedTime': formatted_time})
+        return trip
+
+    pairs = common.city_pairs(trips, cities)
+    local = [fill(Trip(country=common.BENCH_COUNTRY, From=origin, to=destination))
+             for origin, destination in (next(pairs) for i in range(trips - international_count))]
+    Trip.objects.bulk_create(local, batch_size=2000)
+
+    pairs = common.city_pairs(international_count, cities)
+    abroad = [fill(InternationalTrip(first_country=common.BENCH_COUNTRY, From=origin,
+                                     second_country=SECOND_COUNTRY, to=destination))
+              for origin, destination in pairs]
+    InternationalTrip.objects.bulk_create(abroad, batch_size=2000)
+
+    totals.rebuild(user=user)
+    return user
+
+
+class Recorder:
+    ''' Times the test client requests and checks their query counts against QUERY_BUDGETS. '''
+
+    def __init__(self):
+        self.results = {}
+        self.violations = []
+
+    def measure(self, name, function, repeat):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+
+        latencies, queries = [], 0
+        for i in range(repeat):
+            with CaptureQueriesContext(connection) as captured:
+                started = time.perf_counter()
+                response = function(i)
+                latencies.append(time.perf_counter() - started)
+            queries = max(queries, len(captured))
+            if response.status_code >= 400:
+                raise RuntimeError("{} answered with {}.".format(name, response.status_code))
+
+        result = summary(latencies)
+        result['max_queries'] = queries
+        budget = QUERY_BUDGETS.get(name)
+        if budget is not None:
+            result['query_budget'] = budget
+            if queries > budget:
+                self.violations.append("{}: {} queries (budget {})".format(name, queries, budget))
+
+        self.results[name] = result
+        print(name, result)
+        return result
+
+
+def summary(latencies):
+    total = sum(latencies)
+    return {
+        'requests': len(latencies),
+        'throughput': round(len(latencies) / total, 2) if total else None,
+        'mean_ms': round(total / len(latencies) * 1000, 2),
+        'p50_ms': round(common.percentile(latencies, 0.5) * 1000, 2),
+        'p95_ms': round(common.percentile(latencies, 0.95) * 1000, 2),
+    }
+
+
+def run_client(args, recorder, user):
+    ''' The in-process measurements through the Django test client. '''
+
+    from django.core.cache import cache
+    from django.test import Client
+    from accounts import timeline
+    from accounts.models import Trip, InternationalTrip
+
+    client = Client()
+    client.force_login(user)
+
+    # The first page of a section is measured without the fragment cache, like the first visit.
+    def cold(url):
+        def get(i):
+            cache.clear()
+            return client.get(url)
+        return get
+
+    recorder.measure('my_trips', lambda i: client.get('/account/my_trips/'), args.repeat)
+    recorder.measure('trip_section', cold('/account/my_trips/all/'), args.repeat)
+    recorder.measure('trip_section_cached', lambda i: client.get('/account/my_trips/all/'), args.repeat)
+
+    # A page deep down the timeline costs the same as the first one (keyset pagination).
+    rows, cursor = timeline.timeline(user, limit=args.trips // 2)
+    recorder.measure('trip_section_page', cold('/account/my_trips/all/?cursor={}'.format(cursor)), args.repeat)
+    recorder.measure('profile', lambda i: client.get('/account/profile/{}/'.format(user.username)), args.repeat)
+    recorder.measure('api_list', lambda i: client.get('/account/api/trips/?fields=id,From,to'), args.repeat)
+
+    # New pairs (in the second country, which has no local trips yet) go through the stub routing server.
+    pairs = list(common.city_pairs(args.creates, args.cities))
+    recorder.measure('create_trip', lambda i: client.post('/account/non_international/', {
+        'country': SECOND_COUNTRY, 'From': pairs[i][0], 'to': pairs[i][1],
+        'fuel_cost': '1.50', 'fuel_consumption': 7}), args.creates)
+
+    anonymous = Client()
+    recorder.measure('signup', lambda i: Client().post('/account/signup/', {
+        'username': 'benchsignup{}'.format(i), 'email': 'signup{}@example.com'.format(i),
+        'password1': common.BENCH_PASSWORD, 'password2': common.BENCH_PASSWORD}), args.logins)
+    recorder.measure('login', lambda i: anonymous.post('/account/login/', {
+        'username': user.username, 'password': common.BENCH_PASSWORD}), args.logins)
+
+    local = list(Trip.objects.filter(user=user).values_list('id', flat=True)[:args.deletes])
+    recorder.measure('delete_trip', lambda i: client.post('/account/delete_trip/{}'.format(local[i])), len(local))
+
+    batches = list(InternationalTrip.objects.filter(user=user).values_list('id', flat=True)[:args.deletes * 10])
+    size = max(1, len(batches) // 10)
+    recorder.measure('bulk_delete', lambda i: client.post('/account/delete_trips/', {
+        'international': batches[i * size:(i + 1) * size]}), 10)
+    recorder.results['bulk_delete']['trips_per_request'] = size
+
+
+def run_server(args, workdir, stub, usernames):
+    '''
+    The same kind of load through a real server process (gunicorn): the trip
+    submissions of asgi_vs_wsgi.py plus concurrent My Trips reads.
+    '''
+
+    from django.db import connections
+    from accounts.models import User
+
+    # The sessions that asgi_vs_wsgi.submit_trips() logs in as.
+    for i in range(args.concurrency):
+        User.objects.create_user('bench{}'.format(i), 'bench{}@example.com'.format(i), common.BENCH_PASSWORD)
+    connections.close_all()
+
+    env = common.bench_env(workdir, stub.url)
+    port = common.free_port()
+    server = common.start_server('wsgi', env, port, workers=args.workers, threads=args.threads)
+    base_url = 'http://127.0.0.1:{}'.format(port)
+    results = {}
+    try:
+        # The seeded user's pairs were never routed, so every submission reaches the stub.
+        pairs = list(common.city_pairs(args.server_requests, args.cities))
+        results['create_trip'] = asgi_vs_wsgi.submit_trips(base_url, pairs, args.concurrency)
+        print('server', 'create_trip', results['create_trip'])
+
+        sessions = [common.login_session(base_url, username) for username in usernames]
+
+        def timed(session, url):
+            started = time.perf_counter()
+            response = session.get(base_url + url)
+            return response.status_code == 200, time.perf_counter() - started
+
+        for name, url in (('my_trips', '/account/my_trips/'), ('trip_section', '/account/my_trips/all/')):
+            with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+                outcomes = list(executor.map(lambda i: timed(sessions[i % len(sessions)], url), range(args.server_requests)))
+            results[name] = summary([latency for ok, latency in outcomes])
+            results[name]['errors'] = sum(1 for ok, latency in outcomes if not ok)
+            print('server', name, results[name])
+    finally:
+        common.stop_server(server)
+
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=common.PROJECT_DIR, check=True,
+                              stdout=subprocess.PIPE, stderr=subprocess.DEVNULL).stdout.decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline_path):
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+
+    print("Against {} ({}):".format(baseline_path, baseline.get('commit')))
+    for section in ('client', 'server'):
+        for name, result in results.get(section, {}).items():
+            before = baseline.get(section, {}).get(name)
+            if before and before.get('p50_ms') and result.get('p50_ms'):
+                change = (result['p50_ms'] - before['p50_ms']) / before['p50_ms'] * 100
+                print("  {} {}: p50 {} -> {} ms ({:+.1f}%)".format(section, name, before['p50_ms'], result['p50_ms'], change))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--trips', type=int, default=10000, help="The trips of the seeded user.")
+    parser.add_argument('--international', type=float, default=0.2, help="The international share of the trips.")
+    parser.add_argument('--latency', type=float, default=0.05, help="The stub routing server's latency in seconds.")
+    parser.add_argument('--repeat', type=int, default=20, help="Requests per read-only measurement.")
+    parser.add_argument('--creates', type=int, default=50)
+    parser.add_argument('--deletes', type=int, default=50)
+    parser.add_argument('--logins', type=int, default=5)
+    parser.add_argument('--server', action='store_true', help="Also measure through a real gunicorn process.")
+    parser.add_argument('--server-requests', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--output', default='bench.json')
+    parser.add_argument('--baseline', default=None, help="An earlier --output to compare the timings with.")
+    args = parser.parse_args()
+
+    # Enough cities for all of the (From, to) pairs.
+    args.cities = int((args.trips + args.creates) ** 0.5) + 2
+
+    results = {'commit': git_commit(), 'parameters': vars(args)}
+    recorder = Recorder()
+    with tempfile.TemporaryDirectory() as workdir, StubRoutingServer(latency=args.latency) as stub:
+        common.write_gazetteer(os.path.join(workdir, 'countries.csv'), args.cities,
+                               countries=(common.BENCH_COUNTRY, SECOND_COUNTRY))
+        setup_django(workdir, stub)
+
+        started = time.perf_counter()
+        user = seed('benchuser', args.trips, args.international, args.cities)
+        results['seed_seconds'] = round(time.perf_counter() - started, 2)
+        print('seeded', args.trips, 'trips in', results['seed_seconds'], 's')
+
+        run_client(args, recorder, user)
+        results['client'] = recorder.results
+        results['stub_requests'] = stub.requests
+
+        if args.server:
+            results['server'] = run_server(args, workdir, stub, [user.username])
+
+    results['budget_violations'] = recorder.violations
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+
+    if args.baseline:
+        compare(results, args.baseline)
+
+    if recorder.violations:
+        print("Over the query budget:\n  " + "\n  ".join(recorder.violations))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,23 @@
+"""
+ASGI config for economicwebsite project.
+
+It exposes the ASGI callable as a module-level variable named ``application``.
+Serve it with an ASGI server (e.g. ``uvicorn economicwebsite.asgi:application``)
+together with ASYNC_TRIP_VIEWS = True, so that the trip views await the
+routing calls instead of blocking a worker.
+
+For more information on this file, see
+https://docs.djangoproject.com/en/stable/howto/deployment/asgi/
+"""
+
+import os
+
+from django.core.asgi import get_asgi_application
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'economicwebsite.settings')
+
+application = get_asgi_application()
+
+# The routing client, the hot routes and the rest of accounts.warmup (WARMUP_ON_START).
+from accounts import warmup
+warmup.on_start()
@@ -0,0 +1,196 @@
+"""
+The production database layer:
+
+    databases()         - settings.DATABASES out of the environment: the bundled
+                          SQLite file by default or PostgreSQL (DATABASE_ENGINE=postgresql),
+                          with persistent connections and an optional 'replica' alias
+    configure_connection - puts every new SQLite connection in WAL mode with a busy timeout
+    ReplicaRouter       - sends the reads of the read-only views to the replica
+    ReplicaMiddleware   - marks the requests to those views (see `read_only`)
+    retry_on_lock       - retries a write transaction that lost a lock
+
+The views opt in to the replica with a `read_only = True` class attribute.
+Right after a write the user's reads stay on the primary for
+DATABASE_REPLICA_PIN seconds (a cookie), so they always see their own
+changes (and the fragment cache never stores a page that the replica
+didn't catch up with yet).
+"""
+
+import contextvars
+import functools
+import logging
+import os
+import random
+import time
+
+from django.db import OperationalError, transaction
+from django.db.backends.signals import connection_created
+
+
+logger = logging.getLogger(__name__)
+
+REPLICA = 'replica'
+PIN_COOKIE = 'db_primary'
+
+# The PostgreSQL errors that mean "run the transaction again": serialization failure and deadlock.
+RETRYABLE_PGCODES = ('40001', '40P01')
+
+_read_only = contextvars.ContextVar('read_only', default=False)
+
+
+def databases(base_dir, environ=os.environ):
+    ''' Returns the DATABASES setting, configured by the DATABASE_* environment variables. '''
+
+    engine = environ.get('DATABASE_ENGINE', 'sqlite')
+    conn_max_age = int(environ.get('DATABASE_CONN_MAX_AGE', 60))
+
+    if engine == 'postgresql':
+        primary = {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': environ.get('DATABASE_NAME', 'economicwebsite'),
+            'USER': environ.get('DATABASE_USER', ''),
+            'PASSWORD': environ.get('DATABASE_PASSWORD', ''),
+            'HOST': environ.get('DATABASE_HOST', ''),
+            'PORT': environ.get('DATABASE_PORT', ''),
+            'CONN_MAX_AGE': conn_max_age,
+            'CONN_HEALTH_CHECKS': True,
+            'OPTIONS': {'connect_timeout': 5},
+        }
+        replica = {'HOST': environ['DATABASE_REPLICA_HOST']} if environ.get('DATABASE_REPLICA_HOST') else None
+    elif engine == 'sqlite':
+        primary = {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': environ.get('DATABASE_NAME', os.path.join(base_dir, 'db.sqlite3')),
+            'CONN_MAX_AGE': conn_max_age,
+            # How long a writer waits for the lock is settings.DATABASE_BUSY_TIMEOUT (see configure_connection()).
+        }
+        replica = {'NAME': environ['DATABASE_REPLICA_NAME']} if environ.get('DATABASE_REPLICA_NAME') else None
+    else:
+        raise ValueError("Unknown DATABASE_ENGINE: {}".format(engine))
+
+    result = {'default': primary}
+    if replica is not None:
+        result[REPLICA] = dict(primary, TEST={'MIRROR': 'default'}, **replica)
+
+    return result
+
+
+def configure_connection(sender, connection, **kwargs):
+    '''
+    WAL lets the readers and the (one) writer of the SQLite file work at the same
+    time, and the busy timeout makes a writer wait for the lock instead of failing
+    with "database is locked" right away. synchronous=NORMAL is safe in WAL mode.
+    '''
+
+    if connection.vendor != 'sqlite':
+        return
+
+    from django.conf import settings
+
+    busy_timeout = getattr(settings, 'DATABASE_BUSY_TIMEOUT', 5000)
+    with connection.cursor() as cursor:
+        cursor.execute('PRAGMA journal_mode=WAL')
+        cursor.execute('PRAGMA synchronous=NORMAL')
+        cursor.execute('PRAGMA busy_timeout={:d}'.format(busy_timeout))
+
+
+connection_created.connect(configure_connection, dispatch_uid='economicwebsite.database.configure_connection')
+
+
+class ReplicaRouter:
+    '''
+    The reads of the requests that ReplicaMiddleware marked as read-only go to the
+    replica (when there is one), everything else goes to the primary.
+    '''
+
+    def db_for_read(self, model, **hints):
+        from django.conf import settings
+
+        if _read_only.get() and REPLICA in settings.DATABASES:
+            return REPLICA
+        return 'default'
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # The replica has the same rows as the primary.
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == 'default'
+
+
+def is_read_only(view_func):
+    view_class = getattr(view_func, 'view_class', None)
+    return getattr(view_class or view_func, 'read_only', False)
+
+
+class ReplicaMiddleware:
+    '''
+    Marks the GET/HEAD requests to the read-only views for ReplicaRouter and pins the
+    user to the primary for DATABASE_REPLICA_PIN seconds after every other request.
+    '''
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        from django.conf import settings
+
+        # The mark lasts until the response (lazily rendered templates included) is done.
+        token = _read_only.set(False)
+        try:
+            response = self.get_response(request)
+        finally:
+            _read_only.reset(token)
+
+        if REPLICA in settings.DATABASES and request.method not in ('GET', 'HEAD', 'OPTIONS'):
+            response.set_cookie(PIN_COOKIE, '1', max_age=getattr(settings, 'DATABASE_REPLICA_PIN', 10), httponly=True)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if request.method in ('GET', 'HEAD') and PIN_COOKIE not in request.COOKIES and is_read_only(view_func):
+            _read_only.set(True)
+
+
+def is_lock_error(error):
+    ''' Whether the OperationalError only means that the transaction lost a lock race. '''
+
+    message = str(error).lower()
+    if 'database is locked' in message or 'database table is locked' in message:
+        return True
+    return getattr(error.__cause__, 'pgcode', None) in RETRYABLE_PGCODES
+
+
+def retry_on_lock(func):
+    '''
+    Retries the decorated write (a whole transaction) up to DATABASE_LOCK_RETRIES
+    times, with a jittered exponential backoff, when it fails on lock contention.
+    Inside an outer transaction it runs once: only the outermost one can be retried.
+    '''
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        from django.conf import settings
+
+        if transaction.get_connection().in_atomic_block:
+            return func(*args, **kwargs)
+
+        retries = getattr(settings, 'DATABASE_LOCK_RETRIES', 5)
+        backoff = getattr(settings, 'DATABASE_LOCK_BACKOFF', 0.05)
+
+        attempt = 0
+        while True:
+            try:
+                return func(*args, **kwargs)
+            except OperationalError as error:
+                if attempt >= retries or not is_lock_error(error):
+                    raise
+                attempt += 1
+                delay = backoff * 2 ** (attempt - 1) * random.uniform(0.5, 1.5)
+                logger.warning("%s lost a database lock (%s), retry %d in %.3fs",
+                               func.__qualname__, error, attempt, delay)
+                time.sleep(delay)
+
+    return wrapper
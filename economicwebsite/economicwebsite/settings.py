@@ -12,6 +12,8 @@ https://docs.djangoproject.com/en/2.1/ref/settings/
 
 import os
 
+from .database import databases
+
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
@@ -40,13 +42,15 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
-    'accounts',
+    'accounts.apps.AccountsConfig',
     'bootstrap3',
     'avatar',
 
 ]
 
 MIDDLEWARE = [
+    'accounts.metrics.MetricsMiddleware',
+    'economicwebsite.database.ReplicaMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -75,17 +79,21 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'economicwebsite.wsgi.application'
+ASGI_APPLICATION = 'economicwebsite.asgi.application'
 
 
 # Database
 # https://docs.djangoproject.com/en/2.1/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
-    }
-}
+# Configured by the DATABASE_* environment variables (see economicwebsite.database):
+# the SQLite file in WAL mode by default, DATABASE_ENGINE=postgresql in production.
+DATABASES = databases(BASE_DIR)
+
+DATABASE_ROUTERS = ['economicwebsite.database.ReplicaRouter']
+DATABASE_BUSY_TIMEOUT = 5000  # milliseconds that an SQLite writer waits for the lock
+DATABASE_LOCK_RETRIES = 5  # retries of a write transaction that lost a lock
+DATABASE_LOCK_BACKOFF = 0.05  # seconds before the first retry, doubled every time
+DATABASE_REPLICA_PIN = 10  # seconds that the reads stay on the primary after a write
 
 
 # Password validation
@@ -130,14 +138,132 @@ STATICFILES_DIRS = [
     STATIC_DIR,
 ]
 
+# `manage.py build_static` collects, minifies, hashes and precompresses the files
+# into STATIC_ROOT (see economicwebsite.storage), which /static/ is served from.
+STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
+STATICFILES_STORAGE = 'economicwebsite.storage.PipelineStaticFilesStorage'
+STATIC_MAX_AGE = 300  # the Cache-Control max-age of the files that aren't content-hashed
+STATIC_WEBP_QUALITY = 80
+
 
 MEDIA_URL = '/media/'
 MEDIA_ROOT = MEDIA_DIR
 
 
+LOGIN_URL = 'accounts:login'
 LOGIN_REDIRECT_URL = 'home'
 LOGOUT_REDIRECT_URL = 'home'
 
-AVATAR_CACHE_ENABLED = False
+# Caches (the avatars, accounts.fragments, accounts.autocomplete). Every worker
+# process gets its own local memory cache by default; point CACHE_BACKEND and
+# CACHE_LOCATION at a shared cache (memcached, Redis) in production, so that
+# the invalidations reach all of them.
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('CACHE_LOCATION', 'economicwebsite'),
+    }
+}
 
-AVATAR_GRAVATAR_DEFAULT = "https://moonvillageassociation.org/wp-content/uploads/2018/06/default-profile-picture1.jpg"
\ No newline at end of file
+# django-avatar caches the avatar tags' HTML/URLs per user until the avatar
+# changes. It invalidates them in the cache of the worker that saw the change,
+# so only with a shared cache (a LocMemCache would keep the old avatar elsewhere).
+AVATAR_CACHE_ENABLED = CACHES['default']['BACKEND'] != 'django.core.cache.backends.locmem.LocMemCache'
+AVATAR_CACHE_TIMEOUT = 7 * 24 * 60 * 60
+# The thumbnails get generated at upload time in the sizes that the templates
+# use (base.html: 50, the profile and avatar/change.html: 100).
+AVATAR_AUTO_GENERATE_SIZES = (50, 100)
+
+AVATAR_GRAVATAR_DEFAULT = "https://moonvillageassociation.org/wp-content/uploads/2018/06/default-profile-picture1.jpg"
+
+# Route cache (accounts.route_cache)
+ROUTE_CACHE_TTL = 30 * 24 * 60 * 60
+ROUTE_CACHE_MAX_ENTRIES = 50000
+# The expired and the least recently used routes are evicted once every
+# ROUTE_CACHE_EVICT_EVERY stored routes per worker (0: only by `manage.py evict_routes`).
+ROUTE_CACHE_EVICT_EVERY = 100
+# The most used routes are also kept in every worker's memory (0 turns it off);
+# their hits are written to the table at most once every ROUTE_CACHE_HOT_TOUCH seconds.
+ROUTE_CACHE_HOT_SIZE = 1000
+ROUTE_CACHE_HOT_TOUCH = 60
+
+# Warm start (accounts.warmup): AppConfig.ready() loads the city index and the
+# country table, the server processes (wsgi.py/asgi.py) also warm the routing
+# client, the hot routes, the autocomplete and the templates. See `manage.py warmup`.
+WARMUP_ON_READY = True
+WARMUP_ON_START = True
+
+# Routing (accounts.routing, accounts.backends)
+# 'accounts.backends.MapQuestBackend' or 'accounts.backends.LocalGraphBackend'
+ROUTING_BACKEND = 'accounts.backends.MapQuestBackend'
+ROAD_GRAPH_DIR = os.path.join(BASE_DIR, 'road_graph')
+
+# MapQuest API Key (from the environment only, `manage.py check` reports it when it is missing)
+MAPQUEST_KEY = os.environ.get('MAPQUEST_KEY', '')
+MAPQUEST_URL = "http://www.mapquestapi.com/directions/v2/optimizedroute"
+MAPQUEST_MATRIX_URL = "http://www.mapquestapi.com/directions/v2/routematrix"
+ROUTING_TIMEOUT = (3.05, 10)  # (connect, read) in seconds
+ROUTING_RETRIES = 2
+ROUTING_BACKOFF = 0.25
+ROUTING_POOL_SIZE = 10
+ROUTING_BREAKER_THRESHOLD = 5
+ROUTING_BREAKER_RESET = 30
+ROUTING_ASYNC_POOL_SIZE = 100
+# Threads that route in parallel during bulk operations (imports, matrices).
+ROUTING_BULK_WORKERS = 8
+
+# How long the claimed one-time token of a trip form (a double-clicked submission
+# isn't routed twice) is kept, see accounts.models.SubmissionToken.
+TRIP_SUBMISSION_TOKEN_TIMEOUT = 10 * 60
+
+# Serve the trip creation views as async views (needs economicwebsite.asgi, Django >= 4.1 and httpx).
+ASYNC_TRIP_VIEWS = False
+
+# Bulk trip import (accounts.importer)
+IMPORT_BATCH_SIZE = 500
+
+# Distance matrix (accounts.matrix)
+ROUTE_MATRIX_MAX_CITIES = 25
+
+# What-if cost table (accounts.costgrid): fuel costs x fuel consumptions
+COST_GRID_MAX_CELLS = 2500
+
+# My Trips (accounts.timeline)
+TRIPS_PAGE_SIZE = 20
+
+# City/country autocomplete (accounts.autocomplete)
+AUTOCOMPLETE_MAX_RESULTS = 10
+AUTOCOMPLETE_MAX_AGE = 3600  # the Cache-Control max-age of the answers
+AUTOCOMPLETE_USAGE_TTL = 3600  # how often the usage ranking gets recounted (in a background thread)
+
+# My Trips fragment cache (accounts.fragments). The fragments are versioned by
+# the TripTotals rows, so every worker sees the invalidations with any cache backend.
+TRIP_FRAGMENT_CACHE = 'default'
+TRIP_FRAGMENT_CACHE_TIMEOUT = 24 * 60 * 60
+
+# JSON API (accounts.api)
+API_MAX_PAGE_SIZE = 100
+API_BATCH_LIMIT = 100
+
+# Background routing (accounts.route_queue): the trip views save the trips as
+# pending and `manage.py run_route_workers` routes them.
+ROUTING_QUEUE = False
+ROUTE_QUEUE_BATCH_SIZE = 50
+ROUTE_QUEUE_POLL = 1.0  # seconds between the polls of an empty queue
+ROUTE_QUEUE_MAX_ATTEMPTS = 5
+ROUTE_QUEUE_BACKOFF = 30  # seconds before the first retry, doubled every time
+ROUTE_QUEUE_MAX_BACKOFF = 3600
+ROUTE_QUEUE_LOCK_TIMEOUT = 300  # the jobs of a worker that died get requeued after this
+TRIP_STATUS_POLL = 2000  # milliseconds between the My Trips status polls
+
+# My Trips bulk delete (accounts.bulk)
+BULK_DELETE_MAX_IDS = 500
+
+# Repricing at a new fuel cost (accounts.repricing): trips per UPDATE of `manage.py reprice_trips`
+REPRICE_BATCH_SIZE = 5000
+
+# Metrics (accounts.metrics): the bearer token of the scrapers of /metrics (the staff
+# can always see it, nobody else without a token) and the duration (seconds) above
+# which a request gets logged as slow (None - never).
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+SLOW_REQUEST_THRESHOLD = 1.0
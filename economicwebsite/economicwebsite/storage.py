@@ -0,0 +1,300 @@
+"""
+The static pipeline (`manage.py build_static` runs it):
+
+    PipelineStaticFilesStorage - the STATICFILES_STORAGE. On collectstatic it
+                                 minifies the CSS/JS and re-encodes the images
+                                 smaller, then writes the content-hashed copies
+                                 (ManifestStaticFilesStorage) and, next to every
+                                 one of them, a .gz, a .br (with the optional
+                                 brotli package) and, for the images, a .webp
+    serve                      - serves STATIC_ROOT: the best precompressed or
+                                 WebP sibling that the browser accepts, with an
+                                 immutable Cache-Control for the hashed names.
+                                 Only routed with DEBUG; in production the web
+                                 server serves STATIC_ROOT the same way (e.g.
+                                 nginx with gzip_static/brotli_static and a
+                                 far-future expires for the hashed names)
+
+Until the pipeline has run (no manifest yet) {% static %} keeps the plain
+names, so a checkout works without a build.
+"""
+
+import gzip
+import io
+import mimetypes
+import os
+import re
+
+from django.conf import settings
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+from django.core.files.base import ContentFile
+from django.http import FileResponse, Http404, HttpResponseNotModified
+from django.utils._os import safe_join
+from django.utils.cache import patch_vary_headers
+from django.utils.http import http_date
+from django.views.static import was_modified_since
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+MINIFIED = ('.css', '.js')
+COMPRESSED = ('.css', '.js', '.svg', '.html', '.txt', '.json')
+IMAGES = ('.png', '.jpg', '.jpeg')
+
+# The files smaller than this aren't worth a compressed sibling.
+MIN_COMPRESS_SIZE = 256
+
+IMMUTABLE = 'public, max-age=31536000, immutable'
+
+# Strings and comments, which the minifiers have to step over as a whole.
+_CSS_TOKENS = re.compile(r'"(?:\\.|[^"\\])*"|\'(?:\\.|[^\'\\])*\'|/\*.*?\*/', re.S)
+_JS_TOKENS = re.compile(r'"(?:\\.|[^"\\\n])*"|\'(?:\\.|[^\'\\\n])*\'|`(?:\\.|[^`\\])*`|/\*.*?\*/|//[^\n]*', re.S)
+
+
+def minify_css(css):
+    ''' Drops the comments and the whitespace that the CSS syntax doesn't need (strings are kept as they are). '''
+
+    def squeeze(text):
+        text = re.sub(r'\s+', ' ', text)
+        # Not the space before a ":", which is a descendant combinator in "a :hover".
+        text = re.sub(r' ?([{};,>]) ?', r'\1', text)
+        text = re.sub(r': ', ':', text)
+        return text.replace(';}', '}')
+
+    parts, text, position = [], '', 0
+    for match in _CSS_TOKENS.finditer(css):
+        text += css[position:match.start()]
+        if not match.group().startswith('/*'):
+            parts.extend([squeeze(text), match.group()])
+            text = ''
+        position = match.end()
+    parts.append(squeeze(text + css[position:]))
+
+    return ''.join(parts).strip()
+
+
+def minify_js(js):
+    '''
+    A conservative JavaScript minifier: drops the comments, the indentation and the
+    blank lines. The line breaks stay, so the automatic semicolon insertion still works.
+    Regex literals aren't recognized, so they must not contain quotes or "//".
+    '''
+
+    parts, position = [], 0
+    for match in _JS_TOKENS.finditer(js):
+        token = match.group()
+        parts.append(js[position:match.start()])
+        if not token.startswith(('//', '/*')):
+            parts.append(token)
+        elif '\n' in token:
+            parts.append('\n')
+        position = match.end()
+    parts.append(js[position:])
+
+    lines = (line.strip() for line in ''.join(parts).splitlines())
+    return '\n'.join(line for line in lines if line)
+
+
+def optimize_image(content, extension):
+    '''
+    Re-encodes a PNG/JPEG without changing how it looks (an optimized PNG,
+    a progressive JPEG with the same quantization). Returns None if Pillow
+    isn't installed or the result isn't smaller.
+    '''
+
+    try:
+        from PIL import Image
+    except ImportError:
+        return None
+
+    image = Image.open(io.BytesIO(content))
+    output = io.BytesIO()
+    if extension == '.png':
+        image.save(output, 'PNG', optimize=True)
+    else:
+        image.save(output, 'JPEG', quality='keep', optimize=True, progressive=True)
+
+    optimized = output.getvalue()
+    return optimized if len(optimized) < len(content) else None
+
+
+def webp(content):
+    ''' The WebP version of an image, or None if Pillow can't write WebP or it isn't smaller. '''
+
+    try:
+        from PIL import Image, features
+    except ImportError:
+        return None
+    if not features.check('webp'):
+        return None
+
+    image = Image.open(io.BytesIO(content))
+    output = io.BytesIO()
+    image.save(output, 'WEBP', quality=getattr(settings, 'STATIC_WEBP_QUALITY', 80), method=6)
+
+    converted = output.getvalue()
+    return converted if len(converted) < len(content) else None
+
+
+def compress(content):
+    ''' The {suffix: bytes} precompressed versions of the content. '''
+
+    versions = {'.gz': gzip.compress(content, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        versions['.br'] = brotli.compress(content, quality=11)
+
+    return {suffix: data for suffix, data in versions.items() if len(data) < len(content)}
+
+
+def is_own(source_storage):
+    '''
+    Whether the files of the source storage are the project's own (STATICFILES_DIRS).
+    Only they get minified: the simple minifiers can't parse every third-party
+    script (jQuery's regex literals, for one), and those come minified anyway.
+    '''
+
+    location = getattr(source_storage, 'location', None)
+    directories = [entry[1] if isinstance(entry, (list, tuple)) else entry for entry in settings.STATICFILES_DIRS]
+    return location is not None and os.path.abspath(location) in map(os.path.abspath, directories)
+
+
+class PipelineStaticFilesStorage(ManifestStaticFilesStorage):
+    '''
+    ManifestStaticFilesStorage with the minifying and the precompressing described
+    in the module docstring. The sources are shrunk in STATIC_ROOT before they get
+    hashed, so the hashes are the ones of the served bytes.
+    '''
+
+    def stored_name(self, name):
+        # Not built yet: the plain names (served with a short cache lifetime).
+        if not self.hashed_files:
+            return name
+        return super().stored_name(name)
+
+    def post_process(self, paths, dry_run=False, **options):
+        if dry_run:
+            yield from super().post_process(paths, dry_run, **options)
+            return
+
+        for name, (source_storage, path) in paths.items():
+            self.shrink(name, minify=is_own(source_storage))
+
+        # The hashed copies are made from `paths` (the source files), so the
+        # (shrunk) collected copies in STATIC_ROOT take the place of the sources.
+        paths = {name: (self, name) for name in paths}
+
+        for name, hashed_name, processed in super().post_process(paths, dry_run, **options):
+            if isinstance(processed, Exception):
+                yield name, hashed_name, processed
+                continue
+
+            for stored in {name, hashed_name} - {None}:
+                self.write_siblings(stored)
+            yield name, hashed_name, processed
+
+    def shrink(self, name, minify=True):
+        ''' Minifies (with `minify`) or optimizes the collected copy of a file in place. '''
+
+        extension = os.path.splitext(name)[1].lower()
+        if extension not in (MINIFIED if minify else ()) + IMAGES:
+            return
+
+        with self.open(name) as f:
+            content = f.read()
+
+        if extension == '.css':
+            shrunk = minify_css(content.decode('utf-8')).encode('utf-8')
+        elif extension == '.js':
+            shrunk = minify_js(content.decode('utf-8')).encode('utf-8')
+        else:
+            shrunk = optimize_image(content, extension)
+
+        if shrunk is not None and len(shrunk) < len(content):
+            self.delete(name)
+            self._save(name, ContentFile(shrunk))
+
+    def write_siblings(self, name):
+        extension = os.path.splitext(name)[1].lower()
+        if extension not in COMPRESSED + IMAGES:
+            return
+
+        with self.open(name) as f:
+            content = f.read()
+
+        if extension in IMAGES:
+            siblings = {'.webp': webp(content)}
+        elif len(content) >= MIN_COMPRESS_SIZE:
+            siblings = compress(content)
+        else:
+            siblings = {}
+
+        for suffix, data in siblings.items():
+            if data is None:
+                continue
+            if self.exists(name + suffix):
+                self.delete(name + suffix)
+            self._save(name + suffix, ContentFile(data))
+
+
+def is_hashed(path):
+    ''' Whether `path` is one of the content-hashed names (which never change, so they are immutable). '''
+
+    from django.contrib.staticfiles.storage import staticfiles_storage
+
+    return path in getattr(staticfiles_storage, 'hashed_files', {}).values()
+
+
+def pick_variant(request, fullpath):
+    '''
+    The sibling of the file that the request accepts (the WebP version of an image,
+    the brotli or gzip version of a text file) as a (path, content encoding) tuple.
+    '''
+
+    if fullpath.lower().endswith(IMAGES):
+        if 'image/webp' in request.META.get('HTTP_ACCEPT', '') and os.path.exists(fullpath + '.webp'):
+            return fullpath + '.webp', None
+        return fullpath, None
+
+    accepted = request.META.get('HTTP_ACCEPT_ENCODING', '')
+    for suffix, encoding in (('.br', 'br'), ('.gz', 'gzip')):
+        if encoding in accepted and os.path.exists(fullpath + suffix):
+            return fullpath + suffix, encoding
+
+    return fullpath, None
+
+
+def serve(request, path):
+    ''' Serves a file of STATIC_ROOT, see the module docstring. '''
+
+    try:
+        fullpath = safe_join(settings.STATIC_ROOT, path)
+    except ValueError:
+        raise Http404
+    if not os.path.isfile(fullpath):
+        if settings.DEBUG:
+            from django.contrib.staticfiles.views import serve as serve_source
+            return serve_source(request, path)
+        raise Http404
+
+    served, encoding = pick_variant(request, fullpath)
+    stat = os.stat(served)
+    if not was_modified_since(request.META.get('HTTP_IF_MODIFIED_SINCE'), stat.st_mtime):
+        return HttpResponseNotModified()
+
+    content_type = 'image/webp' if served.endswith('.webp') else mimetypes.guess_type(fullpath)[0]
+    response = FileResponse(open(served, 'rb'), content_type=content_type or 'application/octet-stream')
+    response['Last-Modified'] = http_date(stat.st_mtime)
+    response['Content-Length'] = stat.st_size
+    if encoding:
+        response['Content-Encoding'] = encoding
+
+    if is_hashed(path):
+        response['Cache-Control'] = IMMUTABLE
+    else:
+        response['Cache-Control'] = 'public, max-age={}'.format(getattr(settings, 'STATIC_MAX_AGE', 300))
+    patch_vary_headers(response, ('Accept',) if fullpath.lower().endswith(IMAGES) else ('Accept-Encoding',))
+
+    return response
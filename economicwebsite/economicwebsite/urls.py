@@ -13,20 +13,33 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
+import re
+
+from django.conf import settings
 from django.contrib import admin
-from django.urls import path, include
+from django.urls import path, re_path, include
 from django.conf.urls.static import static
 
+from accounts.metrics import metrics_view
+
 from . import views
-from . import settings
+from . import storage
 
 urlpatterns = [
     path('', views.HomeView.as_view(), name='home'),
     path('thanks/', views.ThanksView.as_view(), name='thanks'),
     path('trip_created/', views.TripCreated.as_view(), name='trip_created'),
+    path('metrics', metrics_view, name='metrics'),
     path('admin/', admin.site.urls),
     path('account/', include('accounts.urls'), name=None),
     path('accounts/', include('django.contrib.auth.urls')),
     path('avatar/', include('avatar.urls')),
     path('lazy_tags/', include('lazy_tags.urls')),
 ] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+
+if settings.DEBUG:
+    # The built static files, with far-future caching (see economicwebsite.storage).
+    # In production the web server serves STATIC_ROOT.
+    urlpatterns += [
+        re_path(r'^{}(?P<path>.+)$'.format(re.escape(settings.STATIC_URL.lstrip('/'))), storage.serve),
+    ]
@@ -14,3 +14,7 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'economicwebsite.settings')
 
 application = get_wsgi_application()
+
+# The routing client, the hot routes and the rest of accounts.warmup (WARMUP_ON_START).
+from accounts import warmup
+warmup.on_start()
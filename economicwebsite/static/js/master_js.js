@@ -30,4 +30,99 @@ $(document).ready(function(){
   	$(this).children('.children').slideToggle();
   })
 
+  // Trip forms: country and city suggestions while typing
+  var suggestions = {
+  	'id_country': {field: 'country'},
+  	'id_first_country': {field: 'country'},
+  	'id_second_country': {field: 'country'},
+  	'id_From': {field: 'city', country: ['id_country', 'id_first_country']},
+  	'id_to': {field: 'city', country: ['id_country', 'id_second_country']}
+  };
+
+  $.each(suggestions, function(id, options){
+  	var input = $('#' + id);
+  	if (!input.length || !$('body').data('autocomplete')) {
+  		return;
+  	}
+
+  	var list = $('<datalist>').attr('id', id + '_list').insertAfter(input);
+  	input.attr({'list': list.attr('id'), 'autocomplete': 'off'});
+
+  	input.on('input', function(){
+  		var params = {field: options.field, q: input.val()};
+  		$.each(options.country || [], function(i, countryId){
+  			if ($('#' + countryId).val()) {
+  				params.country = $('#' + countryId).val();
+  			}
+  		});
+  		if (!params.q) {
+  			return;
+  		}
+
+  		$.getJSON($('body').data('autocomplete'), params, function(data){
+  			list.empty();
+  			$.each(data.results, function(i, name){
+  				list.append($('<option>').attr('value', name));
+  			});
+  		});
+  	});
+  });
+
+  // My Trips: a section gets loaded the first time that it is opened
+  $('[data-toggle="collapse"]').click(function(){
+  	var section = $($(this).data('target')).find('.trip-section');
+
+  	if (section.length && !section.data('loaded')) {
+  		section.data('loaded', true);
+  		section.load(section.data('src'));
+  	}
+  });
+
+  // My Trips: the pending trips get their route filled in once the route workers are done with them
+  var accordion = $('#accordionExample[data-status]');
+
+  function routeHtml(trip) {
+  	if (trip.status == 'failed') {
+  		return '<p class="triplate-content"><em>We couldn\'t calculate this trip.</em></p>';
+  	}
+
+  	var hours = parseInt(trip.time.slice(0, 2), 10), minutes = trip.time.slice(3, 5);
+  	return '<p class="triplate-content"><strong>Costs:</strong> ' + trip.money + '€</p>' +
+  		'<p class="triplate-content"><strong>Time:</strong> ' + hours + 'h ' + minutes + 'm</p>' +
+  		'<p class="triplate-content"><strong>Distance:</strong> ' + trip.distance + 'km</p>';
+  }
+
+  if (accordion.length) {
+  	setInterval(function(){
+  		var pending = $('.trip-pending'), ids = {local: [], international: []};
+  		if (!pending.length) {
+  			return;
+  		}
+
+  		pending.each(function(){
+  			ids[$(this).data('kind')].push($(this).data('id'));
+  		});
+
+  		$.getJSON(accordion.data('status'), {local: ids.local.join(','), international: ids.international.join(',')}, function(data){
+  			pending.each(function(){
+  				var trip = (data[$(this).data('kind')] || {})[$(this).data('id')];
+  				if (trip && trip.status != 'pending') {
+  					$(this).removeClass('trip-pending').html(routeHtml(trip));
+  				}
+  			});
+  		});
+  	}, accordion.data('poll'));
+  }
+
+  // My Trips: the next page of a section
+  $(document).on('click', '.trip-section .load-more', function(){
+  	var more = $(this).closest('.trip-section-more');
+
+  	$.get(this.href, function(html){
+  		more.replaceWith(html);
+  	});
+
+  	return false;
+  });
+
 });
\ No newline at end of file